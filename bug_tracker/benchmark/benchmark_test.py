@@ -0,0 +1,80 @@
+from __future__ import absolute_import
+import json
+import shutil
+import sqlite3
+import tempfile
+import os
+
+from unittest import TestCase, main
+from ..models import Repository
+from .run import run
+from .seed import seed
+from .startup import measure_startup, over_budget, LAZY_MODULES
+
+
+class BenchmarkTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.directory, 'benchmark.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_seed(self):
+        sessions = seed(self.db_file, 5, 200, days=30)
+        self.assertEqual([userId for userId, _ in sessions], [1, 2, 3, 4, 5])
+
+        repo = Repository(self.db_file)
+        try:
+            with repo.open() as conn:
+                self.assertTrue(conn.users.authenticateSessionId(*sessions[0]))
+                self.assertEqual(len(conn.issues.list_issues()), 200)
+                statistics = conn.issues.statistics()
+                self.assertTrue(0 < statistics['currentOpen'] < 200)
+                self.assertEqual(conn.issues.check_statistics(), [])
+        finally:
+            repo.close()
+
+        # The same seed gives the same issues
+        other_file = os.path.join(self.directory, 'other.db')
+        seed(other_file, 5, 200, days=30)
+        query = 'SELECT title, creatorId, assigneeId, closed_datetime IS NULL FROM issues ORDER BY id'
+        self.assertEqual(
+            sqlite3.connect(self.db_file).execute(query).fetchall(),
+            sqlite3.connect(other_file).execute(query).fetchall())
+
+    def test_run(self):
+        results = run(sizes=[50], repeat=2, password_iterations=1)
+        json.dumps(results)
+        size = results['sizes'][0]
+        self.assertEqual((size['issues'], size['users']), (50, 10))
+        self.assertEqual(size['repository']['fetch_issue']['count'], 2)
+        self.assertIn('statistics', size['repository'])
+        memory = size['bytesPerIssue']
+        self.assertLess(memory['list_issue_batch'], memory['list_issues'] * 0.5)
+        self.assertIn('GET /issues/{issue_id}', size['routes'])
+        self.assertIn('POST /login', size['routes'])
+
+    def test_startup(self):
+        # Only what's measured is checked here, the budgets being for 'benchmark.startup' on a known machine
+        results = measure_startup(repeat=1)
+        self.assertIn('falcon', results['modules'])
+        self.assertEqual(set(results['modules']) & set(LAZY_MODULES), set())
+        for name in ('import', 'makeApi', 'firstRequest', 'firstResponse'):
+            self.assertEqual(results[name]['count'], 1)
+        self.assertLessEqual(results['import']['median'], results['firstResponse']['median'])
+
+    def test_over_budget(self):
+        results = {
+            'import': {'median': 100.0},
+            'firstResponse': {'median': 200.0},
+            'modules': ['falcon', 'bug_tracker']
+        }
+        self.assertEqual(over_budget(results, import_budget=100, first_response_budget=200), [])
+        self.assertEqual(over_budget(results, import_budget=50, first_response_budget=150), [
+            'import took 100.0ms, over the budget of 50.0ms', 'firstResponse took 200.0ms, over the budget of 150.0ms'])
+        self.assertEqual(over_budget(dict(results, modules=['falcon', 'werkzeug', 'pytz'])), [
+            'Importing the server imported werkzeug, pytz'])
+
+if __name__ == '__main__':
+    main()
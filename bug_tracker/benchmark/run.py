@@ -0,0 +1,248 @@
+from __future__ import absolute_import
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from falcon import testing
+
+from ..models import Repository
+from ..passwords import PasswordHasher, DEFAULT_ITERATIONS
+from ..server import make_api
+from .seed import seed, user_email, PASSWORD
+
+# Issues in the databases benchmarked, each with a user for every hundred issues
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+
+def _summarise(durations):
+    """Summary statistics, in milliseconds, of some durations in seconds."""
+    durations = sorted(durations)
+    count = len(durations)
+    return {
+        'count': count,
+        'min': durations[0] * 1000,
+        'median': durations[count // 2] * 1000,
+        'mean': sum(durations) / count * 1000,
+        'p95': durations[min(count - 1, int(count * 0.95))] * 1000,
+        'max': durations[-1] * 1000
+    }
+
+def _time(operation, repeat):
+    """Time 'repeat' calls of 'operation', which is passed the number of the call."""
+    durations = []
+    for n in range(repeat):
+        start = time.time()
+        operation(n)
+        durations.append(time.time() - start)
+    return _summarise(durations)
+
+
+def _deep_size(obj):
+    """Bytes taken by an object and everything it refers to, counting anything referred to more than once only once."""
+    seen = set()
+    total = 0
+    pending = [obj]
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            pending.extend(obj.keys())
+            pending.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            pending.extend(obj)
+        elif hasattr(obj, '__slots__'):
+            pending.extend(getattr(obj, name) for name in obj.__slots__ if hasattr(obj, name))
+        elif hasattr(obj, '__dict__'):
+            pending.append(obj.__dict__)
+    return total
+
+
+def _succeeding(name, request):
+    """Wrap a request so it fails loudly, rather than timing an error response."""
+    def operation(n):
+        resp = request(n)
+        if resp.status_code >= 400:
+            raise RuntimeError('{} failed with {}: {}'.format(name, resp.status, resp.text))
+    return operation
+
+
+class Benchmark(object):
+    """Times the repository methods and the API's routes against a seeded database."""
+
+    def __init__(self, database_location, sessions, issues, repeat, password_iterations=DEFAULT_ITERATIONS):
+        self._database_location = database_location
+        # The last user is kept for logging in and out, so the others' sessions stay valid
+        self._sessions = sessions[:-1]
+        self._login_email = user_email(len(sessions) - 1)
+        self._issues = issues
+        self._repeat = repeat
+        self._password_iterations = password_iterations
+
+    def _issue_id(self, n):
+        # Spread across the table rather than always the same few
+        return 1 + (n * 7919) % self._issues
+
+    def _session(self, n):
+        return self._sessions[n % len(self._sessions)]
+
+    def repository(self):
+        """Time each repository method, each call in its own transaction as a request would be."""
+        # Sessions are always checked against the database, as the point is to time that
+        repo = Repository(
+            self._database_location, session_cache_ttl=0, hasher=PasswordHasher(iterations=self._password_iterations))
+        try:
+            def call(method):
+                def operation(n):
+                    with repo.open() as conn:
+                        method(conn, n)
+                return operation
+
+            operations = [
+                ('list_issues', lambda conn, n: conn.issues.list_issues(limit=100)),
+                ('list_issues.after', lambda conn, n: conn.issues.list_issues(limit=100, after=self._issue_id(n))),
+                ('list_issues.open', lambda conn, n: conn.issues.list_issues(limit=100, closed=False)),
+                ('list_issues.assignee', lambda conn, n: conn.issues.list_issues(
+                    limit=100, assigneeId=self._session(n)[0])),
+                ('list_issues.all', lambda conn, n: conn.issues.list_issues()),
+                ('list_issue_batch.all', lambda conn, n: conn.issues.list_issue_batch()),
+                ('iter_issues.all', lambda conn, n: sum(1 for _ in conn.issues.iter_issues())),
+                ('fetch_issue', lambda conn, n: conn.issues.fetch_issue(self._issue_id(n))),
+                ('search_issues', lambda conn, n: conn.issues.search_issues('login crash')),
+                ('statistics', lambda conn, n: conn.issues.statistics()),
+                ('create_issue', lambda conn, n: conn.issues.create_issue(
+                    'Benchmark', 'Created by the benchmark', self._session(n)[0])),
+                ('create_issues', lambda conn, n: conn.issues.create_issues(
+                    [('Benchmark', 'Imported by the benchmark')] * 100, self._session(n)[0])),
+                ('update_issue', lambda conn, n: conn.issues.update_issue(
+                    self._issue_id(n), title='Updated by the benchmark', closedFlag=n % 2 == 0)),
+                ('update_issues', lambda conn, n: conn.issues.update_issues(
+                    [(self._issue_id(n + m), {'closedFlag': n % 2 == 0}) for m in range(100)])),
+                ('data_versions', lambda conn, n: conn.data_versions()),
+                ('authenticateSessionId', lambda conn, n: conn.users.authenticateSessionId(*self._session(n))),
+                ('createSessionId', lambda conn, n: conn.users.createSessionId(self._login_email, PASSWORD)),
+                ('listUsers', lambda conn, n: conn.users.listUsers()),
+                ('register', lambda conn, n: conn.users.register('new{}@example.com'.format(n), PASSWORD)),
+            ]
+            return dict((name, _time(call(method), self._repeat)) for name, method in operations)
+        finally:
+            repo.close()
+
+    def memory(self):
+        """Bytes taken per issue by every issue listed, as 'Issue's and as an 'IssueBatch'."""
+        repo = Repository(self._database_location, hasher=PasswordHasher(iterations=self._password_iterations))
+        try:
+            with repo.open() as conn:
+                return {
+                    'list_issues': _deep_size(conn.issues.list_issues()) / float(self._issues),
+                    'list_issue_batch': _deep_size(conn.issues.list_issue_batch()) / float(self._issues)
+                }
+        finally:
+            repo.close()
+
+    def routes(self):
+        """Time each route of the API through the Falcon test client."""
+        app = make_api(
+            self._database_location, migrate_database=False, hash_workers=0,
+            password_iterations=self._password_iterations)
+        try:
+            return self._time_routes(testing.TestClient(app))
+        finally:
+            app.close()
+
+    def _time_routes(self, client):
+        session = dict(zip(('userId', 'sessionId'), self._session(0)))
+        etag = client.simulate_get('/issues', params={'limit': 100}).headers['etag']
+
+        operations = [
+            ('GET /issues?limit=100', lambda n: client.simulate_get('/issues', params={'limit': 100})),
+            ('GET /issues?limit=100&after', lambda n: client.simulate_get(
+                '/issues', params={'limit': 100, 'after': self._issue_id(n)})),
+            ('GET /issues?limit=100 If-None-Match', lambda n: client.simulate_get(
+                '/issues', params={'limit': 100}, headers={'If-None-Match': etag})),
+            ('GET /issues', lambda n: client.simulate_get('/issues')),
+            ('GET /issues?stream', lambda n: client.simulate_get('/issues', params={'stream': 'true'})),
+            ('GET /issues?q', lambda n: client.simulate_get('/issues', params={'q': 'login crash'})),
+            ('GET /issues/{issue_id}', lambda n: client.simulate_get('/issues/{}'.format(self._issue_id(n)))),
+            ('GET /dashboard', lambda n: client.simulate_get('/dashboard')),
+            ('GET /users', lambda n: client.simulate_get('/users')),
+            ('POST /issues', lambda n: client.simulate_post(
+                '/issues', json=dict(session, title='Benchmark', description='Created by the benchmark'))),
+            ('POST /issues/bulk', lambda n: client.simulate_post('/issues/bulk', json=dict(
+                session, issues=[{'title': 'Benchmark', 'description': 'Imported by the benchmark'}] * 100))),
+            ('PUT /issues/{issue_id}', lambda n: client.simulate_put(
+                '/issues/{}'.format(self._issue_id(n)), json=dict(session, closedFlag=n % 2 == 0))),
+            ('PATCH /issues', lambda n: client.simulate_patch('/issues', json=dict(session, issues=[
+                {'id': self._issue_id(n + m), 'fields': {'closedFlag': n % 2 == 0}} for m in range(100)]))),
+            ('POST /login', lambda n: client.simulate_post(
+                '/login', json={'email': self._login_email, 'password': PASSWORD})),
+            ('POST /logout', lambda n: client.simulate_post('/logout', json={'userId': len(self._sessions) + 1})),
+            ('POST /register', lambda n: client.simulate_post(
+                '/register', json={'email': 'route{}@example.com'.format(n), 'password': PASSWORD})),
+        ]
+        return dict((name, _time(_succeeding(name, operation), self._repeat)) for name, operation in operations)
+
+
+def run(sizes=DEFAULT_SIZES, repeat=20, password_iterations=DEFAULT_ITERATIONS):
+    """Seed a database of each size in turn and benchmark it, returning the results ready to be written as JSON."""
+    results = {
+        'started': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'passwordIterations': password_iterations,
+        'sizes': []
+    }
+    for issues in sizes:
+        users = max(10, issues // 100)
+        directory = tempfile.mkdtemp()
+        try:
+            database_location = os.path.join(directory, 'benchmark.db')
+            start = time.time()
+            sessions = seed(
+                database_location, users, issues, hasher=PasswordHasher(iterations=password_iterations))
+            seconds = time.time() - start
+
+            benchmark = Benchmark(database_location, sessions, issues, repeat, password_iterations)
+            results['sizes'].append({
+                'users': users,
+                'issues': issues,
+                'seedSeconds': seconds,
+                'repository': benchmark.repository(),
+                'bytesPerIssue': benchmark.memory(),
+                'routes': benchmark.routes()
+            })
+        finally:
+            shutil.rmtree(directory)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the repository and API against databases of growing size")
+    parser.add_argument('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES),
+                        help="Comma separated numbers of issues to benchmark with")
+    parser.add_argument('--repeat', type=int, default=20,
+                        help="How many times to time each operation")
+    parser.add_argument('--password-iterations', type=int, default=DEFAULT_ITERATIONS,
+                        help="PBKDF2 iterations for the users' passwords")
+    parser.add_argument('--output',
+                        help="File to write the JSON results to, rather than standard output")
+    args = parser.parse_args()
+
+    results = run([int(size) for size in args.sizes.split(',')], args.repeat, args.password_iterations)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        print
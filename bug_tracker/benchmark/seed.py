@@ -0,0 +1,111 @@
+from __future__ import absolute_import
+import argparse
+import os
+import random
+import sqlite3
+from datetime import datetime, timedelta
+
+from ..models import Repository
+from ..passwords import PasswordHasher
+
+# Every seeded user has this password
+PASSWORD = 'benchmark'
+
+# How many issues are inserted per statement
+_CHUNK_SIZE = 1000
+
+_WORDS = (
+    'login page dashboard search button crash slow error timeout email password session list filter sort export '
+    'import upload download report chart user issue comment link image layout font colour mobile browser cache '
+    'server database query index migration').split()
+
+
+def user_email(n):
+    """The email address of the n'th seeded user (counting from 0)."""
+    return 'user{}@example.com'.format(n)
+
+
+def seed(database_location, users, issues, days=365, seed=0, hasher=None):
+    """Fill a new database with 'users' users and 'issues' issues opened over the last 'days' days.
+
+    Issues are opened at a steady rate. Most are closed again after a time that's usually a few days but sometimes
+    weeks, leaving a backlog of open ones; some are unassigned. Every user is logged in, with a session that lasts a
+    day. The same 'seed' always gives the same data.
+
+    Returns the (user id, session id) of each user.
+    """
+    rng = random.Random(seed)
+    hasher = hasher if hasher is not None else PasswordHasher()
+    repo = Repository(database_location, pool_size=1, hasher=hasher)
+    repo.migrate_database()
+    try:
+        db = sqlite3.connect(database_location)
+        try:
+            with db:
+                # Hashing is slow, and deliberately so, but all the users can share the one hash
+                hashedPassword = hasher.hash(PASSWORD)
+                sessions = [(n + 1, '{:032x}'.format(rng.getrandbits(128))) for n in range(users)]
+                db.executemany(
+                    """INSERT INTO users(id, email, password, uuid, expiresAt)
+                        VALUES (?, ?, ?, ?, DATETIME('now', '+1 day'))""",
+                    [(userId, user_email(userId - 1), hashedPassword, sessionId) for userId, sessionId in sessions])
+
+                now = datetime.utcnow().replace(microsecond=0)
+                start = now - timedelta(days=days)
+                step = timedelta(days=days) / max(issues, 1)
+                rows = []
+                for n in range(issues):
+                    opened = start + step * n
+                    closed = None
+                    if rng.random() < 0.85:
+                        closed = opened + timedelta(hours=rng.expovariate(1.0 / (24 * 4)))
+                        if closed > now:
+                            closed = None
+                    assignee = rng.randint(1, users) if rng.random() < 0.7 else None
+                    rows.append((
+                        ' '.join(rng.sample(_WORDS, 4)).capitalize(),
+                        ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(10, 60))),
+                        str(opened.replace(microsecond=0)),
+                        str(closed.replace(microsecond=0)) if closed is not None else None,
+                        rng.randint(1, users),
+                        assignee))
+                    if len(rows) == _CHUNK_SIZE:
+                        _insert_issues(db, rows)
+                        rows = []
+                _insert_issues(db, rows)
+        finally:
+            db.close()
+
+        # The issues were inserted as history so the statistics are brought up to date in one go
+        with repo.open() as conn:
+            conn.issues.check_statistics()
+        return sessions
+    finally:
+        repo.close()
+
+
+def _insert_issues(db, rows):
+    db.executemany(
+        """INSERT INTO issues(title, description, opened_datetime, closed_datetime, creatorId, assigneeId)
+            VALUES (?, ?, ?, ?, ?, ?)""",
+        rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fill a new database with users and issues for benchmarking")
+    parser.add_argument('--database-location', required=True,
+                        help="Where to create the database")
+    parser.add_argument('--users', type=int, default=100,
+                        help="How many users")
+    parser.add_argument('--issues', type=int, default=10000,
+                        help="How many issues")
+    parser.add_argument('--days', type=int, default=365,
+                        help="How many days the issues were opened over")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Random seed")
+    args = parser.parse_args()
+    if os.path.exists(args.database_location):
+        parser.error("{} already exists".format(args.database_location))
+
+    seed(args.database_location, args.users, args.issues, args.days, args.seed)
+    print "Seeded {} with {} users and {} issues".format(args.database_location, args.users, args.issues)
@@ -0,0 +1,108 @@
+from __future__ import absolute_import
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from ..models import Repository
+from .run import _summarise
+
+# Milliseconds a fresh process may take to import the server, and to then answer its first request
+DEFAULT_IMPORT_BUDGET = 250.0
+DEFAULT_FIRST_RESPONSE_BUDGET = 500.0
+
+# Modules the server only needs once it's doing something in particular, so shouldn't be imported with it
+LAZY_MODULES = ('argparse', 'dateutil', 'multiprocessing', 'pytz', 'werkzeug')
+
+# Run in a fresh interpreter, so nothing is already imported
+_CHILD = """
+import json, sys, time
+before = set(sys.modules)
+start = time.time()
+from bug_tracker.server import make_api
+imported = time.time()
+imported_modules = sorted(set(name.split('.')[0] for name in set(sys.modules) - before if sys.modules[name] is not None))
+
+app = make_api(sys.argv[1])
+made = time.time()
+from wsgiref.util import setup_testing_defaults
+environ = {'PATH_INFO': '/users'}
+setup_testing_defaults(environ)
+status = []
+body = b''.join(app(environ, lambda s, headers, exc_info=None: status.append(s)))
+responded = time.time()
+app.close()
+if not status[0].startswith('200'):
+    raise RuntimeError('GET /users failed with {}: {}'.format(status[0], body))
+json.dump({
+    'import': imported - start,
+    'makeApi': made - imported,
+    'firstRequest': responded - made,
+    'firstResponse': responded - start,
+    'modules': imported_modules
+}, sys.stdout)
+"""
+
+
+def _measure(database_location):
+    package_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+    output = subprocess.check_output([sys.executable, '-c', _CHILD, database_location], cwd=package_dir)
+    return json.loads(output)
+
+def measure_startup(repeat=5):
+    """Time importing the server, making its API and answering a first request, each in a new process.
+
+    Returns the timings in milliseconds, from the time the import started, and the packages the import pulled in.
+    """
+    directory = tempfile.mkdtemp()
+    try:
+        # Already migrated, as it is when a worker is restarted
+        database_location = os.path.join(directory, 'startup.db')
+        repo = Repository(database_location, pool_size=1)
+        try:
+            repo.migrate_database()
+        finally:
+            repo.close()
+
+        runs = [_measure(database_location) for _ in range(repeat)]
+    finally:
+        shutil.rmtree(directory)
+    results = dict((name, _summarise([run[name] for run in runs]))
+                   for name in ('import', 'makeApi', 'firstRequest', 'firstResponse'))
+    results['modules'] = runs[0]['modules']
+    return results
+
+def over_budget(results, import_budget=DEFAULT_IMPORT_BUDGET, first_response_budget=DEFAULT_FIRST_RESPONSE_BUDGET):
+    """Describe whatever in some startup timings is over budget, comparing the median of each."""
+    problems = []
+    for name, budget in (('import', import_budget), ('firstResponse', first_response_budget)):
+        median = results[name]['median']
+        if median > budget:
+            problems.append('{} took {:.1f}ms, over the budget of {:.1f}ms'.format(name, median, budget))
+    lazy = [module for module in results['modules'] if module in LAZY_MODULES]
+    if lazy:
+        problems.append('Importing the server imported {}'.format(', '.join(lazy)))
+    return problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Time starting the server in a new process, failing if it's over budget")
+    parser.add_argument('--repeat', type=int, default=5,
+                        help="How many processes to time")
+    parser.add_argument('--import-budget', type=float, default=DEFAULT_IMPORT_BUDGET,
+                        help="Milliseconds importing the server may take")
+    parser.add_argument('--first-response-budget', type=float, default=DEFAULT_FIRST_RESPONSE_BUDGET,
+                        help="Milliseconds from importing the server to its first response")
+    args = parser.parse_args()
+
+    results = measure_startup(args.repeat)
+    json.dump(results, sys.stdout, indent=2, sort_keys=True)
+    print
+    problems = over_budget(results, args.import_budget, args.first_response_budget)
+    for problem in problems:
+        print problem
+    sys.exit(1 if problems else 0)
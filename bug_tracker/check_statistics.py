@@ -0,0 +1,34 @@
+from __future__ import absolute_import
+import argparse
+import os
+import sys
+
+from .models import Repository
+
+
+def check_statistics(database_location):
+    """Recount the dashboard statistics, printing and correcting anything wrong. Returns whether all was well."""
+    repo = Repository(database_location, pool_size=1)
+    try:
+        with repo.open() as conn:
+            problems = conn.issues.check_statistics()
+    finally:
+        repo.close()
+    for problem in problems:
+        print problem
+    if problems:
+        print "Corrected {} inconsistent statistics".format(len(problems))
+    else:
+        print "Statistics are consistent"
+    return not problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Rebuild the dashboard statistics kept by the database triggers, reporting any that were wrong")
+    parser.add_argument('--database-location',
+                        default=os.path.join(
+                            os.path.dirname(__file__), '..', 'database.db'
+                        ), help="Where the database is stored")
+    args = parser.parse_args()
+    sys.exit(0 if check_statistics(args.database_location) else 1)
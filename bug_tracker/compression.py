@@ -0,0 +1,115 @@
+from __future__ import absolute_import
+import zlib
+
+from .resources import MEDIA_NDJSON
+from .static import _accepted_encodings
+
+# Media types worth compressing
+COMPRESSIBLE_TYPES = ('application/json', MEDIA_NDJSON)
+
+# Responses with a length smaller than this many bytes are sent as they are
+DEFAULT_MIN_SIZE = 1024
+
+DEFAULT_LEVEL = 6
+
+# zlib's window bits for writing a gzip header and trailer
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def _header(headers, name):
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+def _compressed_headers(headers):
+    """The headers for the gzipped version of a response, without a Content-Length.
+
+    Any ETag is left as it is, so it must already differ by Accept-Encoding (as the resources' ETags do), or a 304 would
+    have a different tag to the 200 it stands for. Compressing the same body the same way always gives the same bytes.
+    """
+    compressed = []
+    vary = None
+    for name, value in headers:
+        lower = name.lower()
+        if lower == 'content-length':
+            continue
+        if lower == 'vary':
+            vary = value
+            if 'accept-encoding' not in [field.strip().lower() for field in value.split(',')]:
+                value += ', Accept-Encoding'
+        compressed.append((name, value))
+    compressed.append(('Content-Encoding', 'gzip'))
+    if vary is None:
+        compressed.append(('Vary', 'Accept-Encoding'))
+    return compressed
+
+def gzip_middleware(app, level=DEFAULT_LEVEL, min_size=DEFAULT_MIN_SIZE):
+    """Wrap a WSGI application to gzip its JSON responses for clients accepting that.
+
+    Responses with a Content-Length are compressed whole (if at least 'min_size' bytes) and given the compressed
+    length. Streamed responses are compressed as they go, each part of the body flushed through as it comes.
+    """
+    def handler(environ, start_response):
+        accepted = _accepted_encodings(environ.get('HTTP_ACCEPT_ENCODING'))
+        if environ['REQUEST_METHOD'] == 'HEAD' or accepted.get('gzip', accepted.get('*', 0)) <= 0:
+            return app(environ, start_response)
+
+        # Set once the application has started its response, if it's to be compressed
+        started = []
+        buffered = []
+        returned = []
+
+        def compressing_start_response(status, headers, exc_info=None):
+            content_type = (_header(headers, 'content-type') or '').split(';')[0].strip()
+            length = _header(headers, 'content-length')
+            # Only a response started before the application returned its body can still be compressed
+            if (returned or content_type not in COMPRESSIBLE_TYPES or _header(headers, 'content-encoding') is not None
+                    or status[:3] in ('204', '304') or (length is not None and int(length) < min_size)):
+                del started[:]
+                return start_response(status, headers, exc_info)
+
+            if length is not None:
+                # Started once the compressed length is known
+                started[:] = [(status, _compressed_headers(headers), exc_info)]
+                return buffered.append
+            compressor = zlib.compressobj(level, zlib.DEFLATED, _GZIP_WBITS)
+            started[:] = [compressor]
+            write = start_response(status, _compressed_headers(headers), exc_info)
+            return lambda data: write(compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH))
+
+        body = app(environ, compressing_start_response)
+        returned.append(True)
+        if not started:
+            return body
+        if isinstance(started[0], tuple):
+            try:
+                data = b''.join(buffered + list(body))
+            finally:
+                if hasattr(body, 'close'):
+                    body.close()
+            compressor = zlib.compressobj(level, zlib.DEFLATED, _GZIP_WBITS)
+            data = compressor.compress(data) + compressor.flush()
+            status, headers, exc_info = started[0]
+            start_response(status, headers + [('Content-Length', str(len(data)))], exc_info)
+            return [data]
+        return _GzippedBody(body, started[0])
+    return handler
+
+class _GzippedBody(object):
+    """A streamed response body, gzipped a part at a time."""
+
+    def __init__(self, body, compressor):
+        self._body = body
+        self._compressor = compressor
+
+    def __iter__(self):
+        for part in self._body:
+            if part:
+                # Flushed so each part reaches the client as soon as it would have uncompressed
+                yield self._compressor.compress(part) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield self._compressor.flush()
+
+    def close(self):
+        if hasattr(self._body, 'close'):
+            self._body.close()
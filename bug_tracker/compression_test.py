@@ -0,0 +1,105 @@
+from __future__ import absolute_import
+import json
+import os
+import tempfile
+import zlib
+
+from falcon import testing
+from unittest import TestCase, main
+from .compression import gzip_middleware, DEFAULT_MIN_SIZE
+from .server import make_api
+
+
+def _gunzip(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+def _json_app(body, headers=(), content_type='application/json'):
+    def app(environ, start_response):
+        start_response('200 OK', [('Content-Type', content_type), ('Content-Length', str(len(body)))] + list(headers))
+        return [body]
+    return app
+
+def _streaming_app(parts):
+    def app(environ, start_response):
+        start_response('200 OK', [('Content-Type', 'application/x-ndjson')])
+        return iter(parts)
+    return app
+
+
+class GzipMiddlewareTest(TestCase):
+    def get(self, app, accept_encoding='gzip, deflate', **kwargs):
+        headers = {'Accept-Encoding': accept_encoding} if accept_encoding is not None else {}
+        return testing.simulate_get(gzip_middleware(app, **kwargs), '/', headers=headers)
+
+    def test_large_json_compressed(self):
+        body = json.dumps([{'title': 'Issue {}'.format(n)} for n in range(200)])
+        resp = self.get(_json_app(body, [('ETag', '"abc"')]))
+        self.assertEqual(resp.headers['content-encoding'], 'gzip')
+        self.assertEqual(resp.headers['vary'], 'Accept-Encoding')
+        self.assertEqual(resp.headers['etag'], '"abc"')
+        self.assertEqual(self.get(_json_app(body, [('Vary', 'Origin')])).headers['vary'], 'Origin, Accept-Encoding')
+        self.assertEqual(
+            self.get(_json_app(body, [('Vary', 'accept-encoding')])).headers['vary'], 'accept-encoding', 'Not repeated')
+        self.assertEqual(int(resp.headers['content-length']), len(resp.content))
+        self.assertLess(len(resp.content), len(body))
+        self.assertEqual(_gunzip(resp.content), body)
+
+        # The level is up to the caller
+        fastest = self.get(_json_app(body), level=1)
+        self.assertEqual(_gunzip(fastest.content), body)
+
+    def test_left_alone(self):
+        body = json.dumps(['x' * DEFAULT_MIN_SIZE])
+        for resp in (
+                self.get(_json_app(body), accept_encoding=None),
+                self.get(_json_app(body), accept_encoding='gzip;q=0, identity'),
+                self.get(_json_app('{"small": true}')),
+                self.get(_json_app(body, content_type='image/png')),
+                self.get(_json_app(body, [('Content-Encoding', 'br')]))):
+            self.assertNotEqual(resp.headers.get('content-encoding'), 'gzip')
+            self.assertIn(resp.content, (body, '{"small": true}'))
+
+    def test_streamed(self):
+        parts = ['{"id": %d}\n' % n for n in range(100)]
+        compressed = list(gzip_middleware(_streaming_app(parts))(
+            {'REQUEST_METHOD': 'GET', 'HTTP_ACCEPT_ENCODING': 'gzip'}, lambda status, headers, exc_info=None: None))
+        self.assertEqual(len(compressed), len(parts) + 1, 'Each part should be flushed through')
+
+        # Each part can be decompressed as soon as it arrives
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.assertEqual(decompressor.decompress(compressed[0]), parts[0])
+        self.assertEqual(''.join([decompressor.decompress(part) for part in compressed[1:]]), ''.join(parts[1:]))
+
+        resp = self.get(_streaming_app(parts))
+        self.assertEqual(resp.headers['content-encoding'], 'gzip')
+        self.assertNotIn('content-length', resp.headers)
+        self.assertEqual(_gunzip(resp.content), ''.join(parts))
+
+    def test_api(self):
+        db_file = tempfile.mktemp()
+        self.addCleanup(os.remove, db_file)
+        app = make_api(db_file, hash_workers=0, password_iterations=1)
+        self.addCleanup(app.close)
+        client = testing.TestClient(app)
+        for n in range(50):
+            client.simulate_post('/register', json={'email': 'user{}@example.com'.format(n), 'password': 'garfield'})
+
+        plain = client.simulate_get('/users')
+        resp = client.simulate_get('/users', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(resp.headers['content-encoding'], 'gzip')
+        self.assertEqual(json.loads(_gunzip(resp.content)), plain.json)
+
+        # Each coding is its own representation, with the same ETag on a 304 as on the 200
+        self.assertNotEqual(resp.headers['etag'], plain.headers['etag'])
+        not_modified = client.simulate_get(
+            '/users', headers={'Accept-Encoding': 'gzip', 'If-None-Match': resp.headers['etag']})
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.headers['etag'], resp.headers['etag'])
+        # Whatever the coding, the response depends on Accept-Encoding, which caches have to be told even on a 304
+        for response in (plain, resp, not_modified):
+            self.assertEqual(response.headers['vary'], 'Accept-Encoding')
+        self.assertEqual(client.simulate_get(
+            '/users', headers={'If-None-Match': resp.headers['etag']}).status_code, 200)
+
+if __name__ == '__main__':
+    main()
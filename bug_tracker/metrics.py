@@ -0,0 +1,168 @@
+from __future__ import absolute_import
+import threading
+import time
+from bisect import bisect_left
+
+# Upper bounds of the buckets for request and SQL durations, in seconds
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds of the buckets for the number of SQL statements run for a request
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# What requests which didn't match a route, such as for static files, are recorded as
+UNMATCHED_ROUTE = 'other'
+
+_ROUTE_KEY = 'bug_tracker.route'
+
+
+def _format_labels(labels):
+    return ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels)
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Histogram(object):
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0
+
+    def observe(self, value):
+        self._counts[bisect_left(self._buckets, value)] += 1
+        self._sum += value
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self._buckets + ('+Inf', ), self._counts):
+            cumulative += count
+            yield '{}_bucket{{{}}} {}'.format(name, _format_labels(labels + [('le', bound)]), cumulative)
+        yield '{}_sum{{{}}} {}'.format(name, _format_labels(labels), _format_value(self._sum))
+        yield '{}_count{{{}}} {}'.format(name, _format_labels(labels), cumulative)
+
+class Metrics(object):
+    """Request counts, latencies and SQL use for each route, for exposing in the Prometheus text format.
+
+    'middleware' wraps the WSGI application to time each request, 'component' is the Falcon middleware component that
+    tells it which route each request matched, and 'statement_listener' is given to the repository so the SQL run for
+    each request is counted. Requests are recorded once their response has been completely sent.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Keyed by (method, route, status)
+        self._requests = {}
+        # Keyed by (method, route)
+        self._durations = {}
+        self._statements = {}
+        self._sql_durations = {}
+        # The [statement count, SQL seconds] of the request being handled by this thread
+        self._current = threading.local()
+        self._collectors = []
+        self.component = _RouteComponent()
+
+    def add_collector(self, collect):
+        """Include more metrics in those rendered, 'collect' giving a list of (name, type, description, value) for them
+        each time.
+        """
+        self._collectors.append(collect)
+
+    def statement_listener(self, sql, parameters, seconds, rows):
+        current = getattr(self._current, 'request', None)
+        if current is not None:
+            current[0] += 1
+            current[1] += seconds
+
+    def middleware(self, app):
+        def handler(environ, start_response):
+            current = [0, 0.0]
+            self._current.request = current
+            status = []
+
+            def recording_start_response(status_line, headers, exc_info=None):
+                status[:] = [status_line.split(' ', 1)[0]]
+                return start_response(status_line, headers, exc_info)
+
+            start = time.time()
+
+            def finished():
+                self._current.request = None
+                self._record(
+                    environ['REQUEST_METHOD'], environ.get(_ROUTE_KEY) or UNMATCHED_ROUTE,
+                    status[0] if status else '500', time.time() - start, current[0], current[1])
+
+            try:
+                body = app(environ, recording_start_response)
+            except Exception:
+                finished()
+                raise
+            return _RecordedBody(body, finished)
+        return handler
+
+    def render(self):
+        """All the metrics in the Prometheus text exposition format."""
+        with self._lock:
+            lines = [
+                '# HELP bug_tracker_requests_total Requests handled, by route and status code.',
+                '# TYPE bug_tracker_requests_total counter'
+            ]
+            for (method, route, status), count in sorted(self._requests.items()):
+                lines.append('bug_tracker_requests_total{{{}}} {}'.format(
+                    _format_labels([('method', method), ('route', route), ('status', status)]), count))
+
+            for name, histograms, description in (
+                    ('bug_tracker_request_duration_seconds', self._durations,
+                     'Time taken to handle requests, by route.'),
+                    ('bug_tracker_request_sql_statements', self._statements,
+                     'SQL statements run for each request, by route.'),
+                    ('bug_tracker_request_sql_duration_seconds', self._sql_durations,
+                     'Time spent running SQL statements and fetching their rows for each request, by route.')):
+                lines.append('# HELP {} {}'.format(name, description))
+                lines.append('# TYPE {} histogram'.format(name))
+                for (method, route), histogram in sorted(histograms.items()):
+                    lines.extend(histogram.lines(name, [('method', method), ('route', route)]))
+
+        for collect in self._collectors:
+            for name, kind, description, value in collect():
+                lines.append('# HELP {} {}'.format(name, description))
+                lines.append('# TYPE {} {}'.format(name, kind))
+                lines.append('{} {}'.format(name, _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+    def _record(self, method, route, status, seconds, statements, sql_seconds):
+        key = (method, route)
+        with self._lock:
+            self._requests[key + (status, )] = self._requests.get(key + (status, ), 0) + 1
+            if key not in self._durations:
+                self._durations[key] = _Histogram(DURATION_BUCKETS)
+                self._statements[key] = _Histogram(STATEMENT_BUCKETS)
+                self._sql_durations[key] = _Histogram(DURATION_BUCKETS)
+            self._durations[key].observe(seconds)
+            self._statements[key].observe(statements)
+            self._sql_durations[key].observe(sql_seconds)
+
+class _RouteComponent(object):
+    """Notes the template of the route each request matched, for the metrics middleware."""
+
+    def process_resource(self, req, resp, resource, params):
+        req.env[_ROUTE_KEY] = req.uri_template
+
+class _RecordedBody(object):
+    """Passes a response body through, calling 'finished' once the server has closed it."""
+
+    def __init__(self, body, finished):
+        self._body = body
+        self._finished = finished
+
+    def __iter__(self):
+        return iter(self._body)
+
+    def close(self):
+        finished, self._finished = self._finished, None
+        try:
+            if hasattr(self._body, 'close'):
+                self._body.close()
+        finally:
+            if finished is not None:
+                finished()
@@ -0,0 +1,59 @@
+from __future__ import absolute_import
+
+from unittest import TestCase, main
+from .metrics import Metrics
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def _request(self, path, route, status, statements=0, body=('OK', )):
+        def app(environ, start_response):
+            if route is not None:
+                environ['bug_tracker.route'] = route
+            for _ in range(statements):
+                self.metrics.statement_listener('SELECT 1', (), 0.5, 1)
+            start_response(status, [])
+            return list(body)
+
+        response = self.metrics.middleware(app)(
+            {'REQUEST_METHOD': 'GET', 'PATH_INFO': path}, lambda status, headers, exc_info=None: None)
+        content = ''.join(response)
+        response.close()
+        return content
+
+    def test_requests_recorded_by_route(self):
+        self.assertEqual(self._request('/issues/1', '/issues/{issue_id}', '200 OK', statements=2), 'OK')
+        self._request('/issues/2', '/issues/{issue_id}', '200 OK', statements=3)
+        self._request('/missing', None, '404 Not Found')
+
+        lines = self.metrics.render().splitlines()
+        self.assertIn('bug_tracker_requests_total{method="GET",route="/issues/{issue_id}",status="200"} 2', lines)
+        self.assertIn('bug_tracker_requests_total{method="GET",route="other",status="404"} 1', lines)
+        self.assertIn(
+            'bug_tracker_request_sql_statements_bucket{method="GET",route="/issues/{issue_id}",le="2"} 1', lines)
+        self.assertIn(
+            'bug_tracker_request_sql_statements_bucket{method="GET",route="/issues/{issue_id}",le="5"} 2', lines)
+        self.assertIn('bug_tracker_request_sql_statements_sum{method="GET",route="/issues/{issue_id}"} 5', lines)
+        self.assertIn(
+            'bug_tracker_request_sql_duration_seconds_sum{method="GET",route="/issues/{issue_id}"} 2.5', lines)
+        self.assertIn(
+            'bug_tracker_request_duration_seconds_bucket{method="GET",route="other",le="+Inf"} 1', lines)
+        self.assertIn('# TYPE bug_tracker_request_duration_seconds histogram', lines)
+
+    def test_statements_outside_requests_ignored(self):
+        self.metrics.statement_listener('SELECT 1', (), 1.0, 1)
+        self._request('/issues', '/issues', '200 OK')
+        self.metrics.statement_listener('SELECT 1', (), 1.0, 1)
+        self.assertIn(
+            'bug_tracker_request_sql_statements_sum{method="GET",route="/issues"} 0', self.metrics.render().splitlines())
+
+    def test_labels_escaped(self):
+        self._request('/', 'a "quoted"\\route', '200 OK')
+        self.assertIn(
+            'bug_tracker_requests_total{method="GET",route="a \\"quoted\\"\\\\route",status="200"} 1',
+            self.metrics.render().splitlines())
+
+if __name__ == '__main__':
+    main()
@@ -1,34 +1,103 @@
 from __future__ import absolute_import
 import os
+import re
+import sqlite3
+import sys
+import time
 
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), 'migrations')
 
-def do_migrations(cursor):
-    _ensure_migrations_table(cursor)
-    migrations_dir = os.path.join(os.path.dirname(__file__), 'migrations')
-    for migration in sorted(os.listdir(migrations_dir)):
-        cursor.execute(
-            'SELECT count(*) FROM migrations WHERE filename = ?', [migration]
-        )
-        if cursor.fetchone()[0] == 0:
-            print "Running migration", migration
-            with open(os.path.join(migrations_dir, migration)) as f:
-                cursor.execute(f.read())
-                cursor.execute(
-                    'INSERT INTO migrations(filename) VALUES(?)', [migration]
-                )
-
-
-def _ensure_migrations_table(cursor):
-    cursor.execute(
-        "SELECT count(*) FROM sqlite_master WHERE type='table' AND name='migrations'"
-    )
-    if cursor.fetchone()[0] == 0:
-        cursor.execute("""CREATE TABLE migrations(
-            filename VARCHAR(255) PRIMARY KEY
-        )""")
+# The migration files in each directory, in order, as they're only read once
+_migrations = {}
+
+
+def _migration_files(migrations_dir):
+    files = _migrations.get(migrations_dir)
+    if files is None:
+        # By number, not name, so '100_...' comes after '99_...'
+        files = _migrations[migrations_dir] = sorted(
+            (name for name in os.listdir(migrations_dir) if name.endswith('.sql')), key=_number)
+    return files
+
+def _number(filename):
+    """The number a migration file's name starts with, which is what the database's 'user_version' is set to."""
+    return int(re.match(r'\d+', filename).group())
+
+def _statements(sql):
+    """Split a migration into its statements, including any trigger with several statements of its own."""
+    statement = ''
+    parts = sql.split(';')
+    for part in parts[:-1]:
+        statement += part + ';'
+        if sqlite3.complete_statement(statement):
+            yield statement
+            statement = ''
+    statement += parts[-1]
+    if statement.strip():
+        yield statement
+
+
+def do_migrations(cursor, migrations_dir=MIGRATIONS_DIR):
+    """Apply the migrations not yet applied to the database, returning the (filename, seconds taken) of each.
+
+    The database's 'user_version' is the number of the latest migration applied, so when that's current nothing else is
+    looked at, as it isn't when it's newer (after rolling the code back), which leaves the version as it is. Otherwise
+    all the migrations needed are applied in a single transaction, so if one fails none are.
+    """
+    migrations = _migration_files(migrations_dir)
+    latest = _number(migrations[-1]) if migrations else 0
+    cursor.execute('PRAGMA user_version')
+    if cursor.fetchone()[0] >= latest:
+        return []
+
+    conn = cursor.connection
+    isolation_level = conn.isolation_level
+    # Otherwise the sqlite3 module commits before each statement that isn't an INSERT, UPDATE or DELETE
+    conn.isolation_level = None
+    try:
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            applied = _applied_migrations(cursor)
+            timings = []
+            for migration in migrations:
+                if migration in applied:
+                    continue
+                start = time.time()
+                with open(os.path.join(migrations_dir, migration)) as f:
+                    try:
+                        for statement in _statements(f.read()):
+                            cursor.execute(statement)
+                    except sqlite3.Error:
+                        print >> sys.stderr, "Migration", migration, "failed"
+                        raise
+                cursor.execute('INSERT INTO migrations(filename) VALUES(?)', [migration])
+                timings.append((migration, time.time() - start))
+            cursor.execute('PRAGMA user_version = {:d}'.format(latest))
+            cursor.execute('COMMIT')
+        except BaseException:
+            try:
+                cursor.execute('ROLLBACK')
+            except sqlite3.Error:
+                # SQLite has already rolled back after some errors
+                pass
+            raise
+    finally:
+        conn.isolation_level = isolation_level
+
+    # On stderr, so as not to get mixed up with the output of anything run on a fresh database
+    for migration, seconds in timings:
+        print >> sys.stderr, "Ran migration {} in {:.1f}ms".format(migration, seconds * 1000)
+    return timings
+
+
+def _applied_migrations(cursor):
+    cursor.execute("""CREATE TABLE IF NOT EXISTS migrations(
+        filename VARCHAR(255) PRIMARY KEY
+    )""")
+    cursor.execute('SELECT filename FROM migrations')
+    return set(filename for filename, in cursor.fetchall())
 
 if __name__ == '__main__':
-    import sqlite3
     from . import DATABASE_LOCATION
     with sqlite3.connect(DATABASE_LOCATION) as db:
         cursor = db.cursor()
@@ -0,0 +1,104 @@
+from __future__ import absolute_import
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from unittest import TestCase, main
+from .migrate_database import do_migrations, MIGRATIONS_DIR, _migration_files, _statements
+
+
+class MigrationsTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.conn = sqlite3.connect(os.path.join(self.directory, 'test.db'))
+
+    def tearDown(self):
+        self.conn.close()
+        shutil.rmtree(self.directory)
+
+    def _migrate(self, migrations_dir=MIGRATIONS_DIR):
+        cursor = self.conn.cursor()
+        try:
+            return do_migrations(cursor, migrations_dir)
+        finally:
+            cursor.close()
+
+    def _migrations_dir(self, migrations):
+        migrations_dir = os.path.join(self.directory, 'migrations')
+        os.mkdir(migrations_dir)
+        for name, sql in migrations.items():
+            with open(os.path.join(migrations_dir, name), 'w') as f:
+                f.write(sql)
+        return migrations_dir
+
+    def _tables(self):
+        return [name for name, in self.conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name").fetchall()]
+
+    def test_applied_once(self):
+        timings = self._migrate()
+        self.assertEqual([migration for migration, _ in timings], _migration_files(MIGRATIONS_DIR))
+        self.assertTrue(all(seconds >= 0 for _, seconds in timings))
+        latest = int(timings[-1][0].split('_')[0])
+        self.assertEqual(self.conn.execute('PRAGMA user_version').fetchone()[0], latest)
+
+        self.assertEqual(self._migrate(), [])
+
+        # A database migrated before the schema version was recorded only gets the migrations it's missing
+        self.conn.execute('PRAGMA user_version = 0')
+        self.conn.execute('DROP TABLE closed_per_day')
+        self.conn.execute("DELETE FROM migrations WHERE filename = '40_create_closed_per_day_table.sql'")
+        self.conn.commit()
+        self.assertEqual(
+            [migration for migration, _ in self._migrate()], ['40_create_closed_per_day_table.sql'])
+        self.assertIn('closed_per_day', self._tables())
+
+    def test_newer_database(self):
+        # As after rolling the code back to before the latest migration
+        self._migrate()
+        self.conn.execute('PRAGMA user_version = 1000')
+        self.assertEqual(self._migrate(), [])
+        self.assertEqual(self.conn.execute('PRAGMA user_version').fetchone()[0], 1000)
+
+    def test_several_statements(self):
+        migrations_dir = self._migrations_dir({
+            '01_create_tables.sql': """
+                /* Two tables; and a comment with a semicolon */
+                CREATE TABLE a(x INTEGER);
+                CREATE TABLE b(y TEXT DEFAULT ';');
+                CREATE TRIGGER a_insert AFTER INSERT ON a
+                BEGIN
+                  INSERT INTO b(y) VALUES (NEW.x);
+                  INSERT INTO b(y) VALUES (NEW.x + 1);
+                END;
+                INSERT INTO a(x) VALUES (1)""",
+        })
+        self._migrate(migrations_dir)
+        self.assertEqual(self.conn.execute('SELECT y FROM b ORDER BY y').fetchall(), [('1', ), ('2', )])
+
+    def test_failure_rolls_everything_back(self):
+        migrations_dir = self._migrations_dir({
+            '01_create_a.sql': 'CREATE TABLE a(x INTEGER);',
+            '02_create_b.sql': 'CREATE TABLE b(y INTEGER); INSERT INTO nowhere VALUES (1);',
+        })
+        with self.assertRaises(sqlite3.OperationalError):
+            self._migrate(migrations_dir)
+        self.assertEqual(self._tables(), [])
+        self.assertEqual(self.conn.execute('PRAGMA user_version').fetchone()[0], 0)
+
+    def test_applied_in_numeric_order(self):
+        migrations_dir = self._migrations_dir({
+            '99_create_a.sql': 'CREATE TABLE a(x INTEGER);',
+            '100_alter_a.sql': 'ALTER TABLE a ADD COLUMN y INTEGER;',
+        })
+        self.assertEqual(
+            [migration for migration, _ in self._migrate(migrations_dir)], ['99_create_a.sql', '100_alter_a.sql'])
+        self.assertEqual(self.conn.execute('PRAGMA user_version').fetchone()[0], 100)
+
+    def test_statements(self):
+        self.assertEqual(list(_statements('SELECT 1; SELECT 2;\n')), ['SELECT 1;', ' SELECT 2;'])
+        self.assertEqual(list(_statements("SELECT ';'")), ["SELECT ';'"])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,2 @@
+/* Keyset pagination of issues filtered by open / closed state */
+CREATE INDEX issues_state_id ON issues((closed_datetime IS NULL), id);
@@ -0,0 +1,2 @@
+/* Keyset pagination of issues filtered by assignee */
+CREATE INDEX issues_assignee_id ON issues(assigneeId, id);
@@ -0,0 +1,2 @@
+/* Keyset pagination of issues filtered by creator */
+CREATE INDEX issues_creator_id ON issues(creatorId, id);
@@ -0,0 +1,2 @@
+/* Keyset pagination of issues filtered by assignee and state */
+CREATE INDEX issues_assignee_state_id ON issues(assigneeId, (closed_datetime IS NULL), id);
@@ -0,0 +1,2 @@
+/* Keyset pagination of issues filtered by creator and state */
+CREATE INDEX issues_creator_state_id ON issues(creatorId, (closed_datetime IS NULL), id);
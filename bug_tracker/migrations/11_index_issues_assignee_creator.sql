@@ -0,0 +1,2 @@
+/* Keyset pagination of issues filtered by assignee and creator */
+CREATE INDEX issues_assignee_creator_id ON issues(assigneeId, creatorId, id);
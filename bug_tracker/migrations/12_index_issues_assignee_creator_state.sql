@@ -0,0 +1,2 @@
+/* Keyset pagination of issues filtered by assignee, creator and state */
+CREATE INDEX issues_assignee_creator_state_id ON issues(assigneeId, creatorId, (closed_datetime IS NULL), id);
@@ -0,0 +1,2 @@
+/* Replaced by 'issue_stats_trigger_update' which only invalidates 'max_open' when it has to */
+DROP TRIGGER issues_trigger_update;
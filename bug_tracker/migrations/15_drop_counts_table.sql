@@ -0,0 +1,2 @@
+/* The cached 'max_open' now lives in 'issue_stats' */
+DROP TABLE cached;
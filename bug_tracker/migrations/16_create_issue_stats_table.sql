@@ -0,0 +1,13 @@
+/**
+ * Running statistics about open issues, kept up to date by the triggers on 'issues'.
+ */
+CREATE TABLE issue_stats(
+  /* There is only ever the one row */
+  id INTEGER PRIMARY KEY CHECK (id = 1),
+  /* The number of issues currently open */
+  open_now INTEGER NOT NULL,
+  /* The maximum number of issues that have ever been open at once, or NULL when it has to be rebuilt */
+  max_open INTEGER,
+  /* The latest opened or closed datetime of any issue. Changes after this can be applied incrementally. */
+  latest DATETIME
+);
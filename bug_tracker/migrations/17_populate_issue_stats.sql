@@ -0,0 +1,8 @@
+/* Start with the maximum needing a rebuild unless there are no issues yet */
+INSERT INTO issue_stats(id, open_now, max_open, latest)
+SELECT
+  1,
+  COUNT(*) - COUNT(closed_datetime),
+  CASE WHEN COUNT(*) = 0 THEN 0 ELSE NULL END,
+  MAX(MAX(opened_datetime), COALESCE(MAX(closed_datetime), ''))
+FROM issues;
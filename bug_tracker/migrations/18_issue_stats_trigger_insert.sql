@@ -0,0 +1,13 @@
+CREATE TRIGGER issue_stats_trigger_insert
+AFTER INSERT ON issues
+BEGIN
+  /* An issue opened no earlier than everything else is open on top of those open now, so the maximum can only go up
+     to include it. Otherwise it's history being rewritten and the maximum has to be rebuilt. */
+  UPDATE issue_stats SET
+    max_open = CASE
+      WHEN latest IS NULL OR NEW.opened_datetime >= latest THEN MAX(max_open, open_now + 1)
+      ELSE NULL
+    END,
+    open_now = open_now + (NEW.closed_datetime IS NULL),
+    latest = MAX(COALESCE(latest, ''), COALESCE(NEW.opened_datetime, ''), COALESCE(NEW.closed_datetime, ''));
+END;
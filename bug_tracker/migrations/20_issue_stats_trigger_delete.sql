@@ -0,0 +1,7 @@
+CREATE TRIGGER issue_stats_trigger_delete
+AFTER DELETE ON issues
+BEGIN
+  UPDATE issue_stats SET
+    max_open = NULL,
+    open_now = open_now - (OLD.closed_datetime IS NULL);
+END;
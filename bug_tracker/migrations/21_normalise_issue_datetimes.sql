@@ -0,0 +1,8 @@
+/* Store every datetime in the one format DATETIME() produces, 'YYYY-MM-DD HH:MM:SS', which has a fast parser and
+   sorts correctly as text. Anything DATETIME() can't interpret is left as it was. */
+UPDATE issues SET
+  opened_datetime = COALESCE(DATETIME(opened_datetime), opened_datetime),
+  closed_datetime = COALESCE(DATETIME(closed_datetime), closed_datetime)
+WHERE
+  opened_datetime IS NOT COALESCE(DATETIME(opened_datetime), opened_datetime)
+  OR closed_datetime IS NOT COALESCE(DATETIME(closed_datetime), closed_datetime);
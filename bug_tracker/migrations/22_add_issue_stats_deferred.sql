@@ -0,0 +1,2 @@
+/* While set, as during a bulk import, inserts leave 'issue_stats' alone and the importer updates it once per batch */
+ALTER TABLE issue_stats ADD COLUMN deferred INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,2 @@
+/* Recreated by the next migration to respect 'issue_stats.deferred' */
+DROP TRIGGER issue_stats_trigger_insert;
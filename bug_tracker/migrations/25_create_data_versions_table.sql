@@ -0,0 +1,8 @@
+/**
+ * A counter for each kind of data, bumped by triggers whenever it changes, so responses built from it can be given
+ * ETags and a client's copy checked as still current without running the queries.
+ */
+CREATE TABLE data_versions(
+  name TEXT PRIMARY KEY,
+  version INTEGER NOT NULL
+);
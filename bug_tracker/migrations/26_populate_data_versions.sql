@@ -0,0 +1 @@
+INSERT INTO data_versions(name, version) VALUES ('issues', 0), ('users', 0);
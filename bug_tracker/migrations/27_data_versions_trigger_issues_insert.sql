@@ -0,0 +1,5 @@
+CREATE TRIGGER data_versions_trigger_issues_insert
+AFTER INSERT ON issues
+BEGIN
+  UPDATE data_versions SET version = version + 1 WHERE name = 'issues';
+END;
@@ -0,0 +1,5 @@
+CREATE TRIGGER data_versions_trigger_issues_update
+AFTER UPDATE ON issues
+BEGIN
+  UPDATE data_versions SET version = version + 1 WHERE name = 'issues';
+END;
@@ -0,0 +1,5 @@
+CREATE TRIGGER data_versions_trigger_users_insert
+AFTER INSERT ON users
+BEGIN
+  UPDATE data_versions SET version = version + 1 WHERE name = 'users';
+END;
@@ -0,0 +1,6 @@
+/* Only the email is ever shown; logging in and out just changes the session columns */
+CREATE TRIGGER data_versions_trigger_users_update
+AFTER UPDATE OF email ON users
+BEGIN
+  UPDATE data_versions SET version = version + 1 WHERE name = 'users';
+END;
@@ -0,0 +1,5 @@
+CREATE TRIGGER data_versions_trigger_users_delete
+AFTER DELETE ON users
+BEGIN
+  UPDATE data_versions SET version = version + 1 WHERE name = 'users';
+END;
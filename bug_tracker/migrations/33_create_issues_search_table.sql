@@ -0,0 +1,10 @@
+/**
+ * Full-text index of the issues' titles and descriptions. The text itself stays in 'issues' (the index reads it from
+ * there by id) and the triggers on 'issues' keep the index up to date.
+ */
+CREATE VIRTUAL TABLE issues_search USING fts5(
+  title,
+  description,
+  content = 'issues',
+  content_rowid = 'id'
+);
@@ -0,0 +1 @@
+INSERT INTO issues_search(issues_search) VALUES ('rebuild');
@@ -0,0 +1,5 @@
+CREATE TRIGGER issues_search_trigger_insert
+AFTER INSERT ON issues
+BEGIN
+  INSERT INTO issues_search(rowid, title, description) VALUES (NEW.id, NEW.title, NEW.description);
+END;
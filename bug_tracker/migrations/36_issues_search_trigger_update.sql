@@ -0,0 +1,7 @@
+CREATE TRIGGER issues_search_trigger_update
+AFTER UPDATE OF title, description ON issues
+BEGIN
+  /* The index has to be told the old text to remove it */
+  INSERT INTO issues_search(issues_search, rowid, title, description) VALUES ('delete', OLD.id, OLD.title, OLD.description);
+  INSERT INTO issues_search(rowid, title, description) VALUES (NEW.id, NEW.title, NEW.description);
+END;
@@ -0,0 +1,5 @@
+CREATE TRIGGER issues_search_trigger_delete
+AFTER DELETE ON issues
+BEGIN
+  INSERT INTO issues_search(issues_search, rowid, title, description) VALUES ('delete', OLD.id, OLD.title, OLD.description);
+END;
@@ -0,0 +1,2 @@
+/* For the dashboard's counts of issues open now and closed recently */
+CREATE INDEX issues_closed ON issues(closed_datetime);
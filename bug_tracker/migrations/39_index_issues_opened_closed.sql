@@ -0,0 +1,2 @@
+/* Covers the sweep through the issues in opened order when the maximum open has to be rebuilt, so it needn't sort */
+CREATE INDEX issues_opened_closed ON issues(opened_datetime, closed_datetime);
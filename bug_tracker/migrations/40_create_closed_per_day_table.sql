@@ -0,0 +1,8 @@
+/**
+ * How many issues were closed on each day, kept up to date by the triggers on 'issues', so counting those closed
+ * recently only has to add up a few days.
+ */
+CREATE TABLE closed_per_day(
+  day DATE PRIMARY KEY,
+  closed INTEGER NOT NULL
+);
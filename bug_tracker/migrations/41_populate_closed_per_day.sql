@@ -0,0 +1,5 @@
+INSERT INTO closed_per_day(day, closed)
+SELECT DATE(closed_datetime), COUNT(*)
+FROM issues
+WHERE closed_datetime IS NOT NULL
+GROUP BY DATE(closed_datetime);
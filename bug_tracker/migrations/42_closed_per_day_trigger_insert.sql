@@ -0,0 +1,7 @@
+CREATE TRIGGER closed_per_day_trigger_insert
+AFTER INSERT ON issues
+WHEN NEW.closed_datetime IS NOT NULL
+BEGIN
+  INSERT INTO closed_per_day(day, closed) VALUES (DATE(NEW.closed_datetime), 1)
+    ON CONFLICT(day) DO UPDATE SET closed = closed + 1;
+END;
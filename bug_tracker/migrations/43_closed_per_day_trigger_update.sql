@@ -0,0 +1,9 @@
+CREATE TRIGGER closed_per_day_trigger_update
+AFTER UPDATE OF closed_datetime ON issues
+WHEN NEW.closed_datetime IS NOT OLD.closed_datetime
+BEGIN
+  /* Neither does anything for an issue that's open, as the day is then NULL */
+  UPDATE closed_per_day SET closed = closed - 1 WHERE day = DATE(OLD.closed_datetime);
+  INSERT INTO closed_per_day(day, closed) SELECT DATE(NEW.closed_datetime), 1 WHERE NEW.closed_datetime IS NOT NULL
+    ON CONFLICT(day) DO UPDATE SET closed = closed + 1;
+END;
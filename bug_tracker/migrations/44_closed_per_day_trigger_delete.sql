@@ -0,0 +1,6 @@
+CREATE TRIGGER closed_per_day_trigger_delete
+AFTER DELETE ON issues
+WHEN OLD.closed_datetime IS NOT NULL
+BEGIN
+  UPDATE closed_per_day SET closed = closed - 1 WHERE day = DATE(OLD.closed_datetime);
+END;
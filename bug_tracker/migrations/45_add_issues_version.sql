@@ -0,0 +1,6 @@
+/**
+ * Set to the new 'issues' data version by every insert and update made through the repository, so it's different
+ * each time a row is written, even for an id reused after a delete, and anything derived from the row can be cached
+ * against it.
+ */
+ALTER TABLE issues ADD COLUMN version INTEGER NOT NULL DEFAULT 0;
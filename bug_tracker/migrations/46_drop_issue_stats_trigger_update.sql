@@ -0,0 +1,2 @@
+/* Recreated by the next migration to keep the maximum when issues close in the same second */
+DROP TRIGGER issue_stats_trigger_update;
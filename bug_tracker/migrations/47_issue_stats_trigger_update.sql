@@ -0,0 +1,19 @@
+CREATE TRIGGER issue_stats_trigger_update
+AFTER UPDATE OF opened_datetime, closed_datetime ON issues
+BEGIN
+  /* Closing an issue later than everything else can't change the maximum, nor can leaving the datetimes alone.
+     Neither can closing it in the same second as the latest change, unless another issue was opened in that second:
+     the rebuild counts closes before opens within a second, so may no longer count this issue as open with it.
+     Anything else means the maximum has to be rebuilt. */
+  UPDATE issue_stats SET
+    max_open = CASE
+      WHEN NEW.opened_datetime IS NOT OLD.opened_datetime THEN NULL
+      WHEN NEW.closed_datetime IS OLD.closed_datetime THEN max_open
+      WHEN OLD.closed_datetime IS NULL AND NEW.closed_datetime > COALESCE(latest, '') THEN max_open
+      WHEN OLD.closed_datetime IS NULL AND NEW.closed_datetime = latest AND NOT EXISTS (
+        SELECT 1 FROM issues WHERE opened_datetime = NEW.closed_datetime AND id != NEW.id) THEN max_open
+      ELSE NULL
+    END,
+    open_now = open_now + (NEW.closed_datetime IS NULL) - (OLD.closed_datetime IS NULL),
+    latest = MAX(COALESCE(latest, ''), COALESCE(NEW.opened_datetime, ''), COALESCE(NEW.closed_datetime, ''));
+END;
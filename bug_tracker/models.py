@@ -1,36 +1,268 @@
 from __future__ import absolute_import
-import dateutil.parser
+import os
 import sqlite3
-import hashlib
-import binascii
 import re
-from collections import namedtuple
-from bisect import bisect_left, bisect_right
-from uuid import uuid4
+import threading
+import time
+from array import array
+from collections import namedtuple, OrderedDict
+from datetime import datetime
+from heapq import heappop, heappush
 
 from .migrate_database import do_migrations
+from .passwords import PasswordHasher
 
 
+# Tuning applied once to each pooled connection when it is first opened
+DEFAULT_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('cache_size', -16000),  # Negative sizes are in KiB rather than pages
+    ('mmap_size', 64 * 1024 * 1024),
+    ('busy_timeout', 5000),  # Milliseconds
+)
+
+class PoolTimeout(Exception):
+    """No pooled connection became free within the allowed wait time."""
+    pass
+
+class ConnectionPool(object):
+    """A bounded pool of SQLite connections which are opened lazily and reused between requests.
+
+    A process forked from one using the pool starts with an empty pool of its own.
+    """
+
+    def __init__(self, connect, size, timeout):
+        self._connect = connect
+        self._size = size
+        self._timeout = timeout
+        self._idle = []
+        self._opened = 0
+        self._available = threading.Condition(threading.Lock())
+        self._pid = os.getpid()
+        # Connections belonging to a parent process
+        self._inherited = []
+        # Set once closed, after which connections are closed as they're returned rather than kept
+        self._closed = False
+
+    def checkout(self):
+        """Take an idle connection, opening a new one if below the limit, otherwise wait for one."""
+        deadline = time.time() + self._timeout
+        with self._available:
+            self._leave_parent()
+            while not self._idle and self._opened >= self._size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise PoolTimeout(
+                        'No database connection became free within {} seconds'.format(self._timeout))
+                self._available.wait(remaining)
+            if self._idle:
+                return self._idle.pop()
+            self._opened += 1
+
+        try:
+            return self._connect()
+        except Exception:
+            self._release_slot()
+            raise
+
+    def checkin(self, conn):
+        """Return a connection, which must not be in a transaction, to the pool."""
+        with self._available:
+            if not self._closed:
+                self._idle.append(conn)
+                self._available.notify()
+                return
+        self.discard(conn)
+
+    def discard(self, conn):
+        """Close a connection that can't safely be reused, freeing its slot."""
+        try:
+            conn.close()
+        finally:
+            self._release_slot()
+
+    def close(self):
+        """Close all the idle connections, and any others once they're returned."""
+        with self._available:
+            self._leave_parent()
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._opened -= len(idle)
+            self._available.notify_all()
+        for conn in idle:
+            conn.close()
+
+    def _release_slot(self):
+        with self._available:
+            self._opened -= 1
+            self._available.notify()
+
+    def _leave_parent(self):
+        # SQLite connections (and their locks) mustn't be carried across a fork, and closing one here could disturb
+        # the parent's, so they're just kept from being garbage collected
+        if self._pid != os.getpid():
+            self._inherited.extend(self._idle)
+            self._idle = []
+            self._opened = 0
+            self._closed = False
+            self._pid = os.getpid()
+
+class _ListenedCursor(object):
+    """A cursor which tells a listener about each statement run on it once its rows have been fetched (or it's
+    closed or run again), with how long running it and fetching its rows took and how many rows there were.
+    """
+
+    def __init__(self, cursor, listener):
+        self._cursor = cursor
+        self._listener = listener
+        self._sql = None
+        self._parameters = None
+        self._seconds = 0.0
+        self._rows = 0
+
+    def execute(self, sql, parameters=()):
+        self._finished()
+        self._sql, self._parameters = sql, parameters
+        self._timed(self._cursor.execute, sql, parameters)
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finished()
+        # Only the first set of parameters is passed on, as an example
+        seq_of_parameters = list(seq_of_parameters)
+        self._sql, self._parameters = sql, seq_of_parameters[0] if seq_of_parameters else None
+        self._timed(self._cursor.executemany, sql, seq_of_parameters)
+        return self
+
+    def fetchone(self):
+        row = self._timed(self._cursor.fetchone)
+        if row is None:
+            self._finished()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(self._cursor.fetchmany, size if size is not None else self._cursor.arraysize)
+        self._rows += len(rows)
+        if not rows:
+            self._finished()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(self._cursor.fetchall)
+        self._rows += len(rows)
+        self._finished()
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def close(self):
+        self._finished()
+        self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _timed(self, method, *args):
+        start = time.time()
+        try:
+            return method(*args)
+        finally:
+            self._seconds += time.time() - start
+
+    def _finished(self):
+        if self._sql is not None:
+            # Rows are either fetched from a query or changed by anything else
+            rows = self._rows if self._cursor.description is not None else max(self._cursor.rowcount, 0)
+            sql, parameters, seconds = self._sql, self._parameters, self._seconds
+            self._sql, self._parameters, self._seconds, self._rows = None, None, 0.0, 0
+            self._listener(sql, parameters, seconds, rows)
+
+class _ListenedConnection(object):
+    """Passes everything through to a connection, but with cursors that tell a listener about each statement."""
+
+    def __init__(self, conn, listener):
+        self._conn = conn
+        self._listener = listener
+
+    def cursor(self):
+        return _ListenedCursor(self._conn.cursor(), self._listener)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
 class Repository(object):
-    def __init__(self, database_location):
+    """Where the issues and users are stored.
+
+    If given, 'statement_listener' is called with the SQL, the parameters, the seconds taken and the number of rows
+    fetched or changed for every statement run through the repository connections. Up to 'issue_cache_size' of the
+    issues most recently fetched are cached (see 'IssueCache').
+    """
+
+    def __init__(self, database_location, pool_size=5, pool_timeout=5.0, pragmas=DEFAULT_PRAGMAS,
+                 session_cache_ttl=30.0, session_flush_interval=10.0, hasher=None, statement_listener=None,
+                 issue_cache_size=1000):
         self._database_location = database_location
+        self._pragmas = pragmas
+        self._pool = ConnectionPool(self._connect, pool_size, pool_timeout)
+        self._sessions = SessionCache(session_cache_ttl, session_flush_interval) if session_cache_ttl > 0 else None
+        self._hasher = hasher if hasher is not None else PasswordHasher()
+        self._statement_listener = statement_listener
+        self._issues = IssueCache(issue_cache_size) if issue_cache_size > 0 else None
 
     def open(self):
-        return RepositoryConnection(sqlite3.connect(self._database_location))
+        return RepositoryConnection(
+            self._pool.checkout(), self._pool, self._sessions, self._hasher, self._statement_listener, self._issues)
+
+    def issue_cache_statistics(self):
+        """The issue cache's 'hits', 'misses', 'evictions' and current 'size', or None if issues aren't cached."""
+        return self._issues.statistics() if self._issues is not None else None
+
+    def close(self):
+        """Write any pending session expiry extensions then close the pooled connections and hashing workers.
+
+        Any connections still checked out are closed when returned.
+        """
+        if self._sessions is not None:
+            with self.open() as repo:
+                repo.users.flushSessions()
+        self._pool.close()
+        self._hasher.close()
 
     def migrate_database(self):
-        with sqlite3.connect(self._database_location) as conn:
-            cursor = conn.cursor()
-            try:
-                do_migrations(cursor)
-            finally:
-                cursor.close()
+        conn = sqlite3.connect(self._database_location)
+        try:
+            with conn:
+                cursor = conn.cursor()
+                try:
+                    do_migrations(cursor)
+                finally:
+                    cursor.close()
+        finally:
+            # Closed now rather than whenever it's collected, so a server can fork straight after migrating
+            conn.close()
+
+    def _connect(self):
+        # Pooled connections are handed between request threads, though only ever used by one at a time
+        conn = sqlite3.connect(self._database_location, check_same_thread=False)
+        for name, value in self._pragmas:
+            conn.execute('PRAGMA {} = {}'.format(name, value)).fetchall()
+        return conn
 
 class RepositoryConnection(object):
-    def __init__(self, conn):
+    def __init__(self, conn, pool=None, sessions=None, hasher=None, statement_listener=None, issue_cache=None):
         self._conn = conn
-        self.issues = IssueRepository(self._conn)
-        self.users = UserRepository(self._conn)
+        self._pool = pool
+        queries = _ListenedConnection(conn, statement_listener) if statement_listener is not None else conn
+        self.issues = IssueRepository(queries, issue_cache)
+        self.users = UserRepository(queries, sessions, hasher)
+        self._queries = queries
 
     def __enter__(self):
         return self
@@ -38,204 +270,479 @@ class RepositoryConnection(object):
     def __exit__(self, exc, type_, tb):
         try:
             self._conn.__exit__(exc, type_, tb)
-        finally:
-            self._conn.close()
+        except Exception:
+            self._release(reusable=False)
+            raise
+        self._release(reusable=True)
+
+    def commit(self):
+        """Commit the changes so far, e.g. to split up a large amount of work into several transactions."""
+        self._conn.commit()
+
+    def data_versions(self):
+        """The version of each kind of data ('issues' and 'users'), which goes up whenever any of that data changes."""
+        return dict(self._queries.execute('SELECT name, version FROM data_versions').fetchall())
 
     def close(self):
-        self._conn.close()
+        try:
+            self._conn.rollback()
+        except sqlite3.Error:
+            self._release(reusable=False)
+            raise
+        self._release(reusable=True)
+
+    def _release(self, reusable):
+        """Hand the connection back to the pool (or close it if not pooled). Safe to call more than once."""
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        if self._pool is None:
+            conn.close()
+        elif reusable:
+            self._pool.checkin(conn)
+        else:
+            self._pool.discard(conn)
 
-Issue = namedtuple('Issue', ['id', 'title', 'description', 'opened', 'closed', 'createdBy', 'assignedTo' ])
+Issue = namedtuple('Issue', ['id', 'title', 'description', 'opened', 'closed', 'createdBy', 'assignedTo', 'version' ])
 
 def _parseDatetime(datetimeStr):
+    """Parse a stored datetime.
+
+    These are normally as produced by SQLite's DATETIME(), 'YYYY-MM-DD HH:MM:SS', perhaps with microseconds from Python,
+    which are picked apart directly. Only anything else goes to the (much slower) general purpose parser.
+    """
     if datetimeStr is None:
         return None
+    length = len(datetimeStr)
+    if (length == 19 or (length == 26 and datetimeStr[19] == '.')) and datetimeStr[4] == '-' and datetimeStr[13] == ':':
+        try:
+            return datetime(
+                int(datetimeStr[0:4]), int(datetimeStr[5:7]), int(datetimeStr[8:10]),
+                int(datetimeStr[11:13]), int(datetimeStr[14:16]), int(datetimeStr[17:19]),
+                int(datetimeStr[20:26]) if length == 26 else 0
+            )
+        except ValueError:
+            pass
+    # Imported only when needed, as it's slow to import and almost every datetime takes the path above
+    import dateutil.parser
     return dateutil.parser.parse(datetimeStr)
 
 def make_issue(row):
-    id_, title, description, opened, closed, createdBy, assignedTo = row
+    id_, title, description, opened, closed, createdBy, assignedTo, version = row
     opened = _parseDatetime(opened)
     closed = _parseDatetime(closed)
-    return Issue(id_, title, description, opened, closed, createdBy, assignedTo)
+    return Issue(id_, title, description, opened, closed, createdBy, assignedTo, version)
+
+def _encode(text):
+    return text.encode('utf-8') if text is not None else None
+
+def _decode(text):
+    return text.decode('utf-8') if text is not None else None
+
+class IssueBatch(object):
+    """Issues stored a column at a time, taking much less memory than a list of 'Issue's, and only turned back into
+    unicode and datetimes for the issues taken out of it.
+
+    Indexing gives an 'Issue', or another batch for a slice. The columns can also be used directly: 'ids' and
+    'versions' are arrays, 'titles' and 'descriptions' lists of UTF-8 encoded strings (a quarter of the size of
+    unicode in a wide build), 'opened' and 'closed' lists of the datetimes as stored (as byte strings) and 'createdBy'
+    and 'assignedTo' lists of emails.
+    """
+
+    _COLUMNS = ('ids', 'titles', 'descriptions', 'opened', 'closed', 'createdBy', 'assignedTo', 'versions')
+    __slots__ = _COLUMNS + ('_emails', )
+
+    def __init__(self):
+        self.ids = array('l')
+        self.titles = []
+        self.descriptions = []
+        self.opened = []
+        self.closed = []
+        self.createdBy = []
+        self.assignedTo = []
+        self.versions = array('l')
+        # The same few emails come up again and again, so only one copy of each is kept
+        self._emails = {}
+
+    def extend(self, rows):
+        """Add rows of the columns needed by 'make_issue'."""
+        if not rows:
+            return
+        ids, titles, descriptions, opened, closed, createdBy, assignedTo, versions = zip(*rows)
+        self.ids.extend(ids)
+        self.titles.extend(_encode(text) for text in titles)
+        self.descriptions.extend(_encode(text) for text in descriptions)
+        self.opened.extend(_encode(text) for text in opened)
+        self.closed.extend(_encode(text) for text in closed)
+        emails = self._emails
+        self.createdBy.extend(emails.setdefault(email, email) for email in createdBy)
+        self.assignedTo.extend(emails.setdefault(email, email) for email in assignedTo)
+        self.versions.extend(versions)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            batch = IssueBatch()
+            for column in IssueBatch._COLUMNS:
+                setattr(batch, column, getattr(self, column)[index])
+            batch._emails = self._emails
+            return batch
+        return Issue(
+            self.ids[index], _decode(self.titles[index]), _decode(self.descriptions[index]),
+            _parseDatetime(self.opened[index]), _parseDatetime(self.closed[index]), self.createdBy[index],
+            self.assignedTo[index], self.versions[index])
+
+    def __iter__(self):
+        for n in xrange(len(self.ids)):
+            yield self[n]
+
+# The columns needed by 'make_issue'
+_SELECT_ISSUES = """SELECT
+        i.id,
+        i.title,
+        i.description,
+        i.opened_datetime,
+        i.closed_datetime,
+        u1.email,
+        u2.email,
+        i.version
+    FROM
+        issues i
+        JOIN users u1 ON i.creatorId = u1.id
+        LEFT JOIN users u2 on i.assigneeId = u2.id"""
+
+# Matches are ranked with matches in titles counting ten times those in descriptions
+_SEARCH_ISSUES = """SELECT
+        i.id,
+        i.title,
+        i.description,
+        i.opened_datetime,
+        i.closed_datetime,
+        u1.email,
+        u2.email,
+        i.version,
+        snippet(issues_search, -1, '[', ']', '...', 12)
+    FROM
+        issues_search
+        JOIN issues i ON i.id = issues_search.rowid
+        JOIN users u1 ON i.creatorId = u1.id
+        LEFT JOIN users u2 on i.assigneeId = u2.id
+    WHERE
+        issues_search MATCH ?{}
+    ORDER BY
+        bm25(issues_search, 10.0, 1.0)
+    LIMIT ?"""
+
+# Each row written gets the version the 'issues' data version is about to be bumped to by the trigger
+_NEXT_VERSION = "(SELECT version + 1 FROM data_versions WHERE name = 'issues')"
+
+# Enough to tell whether a cached issue is still current
+_ISSUE_VERSIONS = "SELECT version, (SELECT version FROM data_versions WHERE name = 'users') FROM issues WHERE id = ?"
+
+_INSERT_ISSUE = """INSERT INTO issues(
+        title,
+        description,
+        creatorId,
+        version
+    ) VALUES(?, ?, ?, {})""".format(_NEXT_VERSION)
+
+def _search_words(query):
+    """Turn what someone typed into a full-text query for all of its words.
+
+    Each word is quoted so nothing typed can be taken as query syntax, such as 'OR', 'NEAR' or a column name.
+    """
+    # Unicode throughout, as formatting a non-ASCII word into a byte string would fail
+    return u' '.join(u'"{}"'.format(word) for word in re.findall(r'\w+', query, re.UNICODE))
+
+def _issue_conditions(closed, assigneeId, creatorId):
+    """The SQL conditions and parameters for the filters on listing or searching issues, only those needed."""
+    conditions = []
+    params = []
+    if assigneeId is not None:
+        if int(assigneeId) < 0:
+            conditions.append('i.assigneeId IS NULL')
+        else:
+            conditions.append('i.assigneeId = ?')
+            params.append(assigneeId)
+    if creatorId is not None:
+        conditions.append('i.creatorId = ?')
+        params.append(creatorId)
+    if closed is not None:
+        # Must match the indexed expression exactly for the indexes to be used
+        conditions.append('(i.closed_datetime IS NULL) = ?')
+        params.append(0 if closed else 1)
+    return conditions, params
+
+def _list_issues_query(limit, after, closed, assigneeId, creatorId):
+    """The SQL and parameters to list issues, with only the conditions needed so each shape is cached."""
+    conditions, params = _issue_conditions(closed, assigneeId, creatorId)
+    if after is not None:
+        conditions.append('i.id > ?')
+        params.append(after)
+
+    sql = _SELECT_ISSUES
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY i.id'
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+    return sql, params
 
 class IssueRepository(object):
-    def __init__(self, conn):
+    def __init__(self, conn, cache=None):
         self._conn = conn
+        self._cache = cache
+        # Whether this connection has written any issues, so what it reads may yet be rolled back
+        self._written = False
+
+    def list_issues(self, limit=None, after=None, closed=None, assigneeId=None, creatorId=None):
+        """List issues in id order, optionally a page at a time and filtered.
 
-    def list_issues(self):
+        Paging is by keyset: pass the id of the last issue seen as 'after' to get the next 'limit' issues. The
+        filters are 'closed' (a Boolean), 'assigneeId' (negative for unassigned issues) and 'creatorId'. Every
+        combination of filters has a matching index so each page costs the same however large the table grows.
+        """
         cursor = self._conn.cursor()
         try:
-            cursor.execute(
-                """SELECT
-                        i.id,
-                        i.title,
-                        i.description,
-                        i.opened_datetime,
-                        i.closed_datetime,
-                        u1.email,
-                        u2.email
-                    FROM 
-                        issues i
-                        JOIN users u1 ON i.creatorId = u1.id
-                        LEFT JOIN users u2 on i.assigneeId = u2.id 
-                    ORDER BY i.id""")
+            cursor.execute(*_list_issues_query(limit, after, closed, assigneeId, creatorId))
             return [make_issue(row) for row in cursor.fetchall()]
         finally:
             cursor.close()
 
-    def fetch_issue(self, issue_id):
+    def iter_issues(self, limit=None, after=None, closed=None, assigneeId=None, creatorId=None, chunk_size=100):
+        """Generate the same issues as 'list_issues' but only pull 'chunk_size' rows at a time from the cursor."""
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute(*_list_issues_query(limit, after, closed, assigneeId, creatorId))
+            rows = cursor.fetchmany(chunk_size)
+            while rows:
+                for row in rows:
+                    yield make_issue(row)
+                rows = cursor.fetchmany(chunk_size)
+        finally:
+            cursor.close()
+
+    def list_issue_batch(self, limit=None, after=None, closed=None, assigneeId=None, creatorId=None, chunk_size=100):
+        """The same issues as 'list_issues' but as an 'IssueBatch', pulling 'chunk_size' rows at a time into it."""
+        batch = IssueBatch()
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute(*_list_issues_query(limit, after, closed, assigneeId, creatorId))
+            rows = cursor.fetchmany(chunk_size)
+            while rows:
+                batch.extend(rows)
+                rows = cursor.fetchmany(chunk_size)
+        finally:
+            cursor.close()
+        return batch
+
+    def iter_issue_batches(self, limit=None, after=None, closed=None, assigneeId=None, creatorId=None, chunk_size=100):
+        """Generate the same issues as 'list_issues' as an 'IssueBatch' of up to 'chunk_size' at a time."""
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute(*_list_issues_query(limit, after, closed, assigneeId, creatorId))
+            rows = cursor.fetchmany(chunk_size)
+            while rows:
+                batch = IssueBatch()
+                batch.extend(rows)
+                yield batch
+                rows = cursor.fetchmany(chunk_size)
+        finally:
+            cursor.close()
+
+    def search_issues(self, query, limit=20, closed=None, assigneeId=None, creatorId=None):
+        """Find the issues best matching some words, as (issue, snippet) pairs with the best match first.
+
+        Every word has to appear in the title or description, with matches in the title counting for more. The
+        snippet is the best matching part of the text, with each matching word in [brackets]. The filters are those of
+        'list_issues', applied to the matching issues.
+        """
+        match = _search_words(query)
+        if not match:
+            return []
+        conditions, params = _issue_conditions(closed, assigneeId, creatorId)
         cursor = self._conn.cursor()
         try:
             cursor.execute(
-                """SELECT
-                        i.id,
-                        i.title,
-                        i.description,
-                        i.opened_datetime,
-                        i.closed_datetime,
-                        u1.email,
-                        u2.email
-                    FROM 
-                        issues i
-                        JOIN users u1 ON i.creatorId = u1.id
-                        LEFT JOIN users u2 on i.assigneeId = u2.id 
-                    WHERE 
-                        i.id = ?
-                    ORDER BY i.id""",
-                    (issue_id, ))
+                _SEARCH_ISSUES.format(''.join(' AND ' + condition for condition in conditions)),
+                [match] + params + [limit])
+            return [(make_issue(row[:-1]), row[-1]) for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    def fetch_issue(self, issue_id):
+        """Fetch an issue, or None if there isn't one with that id.
+
+        A cached issue is only used once a query for the row's version (and the users' data version, as the issue
+        includes emails) shows it's still current, whichever process last wrote it.
+        """
+        cursor = self._conn.cursor()
+        try:
+            usersVersion = None
+            if self._cache is not None:
+                cursor.execute(_ISSUE_VERSIONS, (issue_id, ))
+                row = cursor.fetchone()
+                if row is None:
+                    self._cache.evict(issue_id)
+                    return None
+                version, usersVersion = row
+                issue = self._cache.lookup(issue_id, version, usersVersion)
+                if issue is not None:
+                    return issue
+
+            cursor.execute(_SELECT_ISSUES + ' WHERE i.id = ?', (issue_id, ))
             row = cursor.fetchone()
-            return make_issue(row) if row != None else None
+            if row is None:
+                return None
+            issue = make_issue(row)
+            # Versions seen in a transaction which could be rolled back might be used again for something else
+            if self._cache is not None and not self._written:
+                self._cache.add(issue, usersVersion)
+            return issue
         finally:
             cursor.close()
 
     def create_issue(self, title, description, creatorId):
+        self._written = True
         cursor = self._conn.cursor()
         try:
-            cursor.execute(
-                """INSERT INTO issues(
-                    title,
-                    description,
-                    creatorId
-                ) VALUES(?, ?, ?)""", 
-                (title, description, creatorId)
-            )
+            cursor.execute(_INSERT_ISSUE, (title, description, creatorId))
             cursor.execute("select last_insert_rowid()")
             return cursor.fetchone()[0]
         finally:
             cursor.close()
 
+    def create_issues(self, issues, creatorId):
+        """Create many issues, given as (title, description) pairs, returning their ids.
+
+        Everything is inserted with one statement in the current transaction, and the statistics triggers are held off
+        so the statistics are updated once for the whole batch rather than for every issue.
+        """
+        rows = [(title, description, creatorId) for title, description in issues]
+        if not rows:
+            return []
+        self._written = True
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute('UPDATE issue_stats SET deferred = 1')
+            cursor.executemany(_INSERT_ISSUE, rows)
+            # Nothing else can insert during the transaction so the new ids are consecutive, ending with the last
+            cursor.execute("select last_insert_rowid()")
+            lastId = cursor.fetchone()[0]
+            firstId = lastId - len(rows) + 1
+
+            # As for a single issue, if they were all opened no earlier than everything else the maximum can only go up
+            cursor.execute(
+                """UPDATE issue_stats SET
+                    max_open = CASE
+                        WHEN latest IS NULL OR (SELECT MIN(opened_datetime) FROM issues WHERE id >= ?) >= latest
+                            THEN MAX(max_open, open_now + ?)
+                        ELSE NULL
+                    END,
+                    open_now = open_now + ?,
+                    latest = MAX(COALESCE(latest, ''), (SELECT MAX(opened_datetime) FROM issues WHERE id >= ?)),
+                    deferred = 0""",
+                (firstId, len(rows), len(rows), firstId))
+            return range(firstId, lastId + 1)
+        finally:
+            cursor.close()
+
     def update_issue(self, issue_id, **kwargs):
+        """Update an issue's 'title', 'description', 'closedFlag' and/or 'assigneeId' with a single statement. Any
+        other keyword arguments are ignored. Returns whether there's an issue with that id.
+
+        The row is only written if one of the fields given differs from what's stored, as the edit form sends every
+        field on each save, so saving an unchanged issue leaves its version, the data version and the statistics alone.
+        """
+        assignments = []
+        parameters = []
+        # Whether each field given would change the row
+        changes = []
+        changeParameters = []
+        if 'title' in kwargs:
+            assignments.append('title = ?')
+            parameters.append(kwargs['title'])
+            changes.append('title IS NOT ?')
+            changeParameters.append(kwargs['title'])
+        if 'description' in kwargs:
+            assignments.append('description = ?')
+            parameters.append(kwargs['description'])
+            changes.append('description IS NOT ?')
+            changeParameters.append(kwargs['description'])
+
+        # The field 'closedFlag' is a Boolean indicating whether the issue is closed. If it is now closed then let the database timestamp
+        # the closure as it did the creation, unless it was already closed.
+        if 'closedFlag' in kwargs:
+            if kwargs['closedFlag']:
+                assignments.append(
+                    "closed_datetime = CASE WHEN closed_datetime IS NULL THEN DATETIME('now') ELSE closed_datetime END")
+                changes.append('closed_datetime IS NULL')
+            else:
+                assignments.append('closed_datetime = NULL')
+                changes.append('closed_datetime IS NOT NULL')
+
+        if 'assigneeId' in kwargs:
+            # Negative assignee id implies issue is not assigned to a user
+            assigneeId = int(kwargs['assigneeId'])
+            assignments.append('assigneeId = ?')
+            parameters.append(assigneeId if assigneeId >= 0 else None)
+            changes.append('assigneeId IS NOT ?')
+            changeParameters.append(assigneeId if assigneeId >= 0 else None)
+
         cursor = self._conn.cursor()
         try:
-            if 'title' in kwargs:
-                cursor.execute(
-                    """UPDATE issues SET title = ? WHERE id = ?""",
-                    (kwargs['title'], issue_id)
-                )
-            if 'description' in kwargs:
+            if assignments:
+                assignments.append('version = ' + _NEXT_VERSION)
+                self._written = True
+
+                # The statement only depends on which fields are given, so there are few enough for the statement cache
+                # to hold
                 cursor.execute(
-                    """UPDATE issues SET description = ? WHERE id = ?""",
-                    (kwargs['description'], issue_id)
+                    'UPDATE issues SET {} WHERE id = ? AND ({})'.format(', '.join(assignments), ' OR '.join(changes)),
+                    parameters + [issue_id] + changeParameters
                 )
+                if cursor.rowcount > 0:
+                    if self._cache is not None:
+                        self._cache.evict(issue_id)
+                    return True
 
-            # The field 'closedFlag' is a Boolean indicating whether the issue is closed. If it is now closed then let the database timestamp
-            # the closure as it did the creation.
-            if 'closedFlag' in kwargs:
-                if kwargs['closedFlag']:
-                    cursor.execute(
-                        """UPDATE issues 
-                            SET closed_datetime = DATETIME('now') 
-                            WHERE id = {} AND closed_datetime IS NULL""".format(issue_id))
-                else:
-                    cursor.execute("UPDATE issues SET closed_datetime = NULL WHERE id = {}".format(issue_id))
-
-            if 'assigneeId' in kwargs:
-                # Negative assignee id implies issue is not assigned to a user
-                assigneeId = int(kwargs['assigneeId'])
-                if assigneeId < 0:
-                    cursor.execute(
-                        """UPDATE issues SET assigneeId = NULL WHERE id = ?""",
-                        (issue_id, ))
-                else:
-                    cursor.execute(
-                        """UPDATE issues SET assigneeId = ? WHERE id = ?""",
-                        (kwargs['assigneeId'], issue_id))
-
+            # Nothing changed, but whether the issue exists is still worth knowing
+            cursor.execute('SELECT 1 FROM issues WHERE id = ?', (issue_id, ))
+            return cursor.fetchone() is not None
         finally:
             cursor.close()
 
+    def update_issues(self, changes):
+        """Apply many updates, given as (issue id, fields) pairs, in the current transaction. Returns the ids of any
+        of the issues that don't exist.
+        """
+        return [issue_id for issue_id, fields in changes if not self.update_issue(issue_id, **fields)]
+
     def statistics(self):
         """Gather statistics for the dashboard."""
         cursor = self._conn.cursor()
         try:
-            # Never cache the open number of issues as it's relatively cheap to calculate (providing the table isn't too big)
-            cursor.execute('SELECT COUNT(*) FROM issues WHERE closed_datetime IS NULL')
-            currentOpenNow = cursor.fetchone()[0]
+            # Triggers on 'issues' keep count of the issues open now and closed each day, so these are both lookups
+            cursor.execute('SELECT open_now, max_open FROM issue_stats')
+            currentOpenNow, maxOpen = cursor.fetchone()
 
-            # Never cache the number of issues closed in the last week as it's relatively cheap to calculate (providing the 
-            # table isn't too big)
-            cursor.execute(
-                """SELECT COUNT(*) 
-                    FROM issues
-                    WHERE closed_datetime > DATE('now', '-7 days')""")
+            # Everything closed on or after the day a week ago
+            cursor.execute("SELECT COALESCE(SUM(closed), 0) FROM closed_per_day WHERE day >= DATE('now', '-7 days')")
             closedInLastWeek = cursor.fetchone()[0]
 
-            # The maximum number of open issues there's every been at one time is more complex so we'll cache it and use 
-            # (database) triggers on insert / update to wipe the cached value
-            cursor.execute("SELECT value FROM cached WHERE name = 'max_open'")
-            row = cursor.fetchone()
-            if row is not None:
-                maxOpen = row[0]
-            else:
-                maxOpen = 0
-
-                # There is no cached value so we'll recalculate it
+            # The maximum number of open issues there's ever been at one time is more complex. Triggers on insert /
+            # update keep it up to date as issues are opened and closed now, but if history is rewritten they clear it
+            # and it must be rebuilt.
+            if maxOpen is None:
+                # Take the write lock first so nothing can change between the rebuild and storing its result
+                cursor.execute('UPDATE issue_stats SET max_open = NULL WHERE max_open IS NULL')
+                maxOpen, currentOpenNow, latest = self._rebuild_max_open(cursor)
                 cursor.execute(
-                    """SELECT 
-                        opened_datetime,
-                        closed_datetime
-                        FROM 
-                            issues
-                        ORDER BY
-                            opened_datetime,
-                            closed_datetime
-                    """)
-
-                # Issues that are currently open and have a closing date; only closing dates are stored and in increasing
-                # order.
-                willCloseIssues = []
-
-                # The count of issues that are opened but never closed
-                neverCloseIssueCount = 0
-
-                # Iterate throw the issues
-                row = cursor.fetchone()
-                while row is not None:
-                    currentOpened = _parseDatetime(row[0])
-                    currentClosed = _parseDatetime(row[1])
-                    row = cursor.fetchone()
- 
-                    # Have any open issues closed since this one opened? Look for the first closed date strictly after
-                    # this opened date. Retain those elements
-                    afterIndex = bisect_right(willCloseIssues, currentOpened)
-                    willCloseIssues = willCloseIssues[afterIndex:]
-
-                    # Is the current issue going to close at some point?
-                    if currentClosed is None:
-                        neverCloseIssueCount += 1
-                    else:
-                        # Insert the new closed date in order
-                        insertAt = bisect_left(willCloseIssues, currentClosed)
-                        willCloseIssues.insert(insertAt, currentClosed)
-
-                    # Is this the maximum number of open issues?
-                    currentOpen = len(willCloseIssues) + neverCloseIssueCount
-                    maxOpen = max(currentOpen, maxOpen)
-
-                try:
-                    cursor.execute("INSERT INTO cached VALUES('max_open', ?)", (maxOpen, ))
-                except sqlite3.DatabaseError:
-                    # Ignore any attempt to insert duplicate key
-                    pass
+                    'UPDATE issue_stats SET max_open = ?, open_now = ?, latest = ?',
+                    (maxOpen, currentOpenNow, latest))
 
             return {
                 'maxOpen': maxOpen, 
@@ -246,6 +753,195 @@ class IssueRepository(object):
         finally:
             cursor.close()
 
+    def check_statistics(self):
+        """Recount everything the triggers keep count of from scratch, storing the right counts.
+
+        Returns a description of each count that was wrong, so an empty list means everything was consistent.
+        """
+        cursor = self._conn.cursor()
+        try:
+            # Take the write lock first so nothing can change while recounting
+            cursor.execute('UPDATE issue_stats SET max_open = max_open')
+            problems = []
+
+            cursor.execute('SELECT open_now, max_open, latest, deferred FROM issue_stats')
+            stored = cursor.fetchone()
+            maxOpen, openNow, latest = self._rebuild_max_open(cursor)
+            # A bulk import that never finished would leave the insert trigger switched off
+            recounted = (openNow, maxOpen, latest, 0)
+            for name, storedValue, recountedValue in zip(('open_now', 'max_open', 'latest', 'deferred'), stored, recounted):
+                # The maximum may legitimately be waiting to be rebuilt
+                if storedValue != recountedValue and not (name == 'max_open' and storedValue is None):
+                    problems.append('issue_stats.{} was {!r} rather than {!r}'.format(name, storedValue, recountedValue))
+            cursor.execute(
+                'UPDATE issue_stats SET open_now = ?, max_open = ?, latest = ?, deferred = ?', recounted)
+
+            cursor.execute('SELECT day, closed FROM closed_per_day WHERE closed != 0')
+            stored = dict(cursor.fetchall())
+            cursor.execute(
+                """SELECT DATE(closed_datetime), COUNT(*)
+                    FROM issues
+                    WHERE closed_datetime IS NOT NULL
+                    GROUP BY DATE(closed_datetime)""")
+            recounted = dict(cursor.fetchall())
+            for day in sorted(set(stored) | set(recounted)):
+                if stored.get(day, 0) != recounted.get(day, 0):
+                    problems.append('closed_per_day for {} was {} rather than {}'.format(
+                        day, stored.get(day, 0), recounted.get(day, 0)))
+            cursor.execute('DELETE FROM closed_per_day')
+            cursor.executemany('INSERT INTO closed_per_day(day, closed) VALUES (?, ?)', sorted(recounted.items()))
+
+            return problems
+        finally:
+            cursor.close()
+
+    def _rebuild_max_open(self, cursor):
+        """Sweep through the issues in the order they were opened to find the most there's been open at once.
+
+        Returns that maximum, the number open now and the latest datetime seen. Datetimes are compared as text, as in
+        the triggers, which works as they're stored in ISO 8601 format.
+        """
+        cursor.execute(
+            """SELECT
+                opened_datetime,
+                closed_datetime
+                FROM
+                    issues
+                ORDER BY
+                    opened_datetime,
+                    closed_datetime
+            """)
+
+        maxOpen = 0
+        latest = None
+
+        # Heap of the closing datetimes of issues that are currently open
+        willCloseIssues = []
+
+        # The count of issues that are opened but never closed
+        neverCloseIssueCount = 0
+
+        for opened, closed in cursor:
+            # Drop issues that closed at or before this one opened
+            while willCloseIssues and willCloseIssues[0] <= opened:
+                heappop(willCloseIssues)
+
+            # Is the current issue going to close at some point?
+            if closed is None:
+                neverCloseIssueCount += 1
+            else:
+                heappush(willCloseIssues, closed)
+
+            # Is this the maximum number of open issues?
+            maxOpen = max(len(willCloseIssues) + neverCloseIssueCount, maxOpen)
+            latest = max(filter(None, (latest, opened, closed)))
+
+        return maxOpen, neverCloseIssueCount, latest
+
+class SessionCache(object):
+    """A process-local cache of recently extended sessions, whose further expiry extensions are written back to the
+    database in batches.
+
+    An entry lasts at most 'ttl' seconds after the database last extended the session, and 'flush_interval' should be
+    well inside the session timeout. The session is still looked up on every use, so one revoked or replaced by another
+    process is refused straight away; it's only the write extending its expiry that's put off.
+    """
+
+    def __init__(self, ttl, flush_interval):
+        self._ttl = ttl
+        self._flush_interval = flush_interval
+        # The session id for each user id and when that entry expires
+        self._entries = {}
+        # Session ids by user id, used since the last flush, whose expiry should be extended
+        self._pending = {}
+        self._next_flush = time.time() + flush_interval
+        self._lock = threading.Lock()
+
+    def lookup(self, id, sessionId):
+        """Whether the session is known to be valid, in which case its expiry is due to be extended."""
+        with self._lock:
+            entry = self._entries.get(id)
+            if entry is None or entry[0] != sessionId:
+                return False
+            if entry[1] <= time.time():
+                del self._entries[id]
+                return False
+            self._pending[id] = sessionId
+            return True
+
+    def add(self, id, sessionId):
+        """Remember a session the database has just confirmed (and extended)."""
+        with self._lock:
+            self._entries[id] = (sessionId, time.time() + self._ttl)
+            self._pending.pop(id, None)
+
+    def invalidate(self, id):
+        """Forget a user's session, as it's been revoked or replaced."""
+        with self._lock:
+            self._entries.pop(id, None)
+            self._pending.pop(id, None)
+
+    def takePending(self, force=False):
+        """Hand over the (user id, session id) pairs to extend, if any and if it's time to (or forced)."""
+        with self._lock:
+            now = time.time()
+            if not self._pending or (now < self._next_flush and not force):
+                return []
+            pending, self._pending = self._pending, {}
+            self._next_flush = now + self._flush_interval
+        return pending.items()
+
+class IssueCache(object):
+    """A process-local cache of the 'size' most recently used issues, each kept with the row version and users' data
+    version it was read at, so it can be checked as current by a query much cheaper than fetching it again.
+
+    Issues updated through this process are forgotten straight away, and those updated by another are noticed by their
+    row version having changed.
+    """
+
+    def __init__(self, size):
+        self._size = size
+        # (issue, row version, users' data version) by issue id, least recently used first
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, issue_id, version, usersVersion):
+        """The cached issue if it's of the versions given, counting a hit or a miss."""
+        with self._lock:
+            entry = self._entries.pop(issue_id, None)
+            if entry is None or entry[1:] != (version, usersVersion):
+                self._misses += 1
+                return None
+            # Back in as the most recently used
+            self._entries[issue_id] = entry
+            self._hits += 1
+            return entry[0]
+
+    def add(self, issue, usersVersion):
+        with self._lock:
+            self._entries.pop(issue.id, None)
+            self._entries[issue.id] = (issue, issue.version, usersVersion)
+            while len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def evict(self, issue_id):
+        """Forget an issue, as it's been changed."""
+        with self._lock:
+            self._entries.pop(issue_id, None)
+
+    def statistics(self):
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+                'size': len(self._entries)
+            }
+
 User = namedtuple('User', ['id', 'email' ])
 
 def _makeUser(row):
@@ -256,11 +952,11 @@ def _makeUser(row):
 class UserRepository:
     """Support for registering, logging in, logging out and authentication."""
 
-    def __init__(self, conn):
+    def __init__(self, conn, sessions=None, hasher=None):
         self._conn = conn
+        self._sessions = sessions
+        self._hasher = hasher if hasher is not None else PasswordHasher()
         self.sessionTimeout = '+1 hour'
-        # This would be better coming from a configuration file
-        self.salt = '\xc1\x9c\x0ei\xb0P\xe5ma\xe0\xa4\xdd0\xa5X\xce'
     
     def register(self, email, password):
         """Register a new user"""
@@ -287,21 +983,30 @@ class UserRepository:
 
     def createSessionId(self, email, password):
         """Given a user's detail return a user and session id, or None if failed to authenticate."""
-        hashedPassword = self.hashPassword(password)
         cursor = self._conn.cursor()
         try:
-            cursor.execute(
-                'SELECT id FROM users WHERE email = ? AND password = ?',
-                (email, hashedPassword))
+            cursor.execute('SELECT id, password FROM users WHERE email = ?', (email, ))
             row = cursor.fetchone()
             if row is None:
+                # Take as long as a wrong password would so as not to give away which e-mail addresses are registered
+                self.hashPassword(password)
+                return None
+            id, storedPassword = row
+
+            matches, rehash = self._hasher.verify(password, storedPassword)
+            if not matches:
                 return None
-            id = row[0]
+            if rehash:
+                # The cost of hashing has changed since this password was stored so bring it up to date
+                cursor.execute('UPDATE users SET password = ? WHERE id = ?', (self.hashPassword(password), id))
 
+            from uuid import uuid4
             sessionId = uuid4().hex
             cursor.execute(
                 "UPDATE users SET uuid = ?, expiresAt = DATETIME('now', '{}') WHERE id = ?".format(self.sessionTimeout),
                 (sessionId, id))
+            if self._sessions is not None:
+                self._sessions.invalidate(id)
             return (id, sessionId)
 
         finally:
@@ -309,6 +1014,8 @@ class UserRepository:
 
     def revokeSessionId(self, id):
         """Drop the session id for a particular user (effetively logging them out)."""
+        if self._sessions is not None:
+            self._sessions.invalidate(id)
         cursor = self._conn.cursor()
         try:
             cursor.execute(
@@ -324,7 +1031,8 @@ class UserRepository:
 
         cursor = self._conn.cursor()
         try:
-            # Does the session id match the one we have for this user? and is it still valid?
+            # Does the session id match the one we have for this user? and is it still valid? Checked even when cached,
+            # as another process may have revoked or replaced it, which is only a lookup by primary key
             cursor.execute(
                 "SELECT COUNT(*) FROM users WHERE id = ? AND uuid = ? AND expiresAt > DATETIME('now')",
                 (id, sessionId))
@@ -332,15 +1040,39 @@ class UserRepository:
             if count == 0:
                 return False
 
+            # A session extended recently can wait for the next batch to extend its expiry again
+            if self._sessions is not None and self._sessions.lookup(id, sessionId):
+                self.flushSessions(force=False)
+                return True
+
             # Extend the expiry of the session id
             cursor.execute(
                 "UPDATE users SET expiresAt = DATETIME('now', '{}') WHERE id = ?".format(self.sessionTimeout),
                 (id, ))
+            if self._sessions is not None:
+                self._sessions.add(id, sessionId)
             return True
 
         finally:
             cursor.close()
 
+    def flushSessions(self, force=True):
+        """Write the expiry extensions of cached sessions used since the last batch, if it's time to (or forced)."""
+        if self._sessions is None:
+            return
+        pending = self._sessions.takePending(force)
+        if not pending:
+            return
+        cursor = self._conn.cursor()
+        try:
+            # Only extend the session that was used, not one that's replaced it since
+            cursor.executemany(
+                "UPDATE users SET expiresAt = DATETIME('now', '{}') WHERE id = ? AND uuid = ?".format(
+                    self.sessionTimeout),
+                pending)
+        finally:
+            cursor.close()
+
     def listUsers(self):
         """Generate a list of all users and their ids."""
 
@@ -360,5 +1092,4 @@ class UserRepository:
 
     def hashPassword(self, plain):
         """Hash a password so the database doesn't contain plaintext."""
-        hashed = hashlib.pbkdf2_hmac('sha256', plain, self.salt, 100000)
-        return binascii.hexlify(hashed)
+        return self._hasher.hash(plain)
@@ -2,25 +2,29 @@ from __future__ import absolute_import
 from datetime import datetime, date
 import time
 import os
+import sqlite3
 import tempfile
 from uuid import uuid4
 
 from unittest import TestCase, main
-from .models import Repository
+from .models import Repository, PoolTimeout, _parseDatetime
 from .migrate_database import do_migrations
+from .passwords import PasswordHasher
 
 
 class IssueRepositoryTest(TestCase):
     def setUp(self):
         self.db_file = tempfile.mktemp()
-        repo = Repository(self.db_file)
-        repo.migrate_database()
-        self.repo_conn = repo.open()
+        # Sessions are checked against the database every time, see 'SessionCacheTest' for the cached case
+        self.repository = Repository(self.db_file, session_cache_ttl=0)
+        self.repository.migrate_database()
+        self.repo_conn = self.repository.open()
         self.repo = self.repo_conn.issues
         self.users = self.repo_conn.users
 
     def tearDown(self):
         self.repo_conn.close()
+        self.repository.close()
         os.remove(self.db_file)
 
     def test_create_and_fetch(self):
@@ -65,6 +69,71 @@ class IssueRepositoryTest(TestCase):
         self.assertEqual(issues[1].description, 'Test Issue Description 2')
         self.assertEqual(issues[1].createdBy, 'fred@bloggs.com')
 
+    def test_list_paging_and_filters(self):
+        self.users.register('justin@justinware.me.uk', 'garfield')
+        self.users.register('fred@bloggs.com', 'garfield')
+
+        ids = [self.repo.create_issue('Issue {}'.format(n), 'Description', 1 + n % 2) for n in range(7)]
+        self.repo.update_issue(ids[1], closedFlag=True, assigneeId=2)
+        self.repo.update_issue(ids[4], closedFlag=True)
+        self.repo.update_issue(ids[5], assigneeId=2)
+
+        page = self.repo.list_issues(limit=3)
+        self.assertEqual([issue.id for issue in page], ids[0:3])
+        page = self.repo.list_issues(limit=3, after=page[-1].id)
+        self.assertEqual([issue.id for issue in page], ids[3:6])
+        page = self.repo.list_issues(limit=3, after=page[-1].id)
+        self.assertEqual([issue.id for issue in page], ids[6:7])
+
+        self.assertEqual([issue.id for issue in self.repo.list_issues(closed=True)], [ids[1], ids[4]])
+        self.assertEqual(
+            [issue.id for issue in self.repo.list_issues(closed=False, limit=2, after=ids[0])], [ids[2], ids[3]])
+        self.assertEqual([issue.id for issue in self.repo.list_issues(assigneeId=2)], [ids[1], ids[5]])
+        self.assertEqual(
+            [issue.id for issue in self.repo.list_issues(assigneeId=-1, creatorId=1)], [ids[0], ids[2], ids[4], ids[6]])
+        self.assertEqual(
+            [issue.id for issue in self.repo.list_issues(assigneeId=2, creatorId=2, closed=False)], [ids[5]])
+
+        self.assertEqual(list(self.repo.iter_issues(chunk_size=2)), self.repo.list_issues())
+        self.assertEqual(
+            list(self.repo.iter_issues(limit=3, closed=False, chunk_size=2)), self.repo.list_issues(limit=3, closed=False))
+
+    def test_issue_batches(self):
+        self.users.register('justin@justinware.me.uk', 'garfield')
+        ids = [self.repo.create_issue('Issue {}'.format(n), 'Description', 1) for n in range(5)]
+        self.repo.update_issue(ids[1], closedFlag=True, assigneeId=1)
+
+        batch = self.repo.list_issue_batch(chunk_size=2)
+        self.assertEqual(len(batch), 5)
+        self.assertEqual(list(batch), self.repo.list_issues())
+        self.assertEqual(list(batch.ids), ids)
+        self.assertEqual(batch[1], self.repo.fetch_issue(ids[1]))
+        self.assertEqual(list(batch[1:3]), self.repo.list_issues()[1:3])
+        # Kept as stored until needed, and each email only once
+        self.assertIsInstance(batch.opened[0], basestring)
+        self.assertIs(batch.createdBy[0], batch.createdBy[4])
+        self.assertIs(batch.assignedTo[1], batch.createdBy[0])
+
+        self.assertEqual(
+            [list(each) for each in self.repo.iter_issue_batches(closed=False, chunk_size=3)],
+            [self.repo.list_issues(closed=False)[0:3], self.repo.list_issues(closed=False)[3:4]])
+        self.assertEqual(len(self.repo.list_issue_batch(after=ids[-1])), 0)
+
+    def test_create_issues(self):
+        self.users.register('justin@justinware.me.uk', 'garfield')
+        self.repo.create_issue('Test Issue', 'Test Issue Description', 1)
+
+        ids = self.repo.create_issues([('Bulk {}'.format(n), 'Imported') for n in range(4)], 1)
+        self.assertEqual(ids, [2, 3, 4, 5])
+        self.assertEqual([issue.title for issue in self.repo.list_issues(after=1)], ['Bulk {}'.format(n) for n in range(4)])
+        self.assertEqual(self.repo.create_issues([], 1), [])
+
+        # Statistics updated once for the whole batch, to what they'd have been otherwise
+        maxOpen, openNow, deferred = self.repo_conn._conn.execute(
+            'SELECT max_open, open_now, deferred FROM issue_stats').fetchone()
+        self.assertEqual((maxOpen, openNow, deferred), (5, 5, 0))
+        self.assertEqual(self.repo._rebuild_max_open(self.repo_conn._conn.cursor())[0:2], (5, 5))
+
     def test_update(self):
         # Register some users
         self.users.register('justin@justinware.me.uk', 'garfield')
@@ -115,6 +184,82 @@ class IssueRepositoryTest(TestCase):
         self.assertIsNone(issue.closed)
         self.assertIsNone(issue.assignedTo, 'No longer assigned to anyone')
 
+    def test_update_issues(self):
+        self.users.register('justin@justinware.me.uk', 'garfield')
+        ids = [self.repo.create_issue('Issue {}'.format(n), 'Description', 1) for n in range(3)]
+
+        missing = self.repo.update_issues([
+            (ids[0], {'closedFlag': True}),
+            (ids[1], {'title': 'Renamed', 'assigneeId': 1}),
+            (ids[2], {'userId': 1, 'sessionId': 'ignored'}),
+            (999, {'title': 'Nowhere'}),
+            (1000, {})
+        ])
+        self.assertEqual(missing, [999, 1000])
+        issues = [self.repo.fetch_issue(issue_id) for issue_id in ids]
+        self.assertIsNotNone(issues[0].closed)
+        self.assertEqual((issues[1].title, issues[1].assignedTo), ('Renamed', 'justin@justinware.me.uk'))
+        self.assertEqual(issues[2].title, 'Issue 2')
+        self.assertEqual(self.repo.statistics()['currentOpen'], 2)
+
+    def test_row_versions(self):
+        self.users.register('justin@justinware.me.uk', 'garfield')
+        ids = [self.repo.create_issue('Issue {}'.format(n), 'Description', 1) for n in range(2)]
+        ids += self.repo.create_issues([('Imported', 'Description')] * 2, 1)
+        versions = [self.repo.fetch_issue(issue_id).version for issue_id in ids]
+        self.assertEqual(len(set(versions)), 4, 'Every row written should get its own version')
+
+        self.repo.update_issue(ids[0], title='Renamed')
+        updated = self.repo.fetch_issue(ids[0]).version
+        self.assertGreater(updated, max(versions))
+        self.assertEqual([issue.version for issue in self.repo.list_issues()], [updated] + versions[1:])
+
+        # Only an update that changes something is written
+        dataVersion = self.repo_conn.data_versions()['issues']
+        self.assertTrue(self.repo.update_issue(ids[0], title='Renamed', closedFlag=False, assigneeId=-1))
+        self.assertEqual(self.repo.fetch_issue(ids[0]).version, updated)
+        self.assertEqual(self.repo_conn.data_versions()['issues'], dataVersion)
+        self.repo.update_issue(ids[0], closedFlag=True)
+        closed = self.repo.fetch_issue(ids[0])
+        self.repo.update_issue(ids[0], closedFlag=True)
+        self.assertEqual(self.repo.fetch_issue(ids[0]), closed)
+
+    def test_search_issues(self):
+        self.users.register('justin@justinware.me.uk', 'garfield')
+        self.repo.create_issue('Login page broken', 'Nothing happens when the button is pressed', 1)
+        self.repo.create_issue('Dashboard slow', 'It takes ages to load after login', 1)
+        self.repo.create_issue('Typo', 'Spelling mistake', 1)
+
+        # Matches in the title rank first
+        results = self.repo.search_issues('login')
+        self.assertEqual([issue.id for issue, _ in results], [1, 2])
+        self.assertEqual(results[1][1], 'It takes ages to load after [login]')
+        self.assertEqual([issue.id for issue, _ in self.repo.search_issues('LOGIN button')], [1])
+        self.assertEqual(self.repo.search_issues('login', limit=1)[0][0].title, 'Login page broken')
+
+        # The index follows changes to the issues
+        self.repo.update_issue(3, title='Login typo')
+        self.assertEqual([issue.id for issue, _ in self.repo.search_issues('login')], [3, 1, 2])
+        self.assertEqual(self.repo.search_issues('spelling')[0][0].title, 'Login typo')
+        self.repo.update_issue(1, description='Fixed')
+        self.assertEqual(self.repo.search_issues('button'), [])
+
+        # Filtered as a listing would be
+        self.repo.update_issue(1, closedFlag=True)
+        self.repo.update_issue(2, assigneeId=1)
+        self.assertEqual([issue.id for issue, _ in self.repo.search_issues('login', closed=False)], [3, 2])
+        self.assertEqual([issue.id for issue, _ in self.repo.search_issues('login', assigneeId=1)], [2])
+        self.assertEqual([issue.id for issue, _ in self.repo.search_issues('login', assigneeId=-1, closed=True)], [1])
+        self.assertEqual(self.repo.search_issues('login', creatorId=2), [])
+
+        # Words needn't be ASCII
+        self.repo.create_issue(u'Caf\xe9 menu', u'Cr\xe8me br\xfbl\xe9e missing', 1)
+        self.assertEqual([issue.title for issue, _ in self.repo.search_issues(u'cr\xe8me caf\xe9')], [u'Caf\xe9 menu'])
+
+        # Query syntax is just treated as words
+        self.assertEqual(self.repo.search_issues('title:login OR "typo'), [])
+        self.assertEqual(self.repo.search_issues(' * '), [])
+
     def test_users(self):
         self.assertIsNone(self.users.register('justin@justinware.me.uk', 'garfield'))
         error = self.users.register('justin@justinware.me.uk', 'pookie')
@@ -257,5 +402,388 @@ class IssueRepositoryTest(TestCase):
             statistics = self.repo.statistics()
             self.assertEquals(statistics, { 'maxOpen': 10, 'currentOpen': 2, 'closedInLastWeek': 8 }, 'Repeat using cached')
 
+    def test_statistics_maintained_incrementally(self):
+        def storedMaxOpen():
+            return self.repo_conn._conn.execute('SELECT max_open FROM issue_stats').fetchone()[0]
+
+        def rebuiltMaxOpen():
+            return self.repo._rebuild_max_open(self.repo_conn._conn.cursor())[0]
+
+        self.users.register('justin@justinware.me.uk', 'garfield')
+        conn = self.repo_conn._conn
+        self.assertEqual(storedMaxOpen(), 0, 'Nothing open yet')
+
+        # Open and close issues as time goes by
+        events = [
+            ('open', 1), ('open', 2), ('close', 1), ('open', 3), ('open', 4), ('open', 5),
+            ('close', 3), ('close', 4), ('open', 6), ('close', 2), ('close', 5), ('open', 7)
+        ]
+        for hour, (event, n) in enumerate(events):
+            when = datetime(2019, 1, 1, hour)
+            if event == 'open':
+                conn.execute(
+                    "INSERT INTO issues(title, opened_datetime, creatorId) VALUES (?, ?, 1)",
+                    ('issue {}'.format(n), when))
+            else:
+                conn.execute("UPDATE issues SET closed_datetime = ? WHERE title = ?", (when, 'issue {}'.format(n)))
+            self.assertIsNotNone(storedMaxOpen(), 'Still known after {} {}'.format(event, n))
+            self.assertEqual(storedMaxOpen(), rebuiltMaxOpen())
+        self.assertEqual(storedMaxOpen(), 4)
+
+        # Editing the title doesn't affect anything
+        self.repo.update_issue(1, title='A new title')
+        self.assertEqual(storedMaxOpen(), 4)
+
+        # Rewriting history means it has to be rebuilt
+        conn.execute("UPDATE issues SET closed_datetime = ? WHERE title = 'issue 4'", (datetime(2019, 1, 1, 4, 30), ))
+        self.assertIsNone(storedMaxOpen())
+        self.assertEqual(self.repo.statistics()['maxOpen'], 3)
+        self.assertEqual(storedMaxOpen(), 3)
+
+    def test_statistics_closing_in_the_same_second(self):
+        def storedMaxOpen():
+            return self.repo_conn._conn.execute('SELECT max_open FROM issue_stats').fetchone()[0]
+
+        self.users.register('justin@justinware.me.uk', 'garfield')
+        conn = self.repo_conn._conn
+        for n in range(5):
+            conn.execute("INSERT INTO issues(title, opened_datetime, creatorId) VALUES (?, '2019-01-01 10:00:00', 1)",
+                         ('Issue {}'.format(n), ))
+        self.assertEqual(storedMaxOpen(), 5)
+
+        # Closing several at once, all in the same second
+        conn.execute("UPDATE issues SET closed_datetime = '2019-01-01 11:00:00' WHERE id IN (1, 2)")
+        self.assertEqual(storedMaxOpen(), 5)
+
+        # Nor does closing an issue in the second it was opened
+        conn.execute("INSERT INTO issues(title, opened_datetime, creatorId) VALUES ('Issue 5', '2019-01-01 12:00:00', 1)")
+        conn.execute("UPDATE issues SET closed_datetime = '2019-01-01 12:00:00' WHERE id = 6")
+        self.assertEqual(storedMaxOpen(), 5)
+
+        # Closing an issue in the second another was opened may not count it as open alongside that one
+        conn.execute("INSERT INTO issues(title, opened_datetime, creatorId) VALUES ('Issue 6', '2019-01-01 13:00:00', 1)")
+        conn.execute("UPDATE issues SET closed_datetime = '2019-01-01 13:00:00' WHERE id = 3")
+        self.assertIsNone(storedMaxOpen())
+        self.assertEqual(self.repo.statistics()['maxOpen'], 5)
+
+        # As when a bulk update closes several issues now
+        self.assertEqual(self.repo.update_issues([(4, {'closedFlag': True}), (5, {'closedFlag': True})]), [])
+        self.assertEqual(storedMaxOpen(), 5)
+        self.assertEqual(self.repo._rebuild_max_open(conn.cursor())[0], 5)
+
+    def test_closed_per_day(self):
+        self.users.register('justin@justinware.me.uk', 'garfield')
+        conn = self.repo_conn._conn
+        ids = [self.repo.create_issue('Issue {}'.format(n), 'Description', 1) for n in range(4)]
+
+        def closedPerDay():
+            return dict(conn.execute('SELECT day, closed FROM closed_per_day WHERE closed != 0').fetchall())
+
+        conn.execute("UPDATE issues SET closed_datetime = '2019-01-01 10:00:00' WHERE id IN (?, ?)", ids[:2])
+        conn.execute("UPDATE issues SET closed_datetime = '2019-01-02 10:00:00' WHERE id = ?", (ids[2], ))
+        self.assertEqual(closedPerDay(), {'2019-01-01': 2, '2019-01-02': 1})
+
+        # Moving, reopening and deleting closed issues
+        conn.execute("UPDATE issues SET closed_datetime = '2019-01-02 11:00:00' WHERE id = ?", (ids[0], ))
+        self.repo.update_issue(ids[1], closedFlag=False)
+        self.assertEqual(closedPerDay(), {'2019-01-02': 2})
+        conn.execute('DELETE FROM issues WHERE id = ?', (ids[2], ))
+        self.assertEqual(closedPerDay(), {'2019-01-02': 1})
+
+        # Only those recently closed count for the last week
+        self.repo.update_issue(ids[3], closedFlag=True)
+        statistics = self.repo.statistics()
+        self.assertEqual((statistics['currentOpen'], statistics['closedInLastWeek']), (1, 1))
+        self.assertEqual(self.repo.check_statistics(), [])
+
+    def test_check_statistics(self):
+        self.users.register('justin@justinware.me.uk', 'garfield')
+        ids = [self.repo.create_issue('Issue {}'.format(n), 'Description', 1) for n in range(3)]
+        self.repo.update_issue(ids[0], closedFlag=True)
+        self.assertEqual(self.repo.check_statistics(), [])
+
+        conn = self.repo_conn._conn
+        conn.execute('UPDATE issue_stats SET open_now = 7, deferred = 1')
+        conn.execute('UPDATE closed_per_day SET closed = 5')
+        conn.execute("INSERT INTO closed_per_day(day, closed) VALUES ('2000-01-01', 1)")
+        problems = self.repo.check_statistics()
+        self.assertEqual(len(problems), 4, problems)
+        self.assertIn('issue_stats.open_now was 7 rather than 2', problems)
+
+        self.assertEqual(self.repo.check_statistics(), [])
+        statistics = self.repo.statistics()
+        self.assertEqual((statistics['currentOpen'], statistics['closedInLastWeek'], statistics['maxOpen']), (2, 1, 3))
+
+class SessionCacheTest(TestCase):
+    def setUp(self):
+        self.db_file = tempfile.mktemp()
+        self.repository = Repository(self.db_file, session_cache_ttl=0.5, session_flush_interval=60)
+        self.repository.migrate_database()
+        with self.repository.open() as repo:
+            repo.users.register('justin@justinware.me.uk', 'garfield')
+            self.id, self.sessionId = repo.users.createSessionId('justin@justinware.me.uk', 'garfield')
+
+    def tearDown(self):
+        self.repository.close()
+        os.remove(self.db_file)
+
+    def _expire_in_database(self, modifier='-1 day'):
+        with self.repository.open() as repo:
+            repo._conn.execute("UPDATE users SET expiresAt = DATETIME('now', ?)", (modifier, ))
+
+    def _expires_at(self):
+        with self.repository.open() as repo:
+            return repo._conn.execute('SELECT expiresAt FROM users WHERE id = ?', (self.id, )).fetchone()[0]
+
+    def test_cached_sessions_still_checked(self):
+        with self.repository.open() as repo:
+            self.assertTrue(repo.users.authenticateSessionId(self.id, self.sessionId))
+            self.assertFalse(repo.users.authenticateSessionId(self.id, uuid4().hex))
+
+        # Even while cached, a session revoked or expired in the database (as by another process) is refused
+        self._expire_in_database()
+        with self.repository.open() as repo:
+            self.assertFalse(repo.users.authenticateSessionId(self.id, self.sessionId))
+
+        other = Repository(self.db_file, session_cache_ttl=0.5, session_flush_interval=60)
+        try:
+            with self.repository.open() as repo:
+                id, sessionId = repo.users.createSessionId('justin@justinware.me.uk', 'garfield')
+                self.assertTrue(repo.users.authenticateSessionId(id, sessionId))
+            with other.open() as repo:
+                self.assertTrue(repo.users.authenticateSessionId(id, sessionId))
+                repo.users.revokeSessionId(id)
+            with self.repository.open() as repo:
+                self.assertFalse(repo.users.authenticateSessionId(id, sessionId), 'Revoked by the other process')
+        finally:
+            other.close()
+
+    def test_extensions_written_in_batches(self):
+        with self.repository.open() as repo:
+            self.assertTrue(repo.users.authenticateSessionId(self.id, self.sessionId))
+        # Nearly expired, so an extension would show
+        self._expire_in_database('+1 minute')
+        before = self._expires_at()
+
+        with self.repository.open() as repo:
+            for _ in range(10):
+                self.assertTrue(repo.users.authenticateSessionId(self.id, self.sessionId))
+        self.assertEqual(self._expires_at(), before, 'Extension not yet written')
+
+        with self.repository.open() as repo:
+            repo.users.flushSessions()
+        self.assertGreater(self._expires_at(), before, 'Extended when flushed')
+
+    def test_invalidated_immediately(self):
+        with self.repository.open() as repo:
+            self.assertTrue(repo.users.authenticateSessionId(self.id, self.sessionId))
+            repo.users.revokeSessionId(self.id)
+            self.assertFalse(repo.users.authenticateSessionId(self.id, self.sessionId))
+
+            id, sessionId = repo.users.createSessionId('justin@justinware.me.uk', 'garfield')
+            self.assertTrue(repo.users.authenticateSessionId(id, sessionId))
+            id, newSessionId = repo.users.createSessionId('justin@justinware.me.uk', 'garfield')
+            self.assertFalse(repo.users.authenticateSessionId(id, sessionId), 'Replaced by a new login')
+            self.assertTrue(repo.users.authenticateSessionId(id, newSessionId))
+
+class IssueCacheTest(TestCase):
+    def setUp(self):
+        self.db_file = tempfile.mktemp()
+        self.repository = Repository(self.db_file, issue_cache_size=2)
+        self.repository.migrate_database()
+        with self.repository.open() as repo:
+            repo.users.register('justin@justinware.me.uk', 'garfield')
+            for n in range(3):
+                repo.issues.create_issue('Issue {}'.format(n), 'Description', 1)
+
+    def tearDown(self):
+        self.repository.close()
+        os.remove(self.db_file)
+
+    def _fetch(self, issue_id):
+        with self.repository.open() as repo:
+            return repo.issues.fetch_issue(issue_id)
+
+    def _statistics(self):
+        statistics = self.repository.issue_cache_statistics()
+        return statistics['hits'], statistics['misses'], statistics['evictions'], statistics['size']
+
+    def test_hits_and_evictions(self):
+        first = self._fetch(1)
+        self.assertIs(self._fetch(1), first)
+        self.assertEqual(self._statistics(), (1, 1, 0, 1))
+
+        self._fetch(2)
+        self._fetch(1)
+        # Drops issue 2, the least recently used
+        self._fetch(3)
+        self.assertEqual(self._statistics(), (2, 3, 1, 2))
+        self._fetch(2)
+        self.assertEqual(self._statistics(), (2, 4, 2, 2))
+
+        self.assertIsNone(self._fetch(4))
+        self.assertIsNone(Repository(self.db_file, issue_cache_size=0).issue_cache_statistics())
+
+    def test_invalidation(self):
+        self._fetch(1)
+        with self.repository.open() as repo:
+            repo.issues.update_issue(1, title='Renamed')
+            self.assertEqual(repo.issues.fetch_issue(1).title, 'Renamed')
+        self.assertEqual(self._fetch(1).title, 'Renamed')
+
+        # Another process's changes, to the issue or the users' emails, are noticed
+        other = Repository(self.db_file, issue_cache_size=0)
+        try:
+            with other.open() as repo:
+                repo.issues.update_issue(1, closedFlag=True)
+            self.assertIsNotNone(self._fetch(1).closed)
+
+            with other.open() as repo:
+                repo._conn.execute("UPDATE users SET email = 'fred@bloggs.com'")
+            self.assertEqual(self._fetch(1).createdBy, 'fred@bloggs.com')
+
+            with other.open() as repo:
+                repo._conn.execute('DELETE FROM issues WHERE id = 1')
+            self.assertIsNone(self._fetch(1))
+        finally:
+            other.close()
+
+    def test_uncommitted_issues_not_cached(self):
+        with self.repository.open() as repo:
+            repo.issues.update_issue(1, title='Never committed')
+            self.assertEqual(repo.issues.fetch_issue(1).title, 'Never committed')
+            repo._conn.rollback()
+
+        # Another process's change then gets the same row version as the one rolled back
+        other = Repository(self.db_file, issue_cache_size=0)
+        try:
+            with other.open() as repo:
+                repo.issues.update_issue(1, description='Changed')
+        finally:
+            other.close()
+        self.assertEqual(self._fetch(1).title, 'Issue 0')
+
+class PasswordRehashTest(TestCase):
+    def setUp(self):
+        self.db_file = tempfile.mktemp()
+
+    def tearDown(self):
+        os.remove(self.db_file)
+
+    def _stored_password(self, repository):
+        with repository.open() as repo:
+            return repo._conn.execute('SELECT password FROM users').fetchone()[0]
+
+    def test_rehashed_at_login(self):
+        repository = Repository(self.db_file, hasher=PasswordHasher(iterations=1000))
+        repository.migrate_database()
+        with repository.open() as repo:
+            repo.users.register('justin@justinware.me.uk', 'garfield')
+        stored = self._stored_password(repository)
+        repository.close()
+
+        repository = Repository(self.db_file, hasher=PasswordHasher(iterations=2000))
+        with repository.open() as repo:
+            self.assertIsNone(repo.users.createSessionId('justin@justinware.me.uk', 'pookie'))
+        self.assertEqual(self._stored_password(repository), stored, 'Wrong password leaves it alone')
+        with repository.open() as repo:
+            self.assertIsNotNone(repo.users.createSessionId('justin@justinware.me.uk', 'garfield'))
+        self.assertTrue(self._stored_password(repository).startswith('pbkdf2_sha256$2000$'))
+        with repository.open() as repo:
+            self.assertIsNotNone(repo.users.createSessionId('justin@justinware.me.uk', 'garfield'))
+        repository.close()
+
+class ParseDatetimeTest(TestCase):
+    def test_formats(self):
+        self.assertIsNone(_parseDatetime(None))
+        self.assertEqual(_parseDatetime('2019-01-15 12:34:56'), datetime(2019, 1, 15, 12, 34, 56))
+        self.assertEqual(_parseDatetime('2019-01-15 12:34:56.000789'), datetime(2019, 1, 15, 12, 34, 56, 789))
+
+        # Not as SQLite stores them so handled by the general parser
+        self.assertEqual(_parseDatetime('2019-01-15T12:34:56'), datetime(2019, 1, 15, 12, 34, 56))
+        self.assertEqual(_parseDatetime('2019-01-15'), datetime(2019, 1, 15))
+
+class ConnectionPoolTest(TestCase):
+    def setUp(self):
+        self.db_file = tempfile.mktemp()
+        self.repository = Repository(self.db_file, pool_size=2, pool_timeout=0.1)
+        self.repository.migrate_database()
+
+    def tearDown(self):
+        self.repository.close()
+        os.remove(self.db_file)
+
+    def test_connections_are_reused(self):
+        with self.repository.open() as repo:
+            first = repo._conn
+        with self.repository.open() as repo:
+            self.assertIs(repo._conn, first, 'Returned connection should be checked out again')
+
+    def test_pragmas_applied(self):
+        with self.repository.open() as repo:
+            self.assertEqual(repo._conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+            self.assertEqual(repo._conn.execute('PRAGMA synchronous').fetchone()[0], 1, 'NORMAL')
+            self.assertEqual(repo._conn.execute('PRAGMA busy_timeout').fetchone()[0], 5000)
+
+    def test_pool_is_bounded(self):
+        first = self.repository.open()
+        second = self.repository.open()
+        self.assertIsNot(first._conn, second._conn)
+        with self.assertRaises(PoolTimeout):
+            self.repository.open()
+
+        second.close()
+        third = self.repository.open()
+        first.close()
+        third.close()
+
+    def test_changes_committed_on_exit(self):
+        with self.repository.open() as repo:
+            repo.users.register('justin@justinware.me.uk', 'garfield')
+        with self.repository.open() as repo:
+            self.assertEqual(len(repo.users.listUsers()), 1)
+
+        # Leaving with an exception rolls back before the connection is reused
+        with self.assertRaises(ValueError):
+            with self.repository.open() as repo:
+                repo.users.register('fred@bloggs.com', 'garfield')
+                raise ValueError()
+        with self.repository.open() as repo:
+            self.assertEqual(len(repo.users.listUsers()), 1)
+
+    def test_connections_returned_after_closing_are_closed(self):
+        checkedOut = self.repository.open()
+        with self.repository.open() as repo:
+            idle = repo._conn
+        self.repository.close()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            idle.execute('SELECT 1')
+
+        conn = checkedOut._conn
+        checkedOut.close()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            conn.execute('SELECT 1')
+
+    def test_forked_process_opens_its_own_connections(self):
+        with self.repository.open() as repo:
+            inherited = repo._conn
+
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                with self.repository.open() as repo:
+                    repo.users.register('justin@justinware.me.uk', 'garfield')
+                    if repo._conn is not inherited:
+                        status = 0
+            finally:
+                os._exit(status)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0, "Child process shouldn't have reused its parent's connection")
+
+        with self.repository.open() as repo:
+            self.assertIs(repo._conn, inherited)
+            self.assertEqual(len(repo.users.listUsers()), 1)
+
 if __name__ == '__main__':
     main()
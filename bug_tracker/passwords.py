@@ -0,0 +1,106 @@
+from __future__ import absolute_import
+import binascii
+import hashlib
+import hmac
+import os
+import threading
+
+# This would be better coming from a configuration file
+DEFAULT_SALT = '\xc1\x9c\x0ei\xb0P\xe5ma\xe0\xa4\xdd0\xa5X\xce'
+
+DEFAULT_ITERATIONS = 100000
+
+# Passwords hashed before the iteration count was stored alongside the hash all used this many
+_LEGACY_ITERATIONS = 100000
+
+_PREFIX = 'pbkdf2_sha256'
+
+
+class HashingBusy(Exception):
+    """Too many passwords are already waiting to be hashed."""
+    pass
+
+
+def _pbkdf2(plain, salt, iterations):
+    if isinstance(plain, unicode):
+        plain = plain.encode('utf-8')
+    return binascii.hexlify(hashlib.pbkdf2_hmac('sha256', plain, salt, iterations))
+
+
+class PasswordHasher(object):
+    """Hashes passwords so the database doesn't contain plaintext.
+
+    With 'workers' the hashing is done on a pool of that many processes, so the (deliberately slow) hashing of one
+    login doesn't hold the GIL while other requests wait. At most 'queue_depth' more can be waiting beyond those being
+    hashed, after which 'HashingBusy' is raised rather than queueing up ever more work, as it is when a password
+    takes more than 'timeout' seconds to hash. The pool is started by 'start', or by the first password hashed.
+
+    Hashes are stored with their iteration count, so changing 'iterations' doesn't stop existing passwords verifying,
+    and 'verify' says when a password should be rehashed to the current count.
+    """
+
+    def __init__(self, salt=DEFAULT_SALT, iterations=DEFAULT_ITERATIONS, workers=0, queue_depth=64, timeout=60):
+        self._salt = salt
+        self._iterations = iterations
+        self._workers = workers
+        self._timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + queue_depth) if workers else None
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+
+    def hash(self, plain):
+        """Hash a password ready to be stored."""
+        return '{}${}${}'.format(_PREFIX, self._iterations, self._pbkdf2(plain, self._iterations))
+
+    def verify(self, plain, stored):
+        """Check a password against a stored hash, returning whether it matches and whether it should be rehashed."""
+        iterations, hashed = _parse(stored)
+        matches = hmac.compare_digest(self._pbkdf2(plain, iterations), str(hashed))
+        return matches, matches and stored != '{}${}${}'.format(_PREFIX, self._iterations, hashed)
+
+    def start(self):
+        """Start the hashing workers now, rather than forking them from whichever request first needs them."""
+        if self._workers:
+            self._get_pool()
+
+    def close(self):
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None and self._pool_pid == os.getpid():
+            pool.terminate()
+            pool.join()
+
+    def _pbkdf2(self, plain, iterations):
+        if not self._workers:
+            return _pbkdf2(plain, self._salt, iterations)
+
+        if not self._slots.acquire(False):
+            raise HashingBusy('Too many passwords are waiting to be hashed')
+        try:
+            result = self._get_pool().apply_async(_pbkdf2, (plain, self._salt, iterations))
+            from multiprocessing import TimeoutError
+            try:
+                return result.get(self._timeout)
+            except TimeoutError:
+                raise HashingBusy('Timed out waiting for a password to be hashed')
+        finally:
+            self._slots.release()
+
+    def _get_pool(self):
+        with self._pool_lock:
+            # A pool inherited from a parent process isn't ours to use
+            if self._pool is None or self._pool_pid != os.getpid():
+                # Imported here so processes that never hash a password don't pay for it
+                import multiprocessing
+                self._pool = multiprocessing.Pool(self._workers)
+                self._pool_pid = os.getpid()
+            return self._pool
+
+
+def _parse(stored):
+    """The iteration count and hash from a stored password hash."""
+    if stored.startswith(_PREFIX + '$'):
+        _, iterations, hashed = stored.split('$')
+        return int(iterations), hashed
+    return _LEGACY_ITERATIONS, stored
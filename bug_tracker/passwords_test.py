@@ -0,0 +1,62 @@
+from __future__ import absolute_import
+import binascii
+import hashlib
+import threading
+import time
+
+from unittest import TestCase, main
+from .passwords import PasswordHasher, HashingBusy, DEFAULT_SALT
+
+
+class PasswordHasherTest(TestCase):
+    def test_hash_and_verify(self):
+        hasher = PasswordHasher(iterations=1000)
+        stored = hasher.hash('garfield')
+        self.assertTrue(stored.startswith('pbkdf2_sha256$1000$'))
+        self.assertEqual(hasher.verify('garfield', stored), (True, False))
+        self.assertEqual(hasher.verify('pookie', stored), (False, False))
+        self.assertEqual(hasher.verify(u'gar\xdffield', hasher.hash(u'gar\xdffield')), (True, False))
+
+    def test_rehash_when_cost_changes(self):
+        stored = PasswordHasher(iterations=1000).hash('garfield')
+        hasher = PasswordHasher(iterations=2000)
+        self.assertEqual(hasher.verify('garfield', stored), (True, True), 'Still verifies but should be rehashed')
+        self.assertEqual(hasher.verify('pookie', stored), (False, False))
+
+        # Hashes from before the iteration count was stored
+        legacy = binascii.hexlify(hashlib.pbkdf2_hmac('sha256', 'garfield', DEFAULT_SALT, 100000))
+        self.assertEqual(PasswordHasher().verify('garfield', legacy), (True, True))
+
+    def test_worker_processes(self):
+        hasher = PasswordHasher(iterations=1000, workers=2)
+        try:
+            stored = hasher.hash('garfield')
+            self.assertEqual(stored, PasswordHasher(iterations=1000).hash('garfield'))
+            self.assertEqual(hasher.verify('garfield', stored), (True, False))
+        finally:
+            hasher.close()
+
+    def test_queue_is_bounded(self):
+        hasher = PasswordHasher(iterations=1000000, workers=1, queue_depth=0)
+        try:
+            slow = threading.Thread(target=hasher.hash, args=('garfield', ))
+            slow.start()
+            time.sleep(0.2)
+            with self.assertRaises(HashingBusy):
+                hasher.hash('pookie')
+            slow.join()
+        finally:
+            hasher.close()
+
+    def test_timeout(self):
+        hasher = PasswordHasher(iterations=1000000, workers=1, timeout=0.01)
+        try:
+            hasher.start()
+            with self.assertRaises(HashingBusy):
+                hasher.hash('garfield')
+        finally:
+            hasher.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+from __future__ import absolute_import
+import errno
+import os
+import random
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+from werkzeug._internal import _log
+from werkzeug.serving import WSGIRequestHandler
+from werkzeug.wsgi import LimitedStream
+
+# How long the accepting threads wait for a connection before checking whether they should stop
+_ACCEPT_TIMEOUT = 1.0
+
+
+class _RequestHandler(WSGIRequestHandler):
+    """Werkzeug's request handler, but keeping the connection open for further requests where the response had a
+    length (as everything but the streamed issue listings does) until the client has been idle for 'timeout' seconds.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def make_environ(self):
+        environ = WSGIRequestHandler.make_environ(self)
+        if environ.get('wsgi.input_terminated'):
+            # A chunked body, which we can't be sure of finding the end of if the application doesn't read it all
+            self.close_connection = True
+            self._input = None
+        else:
+            # Limit reading to this request's body, so whatever's left of it can be skipped to get to the next request
+            self._input = environ['wsgi.input'] = LimitedStream(
+                self.rfile, int(environ.get('CONTENT_LENGTH') or 0))
+        return environ
+
+    def run_wsgi(self):
+        self._input = None
+        self.server.request_started()
+        try:
+            WSGIRequestHandler.run_wsgi(self)
+            if self._input is not None:
+                self._input.exhaust()
+        finally:
+            if self.server.stopping or not self.server.keep_alive:
+                self.close_connection = True
+
+    def end_headers(self):
+        # Telling the client when the worker won't take another request on this connection
+        if (self.server.stopping or not self.server.keep_alive) and not self.close_connection:
+            self.send_header('Connection', 'close')
+        WSGIRequestHandler.end_headers(self)
+
+class _Worker(object):
+    """A worker process's server: 'threads' threads each accepting connections from the shared listening socket and
+    handling the requests on them.
+
+    Stops, letting requests in progress finish, on SIGTERM or once it's handled 'max_requests' requests (if given).
+    """
+
+    multithread = True
+    multiprocess = True
+    passthrough_errors = False
+    ssl_context = None
+    shutdown_signal = False
+
+    def __init__(self, listener, app, threads, keepalive_timeout, max_requests):
+        self.socket = listener
+        self.server_address = listener.getsockname()
+        self.app = app
+        self._threads = threads
+        # Without keep-alive each connection is closed after its one request (a timeout of zero would be non-blocking)
+        self.keep_alive = keepalive_timeout > 0
+        self._handler = type('RequestHandler', (_RequestHandler, ), {'timeout': keepalive_timeout or None})
+        self._max_requests = max_requests
+        self._requests = 0
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def log(self, type, message, *args):
+        _log(type, message, *args)
+
+    @property
+    def stopping(self):
+        return self._stopping.is_set()
+
+    def request_started(self):
+        with self._lock:
+            self._requests += 1
+            if self._max_requests and self._requests >= self._max_requests:
+                self._stopping.set()
+
+    def serve(self):
+        # The master decides when workers stop, including when the terminal's Ctrl-C reaches the whole group
+        signal.signal(signal.SIGTERM, lambda signum, frame: self._stopping.set())
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+        start = getattr(self.app, 'start', None)
+        if start is not None:
+            start()
+        threads = [threading.Thread(target=self._accept_connections) for _ in range(self._threads)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        # Joining with a timeout so the main thread is free to handle signals
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(_ACCEPT_TIMEOUT)
+        # Before the process exits, so the application can write out anything it's been holding on to
+        close = getattr(self.app, 'close', None)
+        if close is not None:
+            close()
+
+    def _accept_connections(self):
+        while not self._stopping.is_set():
+            try:
+                connection, address = self.socket.accept()
+            except socket.timeout:
+                continue
+            except socket.error as e:
+                # Another worker got there first, or a signal arrived
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR, errno.ECONNABORTED):
+                    continue
+                raise
+            try:
+                self._handler(connection, address, self)
+            except Exception:
+                self.log('error', 'Error handling connection:\n%s', traceback.format_exc())
+            finally:
+                try:
+                    connection.shutdown(socket.SHUT_WR)
+                except socket.error:
+                    pass
+                connection.close()
+
+class _Master(object):
+    def __init__(self, listener, app, workers, threads, keepalive_timeout, max_requests, max_requests_jitter,
+                 graceful_timeout):
+        self._listener = listener
+        self._app = app
+        self._workers = workers
+        self._threads = threads
+        self._keepalive_timeout = keepalive_timeout
+        self._max_requests = max_requests
+        self._max_requests_jitter = max_requests_jitter
+        self._graceful_timeout = graceful_timeout
+        # Whether each worker, by process id, is on its way out
+        self._pids = {}
+        self._restart = False
+        self._stop = False
+
+    def run(self):
+        signal.signal(signal.SIGHUP, self._on_restart)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+
+        while not self._stop:
+            self._reap()
+            if self._restart:
+                # Start the replacements before letting the old workers go so there's no gap
+                self._restart = False
+                retiring = [pid for pid, stopping in self._pids.items() if not stopping]
+                for _ in range(self._workers):
+                    self._spawn()
+                self._signal(retiring, signal.SIGTERM)
+            while sum(1 for stopping in self._pids.values() if not stopping) < self._workers:
+                self._spawn()
+            time.sleep(0.2)
+
+        self._signal(list(self._pids), signal.SIGTERM)
+        deadline = time.time() + self._graceful_timeout
+        while self._pids and time.time() < deadline:
+            self._reap()
+            time.sleep(0.05)
+        self._signal(list(self._pids), signal.SIGKILL)
+        while self._pids:
+            self._reap(block=True)
+        self._listener.close()
+
+    def _on_restart(self, signum, frame):
+        self._restart = True
+
+    def _on_stop(self, signum, frame):
+        self._stop = True
+
+    def _signal(self, pids, signum):
+        for pid in pids:
+            if pid in self._pids:
+                self._pids[pid] = True
+                try:
+                    os.kill(pid, signum)
+                except OSError:
+                    pass
+
+    def _reap(self, block=False):
+        while self._pids:
+            try:
+                pid, _ = os.waitpid(-1, 0 if block else os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.ECHILD:
+                    self._pids.clear()
+                break
+            if pid == 0:
+                break
+            self._pids.pop(pid, None)
+            if block:
+                break
+
+    def _spawn(self):
+        max_requests = self._max_requests
+        if max_requests and self._max_requests_jitter:
+            # So the workers don't all recycle at once
+            max_requests += random.randint(0, self._max_requests_jitter)
+        # Otherwise anything buffered would be written again by the worker
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid != 0:
+            self._pids[pid] = False
+            return
+        status = 0
+        try:
+            random.seed()
+            _Worker(self._listener, self._app, self._threads, self._keepalive_timeout, max_requests).serve()
+        except Exception:
+            traceback.print_exc()
+            status = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+
+def serve(make_app, host, port, workers=2, threads=4, keepalive_timeout=5.0, max_requests=0, max_requests_jitter=0,
+          graceful_timeout=30.0):
+    """Serve a WSGI application from 'workers' processes each with 'threads' threads, until SIGTERM or SIGINT.
+
+    The application is made once, before forking, so the workers share its memory, which means it mustn't hold
+    anything that can't be used from more than one process (such as an open SQLite connection) until it's first
+    called. Each worker handles at most 'max_requests' requests (plus up to 'max_requests_jitter' more), if given,
+    before being replaced. SIGHUP replaces all the workers, letting each finish the requests it's already handling.
+    Workers get 'graceful_timeout' seconds to finish when stopping. If the application has 'start' and 'close'
+    methods, each worker calls 'start' before taking requests and 'close' once it's finished with them.
+
+    A connection kept open takes up one of its worker's threads until the client has been idle for
+    'keepalive_timeout' seconds, so with 'threads' idle clients a worker takes no other requests until one times out.
+    """
+    listener = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(128)
+    listener.settimeout(_ACCEPT_TIMEOUT)
+
+    app = make_app()
+    _Master(listener, app, workers, threads, keepalive_timeout, max_requests, max_requests_jitter,
+            graceful_timeout).run()
@@ -0,0 +1,177 @@
+from __future__ import absolute_import
+import httplib
+import json
+import os
+import signal
+import socket
+import tempfile
+import time
+
+from unittest import TestCase, main
+from .prefork import serve
+from .server import make_api
+
+
+def _pid_app(environ, start_response):
+    """Responds with the id of the process handling the request, without reading any request body."""
+    body = str(os.getpid())
+    start_response('200 OK', [('Content-Type', 'text/plain'), ('Content-Length', str(len(body)))])
+    return [body]
+
+class _HookedApp(object):
+    """'_pid_app', noting in a file when each process starts and closes it."""
+
+    def __init__(self, log_file):
+        self._log_file = log_file
+
+    def __call__(self, environ, start_response):
+        return _pid_app(environ, start_response)
+
+    def start(self):
+        self._log('start')
+
+    def close(self):
+        self._log('close')
+
+    def _log(self, event):
+        with open(self._log_file, 'a') as f:
+            f.write('{} {}\n'.format(event, os.getpid()))
+
+def _free_port():
+    s = socket.socket()
+    try:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+    finally:
+        s.close()
+
+
+class PreforkTest(TestCase):
+    def setUp(self):
+        self.server_pid = None
+        self.connections = []
+
+    def tearDown(self):
+        for conn in self.connections:
+            conn.close()
+        if self.server_pid is not None:
+            os.kill(self.server_pid, signal.SIGTERM)
+            _, status = os.waitpid(self.server_pid, 0)
+            self.assertEqual(status, 0, 'Server should stop cleanly')
+
+    def start(self, make_app, **options):
+        self.port = _free_port()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                serve(make_app, '127.0.0.1', self.port, **options)
+            finally:
+                os._exit(0)
+        self.server_pid = pid
+
+        deadline = time.time() + 10
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', self.port)).close()
+                return
+            except socket.error:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def connect(self):
+        conn = httplib.HTTPConnection('127.0.0.1', self.port, timeout=10)
+        self.connections.append(conn)
+        return conn
+
+    def get(self, conn, path='/', method='GET', body=None, headers={}):
+        conn.request(method, path, body, headers)
+        resp = conn.getresponse()
+        return resp, resp.read()
+
+    def test_keep_alive(self):
+        self.start(lambda: _pid_app, workers=2, threads=2, keepalive_timeout=1)
+        conn = self.connect()
+        resp, pid = self.get(conn)
+        self.assertEqual(resp.status, 200)
+        sock = conn.sock
+        for _ in range(5):
+            self.assertEqual(self.get(conn)[1], pid, 'Same connection should be served by the same worker')
+        self.assertIs(conn.sock, sock, 'Connection should have been kept open')
+
+        # A body the application ignored doesn't get in the way of the next request
+        resp, _ = self.get(conn, method='POST', body='x' * 100000, headers={'Content-Type': 'text/plain'})
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(self.get(conn)[1], pid)
+        self.assertIs(conn.sock, sock)
+
+    def test_workers_and_threads(self):
+        self.start(lambda: _pid_app, workers=2, threads=2, keepalive_timeout=5)
+        # Each thread stays with its connection, so these have to be spread over both workers' threads
+        pids = [self.get(self.connect())[1] for _ in range(4)]
+        self.assertEqual(sorted(pids.count(pid) for pid in set(pids)), [2, 2])
+        self.assertNotIn(str(os.getpid()), pids)
+
+    def test_recycling(self):
+        self.start(lambda: _pid_app, workers=1, threads=1, max_requests=3)
+        conn = self.connect()
+        first = [self.get(conn)[1] for _ in range(3)]
+        self.assertEqual(len(set(first)), 1)
+        # The worker closes the connection after its last request, then is replaced
+        self.assertIsNone(conn.sock)
+        second = self.get(self.connect())[1]
+        self.assertNotEqual(second, first[0])
+
+    def test_no_keep_alive(self):
+        self.start(lambda: _pid_app, workers=1, threads=1, keepalive_timeout=0)
+        conn = self.connect()
+        resp, _ = self.get(conn)
+        self.assertEqual(resp.getheader('connection'), 'close')
+        self.assertIsNone(conn.sock)
+
+    def test_start_and_close(self):
+        log_file = tempfile.mktemp()
+        self.addCleanup(os.remove, log_file)
+        self.start(lambda: _HookedApp(log_file), workers=1, threads=1, max_requests=1)
+        first = self.get(self.connect())[1]
+        second = self.get(self.connect())[1]
+        self.assertNotEqual(first, second)
+        os.kill(self.server_pid, signal.SIGTERM)
+        self.assertEqual(os.waitpid(self.server_pid, 0)[1], 0)
+        self.server_pid = None
+
+        # Each worker started the application before its request and closed it before exiting, recycled or stopped
+        with open(log_file) as f:
+            events = f.read().split('\n')[:-1]
+        for pid in (first, second):
+            self.assertEqual(events.index('start ' + pid) + 1, events.index('close ' + pid))
+
+    def test_restart(self):
+        self.start(lambda: _pid_app, workers=1, threads=1, keepalive_timeout=0.5)
+        before = self.get(self.connect())[1]
+        os.kill(self.server_pid, signal.SIGHUP)
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            after = self.get(self.connect())[1]
+            if after != before:
+                break
+            time.sleep(0.1)
+        self.assertNotEqual(after, before, 'Worker should have been replaced')
+
+    def test_api(self):
+        db_file = tempfile.mktemp()
+        self.addCleanup(os.remove, db_file)
+        self.start(lambda: make_api(db_file, hash_workers=0, password_iterations=1), workers=2, threads=2)
+
+        conn = self.connect()
+        resp, _ = self.get(conn, '/register', 'POST', json.dumps({'email': 'a@b.com', 'password': 'garfield'}),
+                           {'Content-Type': 'application/json'})
+        self.assertEqual(resp.status, 204)
+        # Every worker sees the database as the others have left it
+        for conn in [conn] + [self.connect() for _ in range(3)]:
+            resp, body = self.get(conn, '/users')
+            self.assertEqual(resp.status, 200)
+            self.assertEqual([user['email'] for user in json.loads(body)['users']], ['a@b.com'])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+from __future__ import absolute_import
+import itertools
+import os
+import re
+import sqlite3
+import tempfile
+
+from unittest import TestCase, main
+from .models import Repository
+from .passwords import PasswordHasher
+
+# Tables which are always tiny, so scanning them is as good as any index
+SMALL_TABLES = ('issue_stats', 'data_versions')
+
+# Statements allowed to scan a table in full, with why
+ALLOWED_SCANS = [
+    # Listing every issue with no filter at all walks the table in id order, stopping at the page size
+    (re.compile(r'^SELECT\s+i\.id.*FROM\s+issues i\s+JOIN users u1.*LEFT JOIN users u2 on i\.assigneeId = u2\.id\s*'
+                r'(WHERE i\.id > \?\s*)?ORDER BY i\.id', re.DOTALL), 'i'),
+    # The consistency check recounts everything on purpose
+    (re.compile(r'FROM closed_per_day WHERE closed != 0'), 'closed_per_day'),
+    (re.compile(r'DELETE FROM closed_per_day$'), 'closed_per_day'),
+    # Rebuilding the maximum open sweeps every issue in the order they were opened, along the covering index
+    (re.compile(r'FROM\s+issues\s+ORDER BY\s+opened_datetime,\s+closed_datetime'), 'issues'),
+    # Listing users is every user by email, along the covering index
+    (re.compile(r'FROM\s+users\s+ORDER BY\s+email'), 'users'),
+]
+
+# Statements allowed a sort, with why
+ALLOWED_SORTS = [
+    # Search results are ranked on the matches found
+    re.compile(r'ORDER BY\s+bm25\('),
+    # The consistency check recounts everything on purpose
+    re.compile(r'GROUP BY DATE\(closed_datetime\)'),
+]
+
+class QueryPlanTest(TestCase):
+    """Runs every query the repository makes and checks none of them has to scan a whole table or sort its results
+    when an index would do, so a change to a query or the schema can't quietly lose its index.
+    """
+
+    def setUp(self):
+        self.db_file = tempfile.mktemp()
+        self.statements = []
+        self.repositories = [
+            Repository(
+                self.db_file, session_cache_ttl=ttl, session_flush_interval=0, hasher=PasswordHasher(iterations=1),
+                statement_listener=lambda sql, parameters, seconds, rows: self.statements.append((sql, parameters)))
+            for ttl in (0, 60)
+        ]
+        self.repositories[0].migrate_database()
+        self.conn = sqlite3.connect(self.db_file)
+
+    def tearDown(self):
+        self.conn.close()
+        for repository in self.repositories:
+            repository.close()
+        os.remove(self.db_file)
+
+    def _run_everything(self):
+        with self.repositories[0].open() as repo:
+            repo.users.register('justin@justinware.me.uk', 'garfield')
+            repo.users.register('fred@bloggs.com', 'garfield')
+            userId, sessionId = repo.users.createSessionId('justin@justinware.me.uk', 'garfield')
+            repo.users.createSessionId('nobody@nowhere.com', 'garfield')
+            repo.users.authenticateSessionId(userId, sessionId)
+            repo.users.listUsers()
+
+            for n in range(20):
+                repo.issues.create_issue('Issue {}'.format(n), 'Description', 1 + n % 2)
+            repo.issues.create_issues([('Imported', 'Description')] * 5, 2)
+            repo.issues.update_issue(1, title='New title', description='New description', closedFlag=True, assigneeId=2)
+            repo.issues.update_issue(2, closedFlag=False, assigneeId=-1)
+            repo.issues.fetch_issue(1)
+            repo.issues.search_issues('issue', 10)
+            repo.issues.search_issues('issue', 10, closed=False, assigneeId=1, creatorId=1)
+            repo.issues.search_issues('issue', 10, assigneeId=-1)
+            repo.data_versions()
+
+            for limit, after, closed, assigneeId, creatorId in itertools.product(
+                    (None, 10), (None, 5), (None, True, False), (None, 2, -1), (None, 1)):
+                repo.issues.list_issues(limit, after, closed, assigneeId, creatorId)
+                list(repo.issues.iter_issues(limit, after, closed, assigneeId, creatorId))
+
+            repo.issues.statistics()
+            # Rewriting history means the maximum open has to be rebuilt
+            repo._conn.execute("UPDATE issues SET opened_datetime = '2000-01-01 00:00:00' WHERE id = 3")
+            repo.issues.statistics()
+            repo.issues.check_statistics()
+
+            repo.users.revokeSessionId(1)
+
+        # Sessions cached, so their expiry is extended in batches
+        with self.repositories[1].open() as repo:
+            userId, sessionId = repo.users.createSessionId('fred@bloggs.com', 'garfield')
+            repo.users.authenticateSessionId(userId, sessionId)
+            repo.users.authenticateSessionId(userId, sessionId)
+            repo.users.flushSessions()
+
+    def test_no_full_scans(self):
+        self._run_everything()
+        self.assertTrue(self.statements)
+
+        problems = []
+        # Steps the scan pattern recognised, so a change in how SQLite words its plans can't pass unnoticed
+        scans = 0
+        for sql, parameters in self.statements:
+            if not re.match(r'\s*(SELECT|INSERT|UPDATE|DELETE)\b', sql, re.IGNORECASE):
+                continue
+            plan = [row[-1] for row in self.conn.execute('EXPLAIN QUERY PLAN ' + sql, parameters)]
+            for step in plan:
+                # 'SCAN TABLE issues AS i' before SQLite 3.36, 'SCAN i' since (each possibly 'USING' an index)
+                scan = re.match(r'SCAN (?:TABLE )?(\w+)(?: AS (\w+))?(?: USING .*)?$', step)
+                scans += scan is not None
+                names = set(scan.groups()) - set([None]) if scan else set()
+                if scan and not names & set(SMALL_TABLES) and \
+                        not any(pattern.search(sql) and table in names for pattern, table in ALLOWED_SCANS):
+                    problems.append('{}\n  {}'.format(sql.strip(), step))
+                if step.startswith('USE TEMP B-TREE') and not any(pattern.search(sql) for pattern in ALLOWED_SORTS):
+                    problems.append('{}\n  {}'.format(sql.strip(), step))
+
+        self.assertTrue(scans, 'No plan step was recognised as a scan')
+        self.assertEqual(problems, [], '\n'.join(sorted(set(problems))))
+
+if __name__ == '__main__':
+    main()
@@ -1,47 +1,275 @@
 from __future__ import absolute_import
 import falcon
-from pytz import timezone
-import pytz
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from itertools import islice
 
-def _to_local(dt, clientTZ):
-    dtWithTZ = dt.replace(tzinfo = pytz.utc)
-    dtLocalWithTZ = dtWithTZ.astimezone(clientTZ)
-    dtLocal = dtLocalWithTZ.replace(tzinfo = None)
-    return dtLocal.isoformat()
+from .timezones import local_time_converter
 
-def _issue_to_json(issue, clientTZ):
+def _etag(req, *versions):
+    """A strong ETag for a response which depends only on the request and the given data versions.
+
+    Accept-Encoding is included as the response may be gzipped, which makes it a different representation with its
+    own tag (the same on a 304 as on the 200) rather than one the compression would have to weaken.
+    """
+    digest = hashlib.sha1()
+    for part in [req.path, req.query_string, req.accept, req.get_header('Accept-Encoding') or ''] + list(versions):
+        digest.update(part.encode('utf-8') if isinstance(part, unicode) else str(part))
+        digest.update('\n')
+    return '"{}"'.format(digest.hexdigest())
+
+def _not_modified(req, resp, etag):
+    """Set the response's ETag, and if the client already has that version make the response a 304.
+
+    The ETag must differ by Accept-Encoding (as '_etag' does), so the response is marked as varying by it, the 304 as
+    much as the 200 it stands for.
+    """
+    resp.etag = etag
+    resp.vary = ['Accept-Encoding']
+    if req.if_none_match is None:
+        return False
+    # If-None-Match uses the weak comparison, so ignore any 'W/'
+    tags = [tag.strip() for tag in req.if_none_match.split(',')]
+    if '*' in tags or etag in [tag[2:] if tag.startswith('W/') else tag for tag in tags]:
+        resp.status = falcon.HTTP_304
+        return True
+    return False
+
+def _issue_to_json(issue, opened, closed):
+    """The JSON for an issue, given its opened and closed datetimes already converted to the client's local time."""
     return {
         'id': issue.id,
         'title': issue.title,
         'description': issue.description,
-        'opened': _to_local(issue.opened, clientTZ) if issue.opened else None,
-        'closed': _to_local(issue.closed, clientTZ) if issue.closed else None,
+        'opened': opened,
+        'closed': closed,
         'createdBy': issue.createdBy,
         'assignedTo': issue.assignedTo
     }
 
-def _interpret_tzname(name):
-    if name is not None:
-        return timezone(name)
-    else:
-        return pytz.utc
+def _issues_to_json(issues, clientTZ):
+    """The JSON for a list of issues, converting each datetime column to local time in one go."""
+    opened = clientTZ.isoformat_all([issue.opened for issue in issues])
+    closed = clientTZ.isoformat_all([issue.closed for issue in issues])
+    return [_issue_to_json(*columns) for columns in zip(issues, opened, closed)]
+
+# The largest page of issues a client may ask for at once
+MAX_PAGE_SIZE = 1000
+
+def _issue_filters(req):
+    """Interpret the optional 'state', 'assigneeId' and 'creatorId' query parameters for listing issues."""
+    filters = {
+        'assigneeId': req.get_param_as_int('assigneeId'),
+        'creatorId': req.get_param_as_int('creatorId')
+    }
+    state = req.get_param('state')
+    if state is not None:
+        if state not in ('open', 'closed'):
+            raise falcon.HTTPInvalidParam("Must be 'open' or 'closed'", 'state')
+        filters['closed'] = state == 'closed'
+    return filters
+
+# How many search results there are unless the client asks for a different 'limit'
+SEARCH_PAGE_SIZE = 20
+
+# Newline delimited JSON, one issue per line
+MEDIA_NDJSON = 'application/x-ndjson'
+
+# How many issues are encoded and written at a time when streaming
+STREAM_BATCH_SIZE = 100
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
+
+# How many issues' JSON is kept for building listings from
+FRAGMENT_CACHE_SIZE = 20000
+
+class _FragmentCache(object):
+    """Issues already encoded as JSON, so listings only have to encode issues that have changed.
+
+    Entries are keyed by issue id, the issue's row version, the users' data version (as the JSON includes emails) and
+    the timezone, so a changed issue is simply looked up under a new key, and entries which are no longer wanted are
+    dropped once they're the least recently used of more than 'size'.
+    """
+
+    def __init__(self, size=FRAGMENT_CACHE_SIZE):
+        self._size = size
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def encode(self, batch, clientTZ, timezone, usersVersion):
+        """The JSON for each issue in an 'IssueBatch', converting datetimes to local time with 'clientTZ' (the
+        converter for the timezone named 'timezone') for any not in the cache.
+        """
+        keys = [(issue_id, version, usersVersion, timezone) for issue_id, version in zip(batch.ids, batch.versions)]
+        with self._lock:
+            fragments = [self._fragments.pop(key, None) for key in keys]
+            # Back in as the most recently used
+            for key, fragment in zip(keys, fragments):
+                if fragment is not None:
+                    self._fragments[key] = fragment
+
+        missing = [n for n, fragment in enumerate(fragments) if fragment is None]
+        if missing:
+            encoded = [json.dumps(issue) for issue in _issues_to_json([batch[n] for n in missing], clientTZ)]
+            with self._lock:
+                for n, fragment in zip(missing, encoded):
+                    fragments[n] = self._fragments[keys[n]] = fragment
+                while len(self._fragments) > self._size:
+                    self._fragments.popitem(last=False)
+        return fragments
+
+def _ndjson_chunks(batches, encode):
+    for batch in batches:
+        yield ''.join(fragment + '\n' for fragment in encode(batch))
+
+def _json_chunks(batches, encode, limit):
+    """Encode the same document as a non-streamed listing from batches of issues, which must include one beyond the
+    page if there is one.
+    """
+    yield '{"issues": ['
+    count = 0
+    lastId = None
+    more = False
+    for batch in batches:
+        if limit is not None and count + len(batch) > limit:
+            batch = batch[:limit - count]
+            more = True
+        if batch:
+            yield (', ' if count else '') + ', '.join(encode(batch))
+            count += len(batch)
+            lastId = batch.ids[-1]
+        if more:
+            break
+    yield '], "next": {}}}'.format(json.dumps(lastId if more else None))
+
+class _StreamedBody(object):
+    """A response body written as it's generated, releasing the repository connection once finished with.
+
+    The WSGI server calls 'close' even if the client goes away part way through.
+    """
+
+    def __init__(self, repo, chunks):
+        self._repo = repo
+        self._chunks = chunks
+
+    def __iter__(self):
+        try:
+            for chunk in self._chunks:
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        repo, self._repo = self._repo, None
+        if repo is not None:
+            try:
+                self._chunks.close()
+            finally:
+                repo.close()
 
 class IssuesResource(object):
     def __init__(self, repo):
         self._repo = repo
+        self._fragments = _FragmentCache()
 
     def on_get(self, req, resp):
+        """List issues. A page at a time when 'limit' is given, with 'next' being the 'after' for the next page.
+
+        With 'stream' set, or when the client prefers NDJSON, issues are written as they are read from the database.
+        With 'q' set it's instead the issues best matching those words, each with a 'snippet' of the matching text,
+        filtered as a listing is. They're a single page, ordered by how well they match, so 'after' can't be used.
+        """
         # See if a timezone is specified
         clientTZName = req.get_param('tz')
-        clientTZ = _interpret_tzname(clientTZName)
- 
+        clientTZ = local_time_converter(clientTZName)
+        limit = req.get_param_as_int('limit', min=1, max=MAX_PAGE_SIZE)
+        after = req.get_param_as_int('after')
+        filters = _issue_filters(req)
+
+        query = req.get_param('q')
+        if query is not None:
+            if after is not None:
+                raise falcon.HTTPInvalidParam("Search results aren't paged", 'after')
+            self._search(req, resp, clientTZ, query, limit if limit is not None else SEARCH_PAGE_SIZE, filters)
+            return
+
+        ndjson = req.client_prefers([MEDIA_NDJSON, falcon.MEDIA_JSON]) == MEDIA_NDJSON
+        if ndjson or req.get_param_as_bool('stream'):
+            self._stream(req, resp, clientTZ, clientTZName, limit, after, filters, ndjson)
+            return
+
         with self._repo.open() as repo:
-            issue_list = repo.issues.list_issues()
+            # The issues include users' emails, so depend on both
+            versions = repo.data_versions()
+            if _not_modified(req, resp, _etag(req, versions['issues'], versions['users'])):
+                return
+
+            # Ask for one more than the page so we know whether there's another page to come
+            batch = repo.issues.list_issue_batch(
+                limit=limit + 1 if limit is not None else None,
+                after=after,
+                **filters
+            )
+            nextCursor = None
+            if limit is not None and len(batch) > limit:
+                batch = batch[:limit]
+                nextCursor = batch.ids[-1]
+            # The same document as {'issues': [...], 'next': nextCursor} would be, but from the cached issues' JSON
+            fragments = self._fragments.encode(batch, clientTZ, clientTZName, versions['users'])
+            resp.body = '{{"issues": [{}], "next": {}}}'.format(', '.join(fragments), json.dumps(nextCursor))
+            resp.content_type = falcon.MEDIA_JSON
+            resp.status = falcon.HTTP_200
+
+    def _search(self, req, resp, clientTZ, query, limit, filters):
+        with self._repo.open() as repo:
+            versions = repo.data_versions()
+            if _not_modified(req, resp, _etag(req, versions['issues'], versions['users'])):
+                return
+
+            results = repo.issues.search_issues(query, limit, **filters)
+            issues = _issues_to_json([issue for issue, _ in results], clientTZ)
+            for issue, (_, snippet) in zip(issues, results):
+                issue['snippet'] = snippet
             resp.media = {
-                'issues': [_issue_to_json(issue, clientTZ) for issue in issue_list]
+                'issues': issues,
+                'next': None
             }
             resp.status = falcon.HTTP_200
 
+    def _stream(self, req, resp, clientTZ, clientTZName, limit, after, filters, ndjson):
+        repo = self._repo.open()
+        try:
+            versions = repo.data_versions()
+            if _not_modified(req, resp, _etag(req, versions['issues'], versions['users'])):
+                repo.close()
+                return
+
+            encode = lambda batch: self._fragments.encode(batch, clientTZ, clientTZName, versions['users'])
+            if ndjson:
+                batches = repo.issues.iter_issue_batches(
+                    limit=limit, after=after, chunk_size=STREAM_BATCH_SIZE, **filters)
+                chunks = _ndjson_chunks(batches, encode)
+                resp.content_type = MEDIA_NDJSON
+            else:
+                batches = repo.issues.iter_issue_batches(
+                    limit=limit + 1 if limit is not None else None, after=after, chunk_size=STREAM_BATCH_SIZE,
+                    **filters)
+                chunks = _json_chunks(batches, encode, limit)
+                resp.content_type = falcon.MEDIA_JSON
+        except Exception:
+            repo.close()
+            raise
+        resp.stream = _StreamedBody(repo, chunks)
+        resp.status = falcon.HTTP_200
+
     def on_post(self, req, resp):
         fields = req.media
 
@@ -58,24 +286,177 @@ class IssuesResource(object):
             )
         raise falcon.HTTPSeeOther('/issues/{}'.format(new_id))
 
+    def on_patch(self, req, resp):
+        """Update many issues at once, all or nothing. The request has 'userId', 'sessionId' and an 'issues' list of
+        objects with the 'id' of an issue and the 'fields' to update, which are the same as for a PUT to the issue.
+        """
+        fields = req.media
+
+        try:
+            items = fields.get('issues', [])
+        except AttributeError as e:
+            raise falcon.HTTPBadRequest('Invalid issues', str(e))
+        if not isinstance(items, list):
+            raise falcon.HTTPBadRequest('Invalid issues', "'issues' must be a list")
+        try:
+            changes = list(_issues_to_update(items))
+        except ValueError as e:
+            raise falcon.HTTPBadRequest('Invalid issues', str(e))
+
+        with self._repo.open() as repo:
+            # Check this has valid user id and session id
+            if not repo.users.authenticateSessionId(fields.get('userId'), fields.get('sessionId')):
+                resp.status = falcon.HTTP_401
+                return
+
+            try:
+                missing = repo.issues.update_issues(changes)
+            except ValueError as e:
+                # Leaving the block with an exception rolls back whatever was updated before it
+                raise falcon.HTTPBadRequest('Invalid issues', str(e))
+            if missing:
+                raise falcon.HTTPNotFound(description='No issues with ids {}'.format(', '.join(map(str, missing))))
+            resp.status = falcon.HTTP_204
+
+def _issue_fields(fields):
+    """Check the fields to update an issue with, returning just those with 'assigneeId' as an integer, or raising
+    'ValueError' if any is of the wrong type.
+    """
+    if not isinstance(fields, dict):
+        raise ValueError('The fields must be an object')
+    checked = {}
+    for name in ('title', 'description'):
+        if name in fields:
+            if not isinstance(fields[name], basestring):
+                raise ValueError("'{}' must be a string".format(name))
+            checked[name] = fields[name]
+    if 'closedFlag' in fields:
+        if not isinstance(fields['closedFlag'], bool):
+            raise ValueError("'closedFlag' must be true or false")
+        checked['closedFlag'] = fields['closedFlag']
+    if 'assigneeId' in fields:
+        # The UI sends the id from a select element's value, so as a string. Null or a negative id unassigns the issue.
+        assigneeId = fields['assigneeId']
+        try:
+            if isinstance(assigneeId, bool) or not isinstance(assigneeId, (int, long, basestring, type(None))):
+                raise ValueError()
+            checked['assigneeId'] = int(assigneeId) if assigneeId is not None else -1
+        except ValueError:
+            raise ValueError("'assigneeId' must be a user id or null")
+    return checked
+
+def _issues_to_update(items):
+    """Check each update has an issue id and fields, generating them as (issue id, fields) pairs."""
+    for n, item in enumerate(items):
+        if not isinstance(item, dict) or not isinstance(item.get('id'), (int, long)) or not isinstance(item.get('fields'), dict):
+            raise ValueError('Update {} needs an issue id and fields'.format(n))
+        try:
+            yield item['id'], _issue_fields(item['fields'])
+        except ValueError as e:
+            raise ValueError('Update {}: {}'.format(n, e))
+
+# How many issues a bulk import inserts per transaction
+IMPORT_CHUNK_SIZE = 500
+
+def _issues_to_import(items):
+    """Check each issue to import has a title and description, generating them as (title, description) pairs."""
+    for n, item in enumerate(items):
+        if not isinstance(item, dict) or not all(isinstance(item.get(name), basestring) for name in ('title', 'description')):
+            raise ValueError('Issue {} needs a title and a description'.format(n))
+        yield item['title'], item['description']
+
+def _ndjson_lines(stream, block_size=64 * 1024):
+    # Read in blocks rather than lines as not every WSGI server's input supports a 'readline' size limit
+    partial = b''
+    for block in iter(lambda: stream.read(block_size), b''):
+        lines = (partial + block).split(b'\n')
+        partial = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    if partial.strip():
+        yield json.loads(partial)
+
+class BulkIssuesResource(object):
+    """A resource to create many issues at once, such as when importing from another tracker."""
+
+    def __init__(self, repo):
+        self._repo = repo
+
+    def on_post(self, req, resp):
+        """Create issues from either a JSON object with 'userId', 'sessionId' and an 'issues' list, or NDJSON with the
+        user and session ids on the first line followed by an issue per line.
+
+        Issues are inserted a chunk at a time, so a problem part way through NDJSON leaves the issues before it created.
+        The response has the ids of the issues created, in order, and possibly an 'error'.
+        """
+        try:
+            if req.content_type is not None and req.content_type.startswith(MEDIA_NDJSON):
+                lines = _ndjson_lines(req.bounded_stream)
+                fields = next(lines, None)
+                issues = _issues_to_import(lines)
+            else:
+                fields = req.media
+                items = fields.get('issues', [])
+                if not isinstance(items, list):
+                    raise ValueError("'issues' must be a list")
+                # Everything's already here so check it all before creating anything
+                issues = list(_issues_to_import(items))
+        except (ValueError, AttributeError) as e:
+            raise falcon.HTTPBadRequest('Invalid issues', str(e))
+
+        with self._repo.open() as repo:
+            # Check this has valid user id and session id
+            if not isinstance(fields, dict) or \
+                    not repo.users.authenticateSessionId(fields.get('userId'), fields.get('sessionId')):
+                resp.status = falcon.HTTP_401
+                return
+
+            ids = []
+            try:
+                for batch in _batches(issues, IMPORT_CHUNK_SIZE):
+                    ids += repo.issues.create_issues(batch, fields['userId'])
+                    repo.commit()
+            except ValueError as e:
+                resp.media = { 'ids': ids, 'error': str(e) }
+            else:
+                resp.media = { 'ids': ids }
+            resp.status = falcon.HTTP_200
+
 class IssueResource(object):
     def __init__(self, repo):
         self._repo = repo
 
     def on_get(self, req, resp, issue_id):
         clientTZName = req.get_param('tz')
-        clientTZ = _interpret_tzname(clientTZName)
+        clientTZ = local_time_converter(clientTZName)
  
         with self._repo.open() as repo:
+            versions = repo.data_versions()
+            if _not_modified(req, resp, _etag(req, versions['issues'], versions['users'])):
+                return
+
             issue = repo.issues.fetch_issue(int(issue_id))
             if issue != None:
-                resp.media = _issue_to_json(issue, clientTZ)
+                resp.media = _issue_to_json(issue, clientTZ.isoformat(issue.opened), clientTZ.isoformat(issue.closed))
             else:
                 resp.media = { 'error': 'Issue does not exist' }
             resp.status = falcon.HTTP_200
 
     def on_put(self, req, resp, issue_id):
+        """Update an issue's 'title', 'description', 'closedFlag' and/or 'assigneeId' (null or negative to unassign).
+        Fields of the wrong type are a 400, and an issue that doesn't exist a 404.
+        """
         fields = req.media
+        try:
+            # The issue cache has issues by their integer id
+            issue_id = int(issue_id)
+        except ValueError:
+            raise falcon.HTTPNotFound()
+        try:
+            changes = _issue_fields(fields)
+        except ValueError as e:
+            raise falcon.HTTPBadRequest('Invalid issue', str(e))
 
         with self._repo.open() as repo:
             # Check this has valid user id and session id
@@ -83,7 +464,8 @@ class IssueResource(object):
                 resp.status_code = falcon.HTTP_401
                 return
 
-            repo.issues.update_issue(issue_id, **fields)
+            if not repo.issues.update_issue(issue_id, **changes):
+                raise falcon.HTTPNotFound()
             resp.status = falcon.HTTP_204
 
 class DashboardResource(object):
@@ -94,6 +476,11 @@ class DashboardResource(object):
     
     def on_get(self, req, resp):
         with self._repo.open() as repo:
+            # The issues closed in the last week are counted by date, so change each day even if the issues don't
+            versions = repo.data_versions()
+            if _not_modified(req, resp, _etag(req, versions['issues'], datetime.utcnow().date())):
+                return
+
             resp.media = repo.issues.statistics()
             resp.status = falcon.HTTP_200
 
@@ -166,8 +553,22 @@ class UsersResource(object):
 
     def on_get(self, req, resp):
         with self._repo.open() as repo:
+            if _not_modified(req, resp, _etag(req, repo.data_versions()['users'])):
+                return
+
             userList = repo.users.listUsers()
             resp.media = {
                 'users': [_userToJSON(user) for user in userList]
             }
             resp.status = falcon.HTTP_200
+
+class MetricsResource(object):
+    """A resource exposing the request and SQL metrics to Prometheus."""
+
+    def __init__(self, metrics):
+        self._metrics = metrics
+
+    def on_get(self, req, resp):
+        resp.body = self._metrics.render()
+        resp.content_type = 'text/plain; version=0.0.4'
+        resp.status = falcon.HTTP_200
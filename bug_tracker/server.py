@@ -1,10 +1,17 @@
 from __future__ import absolute_import
-import argparse
 import falcon
+import logging
 import os
+import signal
+import sys
 
-from .resources import IssueResource, IssuesResource, RegisterResource, LoginResource, LogoutResource, UsersResource, DashboardResource
-from .models import Repository
+from .resources import IssueResource, IssuesResource, BulkIssuesResource, RegisterResource, LoginResource, LogoutResource, UsersResource, DashboardResource, MetricsResource
+from .compression import gzip_middleware, DEFAULT_LEVEL
+from .metrics import Metrics
+from .static import StaticAssets
+from .tracing import SqlTracer, slow_query_log
+from .models import Repository, PoolTimeout
+from .passwords import PasswordHasher, HashingBusy, DEFAULT_ITERATIONS
 
 
 def _index_middleware(app):
@@ -15,25 +22,84 @@ def _index_middleware(app):
     return handler
 
 
-def make_api(database_location, migrate_database=True):
-    api = falcon.API()
-    repo = Repository(database_location)
+def _busy_handler(ex, req, resp, params):
+    # Every pooled connection or hashing worker is busy so ask the client to come back shortly
+    raise falcon.HTTPServiceUnavailable(description=str(ex), retry_after=1)
+
+
+def _statement_listeners(listeners):
+    """A single statement listener calling all of those given (or None if there aren't any)."""
+    listeners = [listener for listener in listeners if listener is not None]
+    if len(listeners) <= 1:
+        return listeners[0] if listeners else None
+
+    def listener(sql, parameters, seconds, rows):
+        for each in listeners:
+            each(sql, parameters, seconds, rows)
+    return listener
+
+
+def _issue_cache_metrics(repo):
+    statistics = repo.issue_cache_statistics()
+    if statistics is None:
+        return []
+    return [
+        ('bug_tracker_issue_cache_hits_total', 'counter',
+         'Issues fetched from the cache.', statistics['hits']),
+        ('bug_tracker_issue_cache_misses_total', 'counter',
+         'Issues fetched from the database as they were not cached or had changed.', statistics['misses']),
+        ('bug_tracker_issue_cache_evictions_total', 'counter',
+         'Issues dropped from the cache to make room for others.', statistics['evictions']),
+        ('bug_tracker_issue_cache_size', 'gauge',
+         'Issues in the cache.', statistics['size']),
+    ]
+
+
+def make_api(database_location, migrate_database=True, pool_size=5, pool_timeout=5.0, session_cache_ttl=30.0,
+             hash_workers=2, hash_queue_depth=64, password_iterations=DEFAULT_ITERATIONS, collect_metrics=True,
+             sql_tracer=None, compression_level=DEFAULT_LEVEL, issue_cache_size=1000):
+    metrics = Metrics() if collect_metrics else None
+    api = falcon.API(middleware=[metrics.component] if metrics is not None else [])
+    hasher = PasswordHasher(iterations=password_iterations, workers=hash_workers, queue_depth=hash_queue_depth)
+    repo = Repository(
+        database_location, pool_size=pool_size, pool_timeout=pool_timeout, session_cache_ttl=session_cache_ttl,
+        hasher=hasher, statement_listener=_statement_listeners([
+            metrics.statement_listener if metrics is not None else None, sql_tracer]),
+        issue_cache_size=issue_cache_size)
+    api.add_error_handler(PoolTimeout, _busy_handler)
+    api.add_error_handler(HashingBusy, _busy_handler)
     if migrate_database:
         repo.migrate_database()
     api.add_route('/issues', IssuesResource(repo))
+    api.add_route('/issues/bulk', BulkIssuesResource(repo))
     api.add_route('/issues/{issue_id}', IssueResource(repo))
     api.add_route('/login', LoginResource(repo))
     api.add_route('/logout', LogoutResource(repo))
     api.add_route('/register', RegisterResource(repo))
     api.add_route('/users', UsersResource(repo))
     api.add_route('/dashboard', DashboardResource(repo))
+    if metrics is not None:
+        metrics.add_collector(lambda: _issue_cache_metrics(repo))
+        api.add_route('/metrics', MetricsResource(metrics))
     static_dir = os.path.abspath(os.path.join(__file__, '..', '..', 'dist'))
-    api.add_static_route('/', static_dir)
-    return _index_middleware(api)
+    api.add_sink(StaticAssets(static_dir), '/')
+    app = _index_middleware(api)
+    if compression_level > 0:
+        app = gzip_middleware(app, compression_level)
+    if metrics is not None:
+        app = metrics.middleware(app)
+    # For whatever serves the application: 'start' it in the process serving it before taking requests, and 'close'
+    # it once finished with them
+    app.repository = repo
+    app.start = hasher.start
+    app.close = repo.close
+    return app
 
 
 if __name__ == '__main__':
+    import argparse
     from werkzeug.serving import make_server
+    from .prefork import serve
 
     parser = argparse.ArgumentParser(description="Run a bug tracker server")
     parser.add_argument('--interface', default='127.0.0.1',
@@ -48,11 +114,76 @@ if __name__ == '__main__':
                         help="Do not perform database migrations")
     parser.add_argument('--clean', action='store_true',
                         help="Delete the database and start from clean")
+    parser.add_argument('--pool-size', type=int, default=5,
+                        help="Maximum number of pooled database connections")
+    parser.add_argument('--pool-timeout', type=float, default=5.0,
+                        help="Seconds to wait for a free database connection")
+    parser.add_argument('--session-cache-ttl', type=float, default=30.0,
+                        help="Seconds after extending a session during which it's extended in batches (0 to disable)")
+    parser.add_argument('--hash-workers', type=int, default=2,
+                        help="Processes for hashing passwords (0 to hash in the request thread)")
+    parser.add_argument('--hash-queue-depth', type=int, default=64,
+                        help="Passwords that may wait to be hashed before logins are turned away")
+    parser.add_argument('--password-iterations', type=int, default=DEFAULT_ITERATIONS,
+                        help="PBKDF2 iterations for newly hashed passwords (existing ones are rehashed at login)")
+    parser.add_argument('--no-metrics', action='store_true',
+                        help="Do not collect request metrics or serve them at /metrics")
+    parser.add_argument('--trace-sql', action='store_true',
+                        help="Keep statistics on each SQL statement, written to stderr on SIGUSR1 (to each worker)")
+    parser.add_argument('--slow-query-ms', type=float, default=100.0,
+                        help="Log SQL statements taking at least this many milliseconds when tracing")
+    parser.add_argument('--slow-query-log',
+                        help="File to log slow SQL statements to, rather than stderr")
+    parser.add_argument('--issue-cache-size', type=int, default=1000,
+                        help="Issues to cache for fetching one at a time (0 to disable)")
+    parser.add_argument('--compression-level', type=int, default=DEFAULT_LEVEL,
+                        help="Level from 1 to 9 to gzip JSON responses at (0 to send them uncompressed)")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="Worker processes to serve from, restarted on SIGHUP (0 for a single process)")
+    parser.add_argument('--threads', type=int, default=4,
+                        help="Request threads in each worker process")
+    parser.add_argument('--keepalive-timeout', type=float, default=5.0,
+                        help="Seconds to keep an idle connection to a worker open for another request, holding one "
+                             "of its threads all the while (0 to close connections after each request)")
+    parser.add_argument('--max-requests', type=int, default=0,
+                        help="Requests a worker handles before being replaced (0 for no limit)")
+    parser.add_argument('--max-requests-jitter', type=int, default=0,
+                        help="Up to this many more requests per worker, so they aren't all replaced at once")
+    parser.add_argument('--graceful-timeout', type=float, default=30.0,
+                        help="Seconds workers have to finish their requests when stopping")
     args = parser.parse_args()
     if args.clean:
         os.remove(args.database_location)
 
-    api = make_api(args.database_location, not args.no_database_migrations)
-    httpd = make_server(args.interface, args.port, api)
-    print "Serving on {args.interface}:{args.port}".format(args=args)
-    httpd.serve_forever()
+    sql_tracer = None
+    if args.trace_sql:
+        sql_tracer = SqlTracer(args.slow_query_ms / 1000.0)
+        handler = logging.FileHandler(args.slow_query_log) if args.slow_query_log else logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        slow_query_log.addHandler(handler)
+        signal.signal(signal.SIGUSR1, lambda signum, frame: sql_tracer.dump(sys.stderr))
+
+    def make_app():
+        return make_api(
+            args.database_location, not args.no_database_migrations,
+            pool_size=args.pool_size, pool_timeout=args.pool_timeout, session_cache_ttl=args.session_cache_ttl,
+            hash_workers=args.hash_workers, hash_queue_depth=args.hash_queue_depth,
+            password_iterations=args.password_iterations, collect_metrics=not args.no_metrics,
+            sql_tracer=sql_tracer, compression_level=args.compression_level, issue_cache_size=args.issue_cache_size
+        )
+
+    if args.workers > 0:
+        # Each worker has its own metrics, SQL statistics and connection pool
+        print "Serving on {args.interface}:{args.port} with {args.workers} workers".format(args=args)
+        serve(make_app, args.interface, int(args.port), workers=args.workers, threads=args.threads,
+              keepalive_timeout=args.keepalive_timeout, max_requests=args.max_requests,
+              max_requests_jitter=args.max_requests_jitter, graceful_timeout=args.graceful_timeout)
+    else:
+        app = make_app()
+        app.start()
+        httpd = make_server(args.interface, args.port, app)
+        print "Serving on {args.interface}:{args.port}".format(args=args)
+        try:
+            httpd.serve_forever()
+        finally:
+            app.close()
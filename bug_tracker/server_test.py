@@ -1,24 +1,30 @@
 from __future__ import absolute_import
 import datetime
+import json
 import os
 import pytz
+import shutil
 import tempfile
 
 from dateutil.parser import parse as parse_date
 from falcon import testing
 
 from unittest import TestCase, main
+from . import resources
 from .server import make_api
 
 
 class APITest(TestCase):
     def setUp(self):
-        self.db_file = tempfile.mktemp()
+        # A directory of its own, so the database's -wal and -shm files go with it
+        self.directory = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.directory, 'test.db')
         self.api = make_api(self.db_file)
         self.client = testing.TestClient(self.api)
 
     def tearDown(self):
-        os.remove(self.db_file)
+        self.api.close()
+        shutil.rmtree(self.directory)
 
     def test_issue_workflow(self):
         register_resp = self.client.simulate_post(
@@ -129,6 +135,301 @@ class APITest(TestCase):
         statistics_json = dashboard_resp.json
         self.assertGreaterEqual(statistics_json['maxOpen'], 1)
     
+    def _create_issues(self, count):
+        """Register and login a user who then creates some issues, returning the user's credentials."""
+        self.client.simulate_post('/register', json={'email': 'justin@justinware.me.uk', 'password': 'garfield'})
+        login_resp = self.client.simulate_post(
+            '/login', json={'email': 'justin@justinware.me.uk', 'password': 'garfield'})
+        credentials = {'userId': login_resp.json['userId'], 'sessionId': login_resp.json['sessionId']}
+        for n in range(count):
+            fields = dict(credentials, title='Issue {}'.format(n), description='Description')
+            self.client.simulate_post('/issues', json=fields)
+        return credentials
+
+    def test_issue_paging(self):
+        credentials = self._create_issues(5)
+        self.client.simulate_put('/issues/2', json=dict(credentials, closedFlag=True))
+
+        list_resp = self.client.simulate_get('/issues')
+        self.assertEqual(len(list_resp.json['issues']), 5, 'Everything when not paging')
+        self.assertIsNone(list_resp.json['next'])
+
+        titles = []
+        after = None
+        while True:
+            params = {'limit': 2}
+            if after is not None:
+                params['after'] = after
+            page = self.client.simulate_get('/issues', params=params).json
+            titles += [issue['title'] for issue in page['issues']]
+            after = page['next']
+            if after is None:
+                break
+        self.assertEqual(titles, ['Issue {}'.format(n) for n in range(5)])
+
+        closed_resp = self.client.simulate_get('/issues', params={'state': 'closed'})
+        self.assertEqual([issue['id'] for issue in closed_resp.json['issues']], [2])
+        open_resp = self.client.simulate_get('/issues', params={'state': 'open', 'creatorId': 1, 'limit': 3})
+        self.assertEqual([issue['id'] for issue in open_resp.json['issues']], [1, 3, 4])
+        self.assertEqual(open_resp.json['next'], 4)
+
+        self.assertEqual(self.client.simulate_get('/issues', params={'state': 'wibble'}).status_code, 400)
+        self.assertEqual(self.client.simulate_get('/issues', params={'limit': 0}).status_code, 400)
+
+    def test_issue_streaming(self):
+        self._create_issues(5)
+
+        # Stream in small batches to exercise writing several chunks
+        batchSize = resources.STREAM_BATCH_SIZE
+        resources.STREAM_BATCH_SIZE = 2
+        try:
+            for params in [{}, {'limit': 2}, {'limit': 4}, {'limit': 5}, {'limit': 3, 'after': 1, 'tz': 'US/Eastern'}]:
+                expected = self.client.simulate_get('/issues', params=params).json
+                stream_resp = self.client.simulate_get('/issues', params=dict(params, stream=1))
+                self.assertEqual(stream_resp.status_code, 200)
+                self.assertEqual(stream_resp.json, expected, 'Streaming {} matches'.format(params))
+
+            ndjson_resp = self.client.simulate_get(
+                '/issues', params={'limit': 3}, headers={'Accept': 'application/x-ndjson'})
+            self.assertEqual(ndjson_resp.headers['Content-Type'], 'application/x-ndjson')
+            lines = ndjson_resp.text.splitlines()
+            self.assertEqual([json.loads(line)['title'] for line in lines], ['Issue 0', 'Issue 1', 'Issue 2'])
+        finally:
+            resources.STREAM_BATCH_SIZE = batchSize
+
+    def test_issue_json_cached(self):
+        credentials = self._create_issues(3)
+        first = self.client.simulate_get('/issues').json
+        self.assertEqual(self.client.simulate_get('/issues').json, first)
+
+        # Changed issues, and other timezones, aren't taken from the cache
+        self.client.simulate_put('/issues/2', json=dict(credentials, title='Renamed', closedFlag=True))
+        for params in [{}, {'stream': 1}]:
+            issues = self.client.simulate_get('/issues', params=params).json['issues']
+            self.assertEqual([issue['title'] for issue in issues], ['Issue 0', 'Renamed', 'Issue 2'])
+            self.assertIsNotNone(issues[1]['closed'])
+            self.assertEqual([issues[0], issues[2]], [first['issues'][0], first['issues'][2]])
+
+        eastern = self.client.simulate_get('/issues', params={'tz': 'US/Eastern'}).json['issues']
+        self.assertNotEqual(eastern[0]['opened'], first['issues'][0]['opened'])
+        self.assertEqual(
+            parse_date(eastern[0]['opened']),
+            pytz.timezone('US/Eastern').fromutc(parse_date(first['issues'][0]['opened'])).replace(tzinfo=None))
+
+    def test_bulk_import(self):
+        credentials = self._create_issues(1)
+
+        chunkSize = resources.IMPORT_CHUNK_SIZE
+        resources.IMPORT_CHUNK_SIZE = 2
+        try:
+            issues = [{'title': 'Bulk {}'.format(n), 'description': 'Imported'} for n in range(5)]
+            bulk_resp = self.client.simulate_post('/issues/bulk', json=dict(credentials, issues=issues))
+            self.assertEqual(bulk_resp.status_code, 200)
+            self.assertEqual(bulk_resp.json, {'ids': [2, 3, 4, 5, 6]})
+
+            lines = [json.dumps(credentials)] + [json.dumps(issue) for issue in issues[:3]]
+            bulk_resp = self.client.simulate_post(
+                '/issues/bulk', body='\n'.join(lines) + '\n', headers={'Content-Type': 'application/x-ndjson'})
+            self.assertEqual(bulk_resp.json, {'ids': [7, 8, 9]})
+
+            # A bad issue part way through NDJSON stops the import there, leaving the chunks before it imported
+            lines = [json.dumps(credentials)] + [json.dumps(issue) for issue in issues[:3]] + ['{"title": "No description"}']
+            bulk_resp = self.client.simulate_post(
+                '/issues/bulk', body='\n'.join(lines), headers={'Content-Type': 'application/x-ndjson'})
+            self.assertEqual(bulk_resp.json['ids'], [10, 11])
+            self.assertIn('error', bulk_resp.json)
+
+            # Whereas nothing's imported from JSON unless it's all good
+            bulk_resp = self.client.simulate_post(
+                '/issues/bulk', json=dict(credentials, issues=issues + [{'title': 'No description'}]))
+            self.assertEqual(bulk_resp.status_code, 400)
+            for notAList in (5, issues[0], 'issues'):
+                bulk_resp = self.client.simulate_post('/issues/bulk', json=dict(credentials, issues=notAList))
+                self.assertEqual(bulk_resp.status_code, 400, 'issues as {!r}'.format(notAList))
+        finally:
+            resources.IMPORT_CHUNK_SIZE = chunkSize
+
+        issues_resp = self.client.simulate_get('/issues')
+        self.assertEqual(
+            [issue['title'] for issue in issues_resp.json['issues']],
+            ['Issue 0'] + ['Bulk {}'.format(n) for n in range(5)] + ['Bulk {}'.format(n) for n in range(3)] + ['Bulk 0', 'Bulk 1'])
+        self.assertEqual(self.client.simulate_get('/dashboard').json['maxOpen'], 11)
+
+        bulk_resp = self.client.simulate_post(
+            '/issues/bulk', json={'userId': credentials['userId'], 'sessionId': 'wrong', 'issues': issues})
+        self.assertEqual(bulk_resp.status_code, 401)
+
+    def test_batch_update(self):
+        credentials = self._create_issues(3)
+
+        patch_resp = self.client.simulate_patch('/issues', json=dict(credentials, issues=[
+            {'id': 1, 'fields': {'closedFlag': True}},
+            {'id': 3, 'fields': {'closedFlag': True, 'title': 'Closed too'}}
+        ]))
+        self.assertEqual(patch_resp.status_code, 204)
+        issues_resp = self.client.simulate_get('/issues', params={'state': 'open'})
+        self.assertEqual([issue['id'] for issue in issues_resp.json['issues']], [2])
+        self.assertEqual(self.client.simulate_get('/issues/3').json['title'], 'Closed too')
+
+        # Nothing is updated if any of the updates is bad
+        patch_resp = self.client.simulate_patch('/issues', json=dict(credentials, issues=[
+            {'id': 2, 'fields': {'closedFlag': True}},
+            {'id': 3, 'fields': {'assigneeId': 'nobody'}}
+        ]))
+        self.assertEqual(patch_resp.status_code, 400)
+        patch_resp = self.client.simulate_patch('/issues', json=dict(credentials, issues=[{'id': 2}]))
+        self.assertEqual(patch_resp.status_code, 400)
+        for issues in (5, {'id': 2, 'fields': {'closedFlag': True}}, 'issues'):
+            patch_resp = self.client.simulate_patch('/issues', json=dict(credentials, issues=issues))
+            self.assertEqual(patch_resp.status_code, 400, 'issues as {!r}'.format(issues))
+        self.assertIsNone(self.client.simulate_get('/issues/2').json['closed'])
+
+        patch_resp = self.client.simulate_patch('/issues', json=dict(credentials, issues=[
+            {'id': 2, 'fields': {'closedFlag': True}},
+            {'id': 3, 'fields': {'title': {'not': 'a string'}}}
+        ]))
+        self.assertEqual(patch_resp.status_code, 400)
+        patch_resp = self.client.simulate_patch('/issues', json=dict(credentials, issues=[
+            {'id': 2, 'fields': {'closedFlag': True}},
+            {'id': 99, 'fields': {'closedFlag': True}}
+        ]))
+        self.assertEqual(patch_resp.status_code, 404)
+        self.assertIsNone(self.client.simulate_get('/issues/2').json['closed'])
+
+        patch_resp = self.client.simulate_patch('/issues', json={
+            'userId': credentials['userId'], 'sessionId': 'wrong', 'issues': []})
+        self.assertEqual(patch_resp.status_code, 401)
+
+    def test_unchanged_update_keeps_etags(self):
+        credentials = self._create_issues(2)
+        self.client.simulate_put('/issues/1', json=dict(credentials, closedFlag=True))
+        etags = [self.client.simulate_get(path).headers['etag'] for path in ('/issues', '/issues/1')]
+        closed = self.client.simulate_get('/issues/1').json['closed']
+
+        # Closing again, or saving the edit form as it is (which sends every field), changes nothing
+        for fields in ({'closedFlag': True},
+                       {'title': 'Issue 0', 'description': 'Description', 'closedFlag': True, 'assigneeId': '-1'}):
+            self.assertEqual(self.client.simulate_put('/issues/1', json=dict(credentials, **fields)).status_code, 204)
+            self.assertEqual([self.client.simulate_get(path).headers['etag'] for path in ('/issues', '/issues/1')], etags)
+        self.assertEqual(self.client.simulate_get('/issues/1').json['closed'], closed)
+
+        self.client.simulate_put('/issues/1', json=dict(credentials, title='Issue 0', closedFlag=False))
+        self.assertIsNone(self.client.simulate_get('/issues/1').json['closed'])
+        self.assertNotEqual(self.client.simulate_get('/issues').headers['etag'], etags[0])
+
+    def test_update_validation(self):
+        credentials = self._create_issues(1)
+        for fields in ({'title': ['a', 'list']}, {'description': None}, {'closedFlag': 'yes'}, {'assigneeId': 'nobody'},
+                       {'assigneeId': True}):
+            self.assertEqual(self.client.simulate_put('/issues/1', json=dict(credentials, **fields)).status_code, 400)
+        self.assertEqual(self.client.simulate_put('/issues/99', json=dict(credentials, title='Nowhere')).status_code, 404)
+
+        # As the UI sends it, the id from a select element
+        self.assertEqual(self.client.simulate_put('/issues/1', json=dict(
+            credentials, assigneeId=str(credentials['userId']))).status_code, 204)
+        self.assertEqual(self.client.simulate_get('/issues/1').json['assignedTo'], 'justin@justinware.me.uk')
+        self.assertEqual(self.client.simulate_put('/issues/1', json=dict(credentials, assigneeId=None)).status_code, 204)
+        self.assertIsNone(self.client.simulate_get('/issues/1').json['assignedTo'])
+
+    def test_search(self):
+        credentials = self._create_issues(3)
+        self.client.simulate_put('/issues/2', json=dict(credentials, description='The search box is missing'))
+
+        search_resp = self.client.simulate_get('/issues', params={'q': 'search'})
+        self.assertEqual(search_resp.status_code, 200)
+        self.assertEqual(
+            [(issue['id'], issue['snippet']) for issue in search_resp.json['issues']],
+            [(2, 'The [search] box is missing')])
+        self.assertEqual(search_resp.json['issues'][0]['createdBy'], 'justin@justinware.me.uk')
+
+        search_resp = self.client.simulate_get('/issues', params={'q': 'issue', 'limit': 2})
+        self.assertEqual(len(search_resp.json['issues']), 2)
+
+        # Including words that aren't ASCII
+        self.client.simulate_put('/issues/3', json=dict(credentials, title=u'Issue 2 at the caf\xe9'))
+        search_resp = self.client.simulate_get('/issues', query_string='q=caf%C3%A9')
+        self.assertEqual(search_resp.status_code, 200)
+        self.assertEqual([issue['id'] for issue in search_resp.json['issues']], [3])
+
+        # Filtered as a listing is, but not paged
+        self.client.simulate_put('/issues/1', json=dict(credentials, closedFlag=True))
+        search_resp = self.client.simulate_get('/issues', params={'q': 'issue', 'state': 'open'})
+        self.assertEqual(sorted(issue['id'] for issue in search_resp.json['issues']), [2, 3])
+        search_resp = self.client.simulate_get('/issues', params={'q': 'issue', 'creatorId': credentials['userId'] + 1})
+        self.assertEqual(search_resp.json['issues'], [])
+        self.assertEqual(self.client.simulate_get('/issues', params={'q': 'issue', 'after': 1}).status_code, 400)
+
+    def test_conditional_get(self):
+        credentials = self._create_issues(2)
+
+        for path in ('/issues', '/issues/1', '/users', '/dashboard'):
+            first_resp = self.client.simulate_get(path)
+            etag = first_resp.headers['etag']
+            cached_resp = self.client.simulate_get(path, headers={'If-None-Match': etag})
+            self.assertEqual(cached_resp.status_code, 304, path)
+            self.assertEqual(cached_resp.headers['etag'], etag)
+            self.assertEqual(cached_resp.content, b'')
+
+        # The query string is part of the tag
+        etag = self.client.simulate_get('/issues').headers['etag']
+        self.assertNotEqual(self.client.simulate_get('/issues', params={'tz': 'Europe/London'}).headers['etag'], etag)
+        stream_resp = self.client.simulate_get('/issues', params={'stream': 'true'})
+        self.assertEqual(
+            self.client.simulate_get(
+                '/issues', params={'stream': 'true'}, headers={'If-None-Match': stream_resp.headers['etag']}).status_code,
+            304)
+
+        # Any change to the issues gives a new tag
+        self.client.simulate_put('/issues/2', json=dict(credentials, closedFlag=True))
+        changed_resp = self.client.simulate_get('/issues', headers={'If-None-Match': etag})
+        self.assertEqual(changed_resp.status_code, 200)
+        self.assertNotEqual(changed_resp.headers['etag'], etag)
+
+        # Whereas logging in again doesn't change the users
+        etag = self.client.simulate_get('/users').headers['etag']
+        self.client.simulate_post('/login', json={'email': 'justin@justinware.me.uk', 'password': 'garfield'})
+        self.assertEqual(self.client.simulate_get('/users', headers={'If-None-Match': etag}).status_code, 304)
+        self.client.simulate_post('/register', json={'email': 'fred@bloggs.com', 'password': 'garfield'})
+        self.assertEqual(self.client.simulate_get('/users', headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_metrics(self):
+        self._create_issues(2)
+        self.client.simulate_get('/issues/1')
+        self.client.simulate_get('/issues/2')
+        self.client.simulate_get('/issues', params={'stream': 'true'})
+
+        metrics_resp = self.client.simulate_get('/metrics')
+        self.assertEqual(metrics_resp.status_code, 200)
+        self.assertTrue(metrics_resp.headers['content-type'].startswith('text/plain'))
+        lines = metrics_resp.text.splitlines()
+        self.assertIn('bug_tracker_requests_total{method="GET",route="/issues/{issue_id}",status="200"} 2', lines)
+        self.assertIn('bug_tracker_requests_total{method="POST",route="/issues",status="303"} 2', lines)
+        self.assertIn('bug_tracker_request_duration_seconds_count{method="GET",route="/issues"} 1', lines)
+        # Checking the data versions, then the issue's version, then fetching the issue
+        self.assertIn('bug_tracker_request_sql_statements_sum{method="GET",route="/issues/{issue_id}"} 6', lines)
+        self.assertIn('bug_tracker_issue_cache_misses_total 2', lines)
+
+        # Only the versions when it's cached
+        self.client.simulate_get('/issues/1')
+        lines = self.client.simulate_get('/metrics').text.splitlines()
+        self.assertIn('bug_tracker_request_sql_statements_sum{method="GET",route="/issues/{issue_id}"} 8', lines)
+        self.assertIn('bug_tracker_issue_cache_hits_total 1', lines)
+        self.assertIn('bug_tracker_issue_cache_size 2', lines)
+
+    def test_put_evicts_cached_issue(self):
+        credentials = self._create_issues(2)
+        self.client.simulate_get('/issues/1')
+        self.client.simulate_get('/issues/2')
+        self.assertEqual(self.api.repository.issue_cache_statistics()['size'], 2)
+
+        self.client.simulate_put('/issues/1', json=dict(credentials, title='Renamed'))
+        statistics = self.api.repository.issue_cache_statistics()
+        self.assertEqual(statistics['size'], 1)
+        self.assertEqual(self.client.simulate_get('/issues/1').json['title'], 'Renamed')
+        self.assertEqual(self.api.repository.issue_cache_statistics()['misses'], statistics['misses'] + 1)
+
+        self.assertEqual(self.client.simulate_put('/issues/first', json=credentials).status_code, 404)
+
     def test_nonexistent_issues(self):
         fetch_resp = self.client.simulate_get('/issues/1')
         self.assertEqual(fetch_resp.status_code, 200, 'Succeeds but returns error in JSON')
@@ -0,0 +1,151 @@
+from __future__ import absolute_import
+import falcon
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import stat
+from io import BytesIO
+
+try:
+    import brotli
+except ImportError:
+    # Brotli is optional, without it assets are only gzipped
+    brotli = None
+
+from .resources import _not_modified
+
+# Parcel names its outputs with a hash of their content, such as 'src.3f1b8c2e.js', so they never change
+_FINGERPRINTED = re.compile(r'\.[0-9a-f]{8}\.\w+$')
+
+# How long clients may cache fingerprinted assets, and everything else (such as 'index.html') for which they must check
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+# Assets smaller than this many bytes are sent as they are
+COMPRESS_MIN_SIZE = 256
+
+# Content codings in the order they're preferred, when the client accepts them and they made the asset smaller
+_PREFERRED_ENCODINGS = ('br', 'gzip')
+
+
+def _gzip(data):
+    out = BytesIO()
+    # No name or time in the header, so the same file always compresses the same way
+    with gzip.GzipFile(filename='', mode='wb', compresslevel=9, fileobj=out, mtime=0) as f:
+        f.write(data)
+    return out.getvalue()
+
+# Each way of compressing assets, by content coding
+_COMPRESSORS = [('gzip', _gzip)] + ([('br', brotli.compress)] if brotli is not None else [])
+
+def _accepted_encodings(header):
+    """The content codings a client accepts, by their q-values, from its Accept-Encoding header."""
+    accepted = {}
+    for coding in (header or '').split(','):
+        name, _, parameters = coding.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for parameter in parameters.split(';'):
+            key, _, value = parameter.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+class _Asset(object):
+    def __init__(self, data, content_type, cache_control, modified):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        # The file's (modification time, size) when it was read
+        self.modified = modified
+        digest = hashlib.sha1(data).hexdigest()
+        # (body, ETag) by content coding, each coding being a different representation with its own ETag
+        self.variants = {'identity': (data, '"{}"'.format(digest))}
+        if len(data) >= COMPRESS_MIN_SIZE:
+            for encoding, compress in _COMPRESSORS:
+                compressed = compress(data)
+                if len(compressed) < len(data):
+                    self.variants[encoding] = (compressed, '"{}-{}"'.format(digest, encoding))
+
+    def variant(self, accept_encoding):
+        """The content coding, body and ETag to send to a client with the given Accept-Encoding header."""
+        accepted = _accepted_encodings(accept_encoding)
+        for encoding in _PREFERRED_ENCODINGS:
+            if encoding in self.variants and accepted.get(encoding, accepted.get('*', 0)) > 0:
+                return (encoding, ) + self.variants[encoding]
+        return ('identity', ) + self.variants['identity']
+
+class StaticAssets(object):
+    """A Falcon sink serving the files under a directory, all read (and compressed) into memory up front.
+
+    Each file is served gzipped, or brotli compressed if the 'brotli' package is installed, to clients accepting that,
+    with an ETag of its content. Parcel's fingerprinted outputs may be cached indefinitely, and are only ever read
+    once. Anything else (such as 'index.html') is read again when the file changes, and files added since (as when
+    'npm run-script watch' rebuilds) are read when first requested.
+    """
+
+    def __init__(self, directory):
+        self._directory = os.path.abspath(directory)
+        # By request path
+        self._assets = {}
+        for parent, _, names in os.walk(self._directory):
+            for name in names:
+                path = os.path.join(parent, name)
+                self._read('/' + os.path.relpath(path, self._directory).replace(os.sep, '/'), path)
+
+    def _read(self, request_path, path):
+        modified = os.stat(path)
+        with open(path, 'rb') as f:
+            data = f.read()
+        content_type, _ = mimetypes.guess_type(path)
+        asset = self._assets[request_path] = _Asset(
+            data, content_type or 'application/octet-stream',
+            IMMUTABLE_CACHE_CONTROL if _FINGERPRINTED.search(path) else REVALIDATE_CACHE_CONTROL,
+            (modified.st_mtime, modified.st_size))
+        return asset
+
+    def _asset(self, request_path):
+        asset = self._assets.get(request_path)
+        if asset is not None and asset.cache_control == IMMUTABLE_CACHE_CONTROL:
+            return asset
+
+        path = os.path.normpath(os.path.join(self._directory, request_path.lstrip('/')))
+        if not path.startswith(self._directory + os.sep):
+            return None
+        try:
+            modified = os.stat(path)
+        except OSError:
+            # Possibly only until a rebuild has finished, so the last version read is still served
+            return asset
+        if not stat.S_ISREG(modified.st_mode):
+            return None
+        if asset is None or asset.modified != (modified.st_mtime, modified.st_size):
+            try:
+                asset = self._read(request_path, path)
+            except (IOError, OSError):
+                pass
+        return asset
+
+    def __call__(self, req, resp):
+        asset = self._asset(req.path)
+        if asset is None:
+            raise falcon.HTTPNotFound()
+        if req.method not in ('GET', 'HEAD'):
+            raise falcon.HTTPMethodNotAllowed(['GET', 'HEAD'])
+
+        encoding, body, etag = asset.variant(req.get_header('Accept-Encoding'))
+        resp.set_header('Cache-Control', asset.cache_control)
+        if _not_modified(req, resp, etag):
+            return
+        resp.content_type = asset.content_type
+        if encoding != 'identity':
+            resp.set_header('Content-Encoding', encoding)
+        resp.data = body
@@ -0,0 +1,115 @@
+from __future__ import absolute_import
+import falcon
+import gzip
+import os
+import shutil
+import tempfile
+from io import BytesIO
+
+from falcon import testing
+from unittest import TestCase, main
+from .static import StaticAssets, IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL, _accepted_encodings
+
+
+class StaticAssetsTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.files = {
+            'index.html': '<html><script src="/src.1a2b3c4d.js"></script></html>\n' * 20,
+            'src.1a2b3c4d.js': 'console.log("Hello");\n' * 100,
+            'icons/tiny.svg': '<svg/>'
+        }
+        for name, content in self.files.items():
+            path = os.path.join(self.directory, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as f:
+                f.write(content)
+
+        api = falcon.API()
+        api.add_sink(StaticAssets(self.directory), '/')
+        self.client = testing.TestClient(api)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_served_from_memory(self):
+        assets = StaticAssets(self.directory)
+        shutil.rmtree(self.directory)
+        os.makedirs(self.directory)
+        api = falcon.API()
+        api.add_sink(assets, '/')
+
+        resp = testing.TestClient(api).simulate_get('/index.html')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content, self.files['index.html'])
+        self.assertEqual(resp.headers['content-type'], 'text/html')
+        self.assertNotIn('content-encoding', resp.headers)
+
+    def test_compressed_variants(self):
+        resp = self.client.simulate_get('/src.1a2b3c4d.js', headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(resp.headers['content-encoding'], 'gzip')
+        self.assertEqual(resp.headers['vary'], 'Accept-Encoding')
+        self.assertLess(len(resp.content), len(self.files['src.1a2b3c4d.js']))
+        self.assertEqual(gzip.GzipFile(fileobj=BytesIO(resp.content)).read(), self.files['src.1a2b3c4d.js'])
+
+        plain = self.client.simulate_get('/src.1a2b3c4d.js', headers={'Accept-Encoding': 'gzip;q=0'})
+        self.assertNotIn('content-encoding', plain.headers)
+        self.assertEqual(plain.content, self.files['src.1a2b3c4d.js'])
+        self.assertNotEqual(plain.headers['etag'], resp.headers['etag'], 'Each variant should have its own ETag')
+
+        # Not worth compressing
+        tiny = self.client.simulate_get('/icons/tiny.svg', headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('content-encoding', tiny.headers)
+        self.assertEqual(tiny.content, '<svg/>')
+
+    def test_caching(self):
+        script = self.client.simulate_get('/src.1a2b3c4d.js')
+        self.assertEqual(script.headers['cache-control'], IMMUTABLE_CACHE_CONTROL)
+        page = self.client.simulate_get('/index.html')
+        self.assertEqual(page.headers['cache-control'], REVALIDATE_CACHE_CONTROL)
+
+        resp = self.client.simulate_get('/index.html', headers={'If-None-Match': page.headers['etag']})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.content, '')
+
+    def test_rebuilt(self):
+        page = self.client.simulate_get('/index.html')
+        # As 'npm run-script watch' does, with a different size so the change is seen whatever the mtime resolution
+        self.files['index.html'] = '<html><script src="/src.5e6f7a8b.js"></script></html>\n'
+        with open(os.path.join(self.directory, 'index.html'), 'wb') as f:
+            f.write(self.files['index.html'])
+        with open(os.path.join(self.directory, 'src.5e6f7a8b.js'), 'wb') as f:
+            f.write('console.log("Rebuilt");\n')
+
+        rebuilt = self.client.simulate_get('/index.html')
+        self.assertEqual(rebuilt.content, self.files['index.html'])
+        self.assertNotEqual(rebuilt.headers['etag'], page.headers['etag'])
+        script = self.client.simulate_get('/src.5e6f7a8b.js')
+        self.assertEqual(script.status_code, 200)
+        self.assertEqual(script.headers['cache-control'], IMMUTABLE_CACHE_CONTROL)
+
+    def test_not_built_yet(self):
+        directory = os.path.join(self.directory, 'dist')
+        api = falcon.API()
+        api.add_sink(StaticAssets(directory), '/')
+        client = testing.TestClient(api)
+        self.assertEqual(client.simulate_get('/index.html').status_code, 404)
+
+        os.makedirs(directory)
+        with open(os.path.join(directory, 'index.html'), 'wb') as f:
+            f.write('<html></html>')
+        self.assertEqual(client.simulate_get('/index.html').content, '<html></html>')
+
+    def test_missing(self):
+        self.assertEqual(self.client.simulate_get('/nothing.js').status_code, 404)
+        self.assertEqual(self.client.simulate_get('/../static.py').status_code, 404)
+        self.assertEqual(self.client.simulate_post('/index.html').status_code, 405)
+        self.assertEqual(self.client.simulate_head('/index.html').status_code, 200)
+
+    def test_accepted_encodings(self):
+        self.assertEqual(_accepted_encodings(None), {})
+        self.assertEqual(_accepted_encodings('gzip, br;q=0.5, *;q=0'), {'gzip': 1.0, 'br': 0.5, '*': 0.0})
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+from __future__ import absolute_import
+from bisect import bisect_right
+from datetime import datetime
+
+# Converters already built, by timezone name
+_converters = {}
+
+
+def local_time_converter(name):
+    """Get the (shared) converter for a timezone name, or for UTC if there's no name.
+
+    Raises 'pytz.UnknownTimeZoneError' if the name isn't recognised.
+    """
+    converter = _converters.get(name)
+    if converter is None:
+        import pytz
+        converter = LocalTimeConverter(pytz.timezone(name) if name is not None else pytz.utc)
+        _converters[name] = converter
+    return converter
+
+
+class LocalTimeConverter(object):
+    """Converts naive UTC datetimes to ISO 8601 strings in local time (without the UTC offset).
+
+    Gives the same results as converting with 'astimezone' but looks the UTC offset up in a table of the timezone's
+    transitions, so there's no per-datetime timezone object handling.
+    """
+
+    def __init__(self, tz):
+        # The UTC datetimes at which the offset changes, and the offset from then on. Timezones which never change have
+        # a single offset for all time.
+        transitions = getattr(tz, '_utc_transition_times', None)
+        if transitions:
+            self._transitions = list(transitions)
+            self._offsets = [info[0] for info in tz._transition_info]
+        else:
+            self._transitions = [datetime.min]
+            self._offsets = [tz.utcoffset(datetime.min)]
+
+    def isoformat(self, dt):
+        """Convert a single datetime, or None."""
+        if dt is None:
+            return None
+        return (dt + self._offsets[self._index(dt)]).isoformat()
+
+    def isoformat_all(self, datetimes):
+        """Convert a whole column of datetimes (or Nones) in one pass.
+
+        The offset found for one datetime is reused for the next as long as it falls between the same transitions,
+        which for the usual run of recent datetimes is nearly always.
+        """
+        transitions = self._transitions
+        converted = []
+        start = end = offset = None
+        for dt in datetimes:
+            if dt is None:
+                converted.append(None)
+                continue
+            if start is None or not start <= dt < end:
+                index = self._index(dt)
+                start = transitions[index]
+                end = transitions[index + 1] if index + 1 < len(transitions) else datetime.max
+                offset = self._offsets[index]
+            converted.append((dt + offset).isoformat())
+        return converted
+
+    def _index(self, dt):
+        return max(0, bisect_right(self._transitions, dt) - 1)
@@ -0,0 +1,43 @@
+from __future__ import absolute_import
+from datetime import datetime, timedelta
+import pytz
+
+from unittest import TestCase, main
+from .timezones import local_time_converter
+
+
+def _astimezone_isoformat(dt, tz):
+    """The straightforward (but slower) conversion the converter should agree with."""
+    return dt.replace(tzinfo=pytz.utc).astimezone(tz).replace(tzinfo=None).isoformat()
+
+
+class LocalTimeConverterTest(TestCase):
+    def test_matches_astimezone(self):
+        # Every few hours through a couple of years, crossing daylight saving changes
+        datetimes = [datetime(2018, 1, 1) + timedelta(hours=7 * n, seconds=n) for n in range(2500)]
+        datetimes.append(datetime(1850, 1, 1))
+        for name in ['US/Eastern', 'Europe/London', 'Australia/Lord_Howe', 'Asia/Kolkata', 'EST', 'UTC']:
+            tz = pytz.timezone(name)
+            converter = local_time_converter(name)
+            expected = [_astimezone_isoformat(dt, tz) for dt in datetimes]
+            self.assertEqual([converter.isoformat(dt) for dt in datetimes], expected, name)
+            self.assertEqual(converter.isoformat_all(datetimes), expected, name)
+            self.assertEqual(converter.isoformat_all(reversed(datetimes)), list(reversed(expected)), name)
+
+    def test_daylight_saving_boundary(self):
+        converter = local_time_converter('Europe/London')
+        self.assertEqual(
+            converter.isoformat_all([datetime(2019, 3, 31, 0, 59, 59), datetime(2019, 3, 31, 1), None]),
+            ['2019-03-31T00:59:59', '2019-03-31T02:00:00', None])
+
+    def test_utc_by_default(self):
+        self.assertEqual(local_time_converter(None).isoformat(datetime(2019, 2, 7, 12, 30)), '2019-02-07T12:30:00')
+
+    def test_shared(self):
+        self.assertIs(local_time_converter('US/Eastern'), local_time_converter('US/Eastern'))
+        with self.assertRaises(pytz.UnknownTimeZoneError):
+            local_time_converter('Nowhere/Special')
+
+
+if __name__ == '__main__':
+    main()
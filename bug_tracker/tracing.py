@@ -0,0 +1,86 @@
+from __future__ import absolute_import
+import logging
+import re
+import threading
+
+# Where statements slower than the threshold are logged
+slow_query_log = logging.getLogger('bug_tracker.slow_queries')
+slow_query_log.addHandler(logging.NullHandler())
+
+_WHITESPACE = re.compile(r'\s+')
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r'\bIN \(\?(?:, ?\?)*\)', re.IGNORECASE)
+
+
+def normalise(sql):
+    """The shape of a statement, so the same statement with different values in it is recognised as such.
+
+    Whitespace is collapsed and literal strings and numbers become '?', and so does a list of them for 'IN' whatever
+    its length.
+    """
+    sql = _LITERALS.sub('?', sql)
+    sql = _WHITESPACE.sub(' ', sql).strip()
+    return _IN_LISTS.sub('IN (?...)', sql)
+
+
+class SqlTracer(object):
+    """Keeps statistics on each statement run through a repository, logging any slower than 'slow_threshold' seconds
+    to 'bug_tracker.slow_queries'.
+
+    Pass it as a repository's 'statement_listener' to trace that repository's statements.
+    """
+
+    def __init__(self, slow_threshold=0.1):
+        self._slow_threshold = slow_threshold
+        self._lock = threading.Lock()
+        # [count, total seconds, maximum seconds, total rows] keyed by normalised statement
+        self._statements = {}
+        # The shapes of the statements already seen, so each is only normalised once
+        self._normalised = {}
+
+    def __call__(self, sql, parameters, seconds, rows):
+        normalised = self._normalised.get(sql)
+        if normalised is None:
+            normalised = self._normalised[sql] = normalise(sql)
+
+        with self._lock:
+            statistics = self._statements.get(normalised)
+            if statistics is None:
+                statistics = self._statements[normalised] = [0, 0.0, 0.0, 0]
+            statistics[0] += 1
+            statistics[1] += seconds
+            statistics[2] = max(statistics[2], seconds)
+            statistics[3] += rows
+
+        # Not the parameters, which include session ids and password hashes
+        if seconds >= self._slow_threshold:
+            slow_query_log.warning('Slow query took %.1fms for %d rows: %s', seconds * 1000, rows, normalised)
+
+    def report(self):
+        """The statistics for each statement seen, the one taking the most time altogether first."""
+        with self._lock:
+            statements = [(sql, list(statistics)) for sql, statistics in self._statements.items()]
+        return [
+            {
+                'sql': sql,
+                'count': count,
+                'totalSeconds': total,
+                'meanSeconds': total / count,
+                'maxSeconds': maximum,
+                'rows': rows
+            }
+            for sql, (count, total, maximum, rows) in sorted(statements, key=lambda statement: -statement[1][1])
+        ]
+
+    def dump(self, out):
+        """Write the report as a table to a file."""
+        out.write('{:>8} {:>10} {:>9} {:>9} {:>9}  {}\n'.format('count', 'total ms', 'mean ms', 'max ms', 'rows', 'sql'))
+        for statement in self.report():
+            out.write('{:>8} {:>10.1f} {:>9.3f} {:>9.3f} {:>9}  {}\n'.format(
+                statement['count'], statement['totalSeconds'] * 1000, statement['meanSeconds'] * 1000,
+                statement['maxSeconds'] * 1000, statement['rows'], statement['sql']))
+        out.flush()
+
+    def reset(self):
+        with self._lock:
+            self._statements = {}
@@ -0,0 +1,98 @@
+from __future__ import absolute_import
+import logging
+import os
+import tempfile
+from StringIO import StringIO
+
+from unittest import TestCase, main
+from .models import Repository
+from .passwords import PasswordHasher
+from .tracing import SqlTracer, normalise, slow_query_log
+
+
+class NormaliseTest(TestCase):
+    def test_normalise(self):
+        self.assertEqual(
+            normalise("""SELECT id
+                FROM users
+                WHERE email = 'it''s@here.com' AND id > 10 AND u1.id IN (?, ?,?) AND u2.id in (1, 2)"""),
+            'SELECT id FROM users WHERE email = ? AND id > ? AND u1.id IN (?...) AND u2.id IN (?...)')
+        self.assertEqual(
+            normalise("UPDATE users SET expiresAt = DATETIME('now', '+1 hour') WHERE id = ?"),
+            'UPDATE users SET expiresAt = DATETIME(?, ?) WHERE id = ?')
+
+class _Records(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+class SqlTracerTest(TestCase):
+    def setUp(self):
+        self.db_file = tempfile.mktemp()
+
+    def tearDown(self):
+        os.remove(self.db_file)
+
+    def _run(self, tracer):
+        repository = Repository(
+            self.db_file, session_cache_ttl=0, hasher=PasswordHasher(iterations=1), statement_listener=tracer)
+        repository.migrate_database()
+        try:
+            with repository.open() as repo:
+                repo.users.register('justin@justinware.me.uk', 'garfield')
+                repo.users.createSessionId('justin@justinware.me.uk', 'garfield')
+                for n in range(3):
+                    repo.issues.create_issue('Issue {}'.format(n), 'Description', 1)
+                repo.issues.update_issues([(1, {'closedFlag': True}), (2, {'closedFlag': True})])
+                repo.issues.list_issues()
+                repo.issues.fetch_issue(1)
+                repo.issues.fetch_issue(2)
+        finally:
+            repository.close()
+
+    def test_statistics(self):
+        tracer = SqlTracer()
+        self._run(tracer)
+        report = dict((statement['sql'], statement) for statement in tracer.report())
+
+        fetch = report[normalise(
+            'SELECT i.id, i.title, i.description, i.opened_datetime, i.closed_datetime, u1.email, u2.email, i.version '
+            'FROM issues i JOIN users u1 ON i.creatorId = u1.id LEFT JOIN users u2 on i.assigneeId = u2.id '
+            'WHERE i.id = ?')]
+        self.assertEqual((fetch['count'], fetch['rows']), (2, 2))
+
+        update = report[
+            "UPDATE issues SET closed_datetime = CASE WHEN closed_datetime IS NULL THEN DATETIME(?) ELSE closed_datetime END, "
+            "version = (SELECT version + ? FROM data_versions WHERE name = ?) WHERE id = ? AND (closed_datetime IS NULL)"]
+        self.assertEqual((update['count'], update['rows']), (2, 2))
+        self.assertEqual(report[
+            'INSERT INTO issues( title, description, creatorId, version ) '
+            'VALUES(?, ?, ?, (SELECT version + ? FROM data_versions WHERE name = ?))']['count'], 3)
+        self.assertTrue(all(statement['maxSeconds'] <= statement['totalSeconds'] for statement in report.values()))
+
+        out = StringIO()
+        tracer.dump(out)
+        self.assertEqual(len(out.getvalue().splitlines()), len(report) + 1)
+
+        tracer.reset()
+        self.assertEqual(tracer.report(), [])
+
+    def test_slow_query_log(self):
+        records = _Records()
+        slow_query_log.addHandler(records)
+        try:
+            self._run(SqlTracer(slow_threshold=float('inf')))
+            self.assertEqual(records.messages, [])
+            self._run(SqlTracer(slow_threshold=0))
+        finally:
+            slow_query_log.removeHandler(records)
+        self.assertTrue(records.messages)
+        # Without the parameters, which might be sensitive
+        self.assertTrue(any('UPDATE users SET uuid = ?' in message for message in records.messages))
+        self.assertFalse(any('pbkdf2' in message for message in records.messages))
+
+if __name__ == '__main__':
+    main()